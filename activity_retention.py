@@ -0,0 +1,115 @@
+"""
+Retention for the user_activities log.
+
+Raw activities older than ACTIVITY_RETENTION_DAYS are rolled into per-user
+daily counts by activity type (activity_daily_counts) and deleted. Each batch
+of ACTIVITY_COMPACTION_BATCH rows is its own short transaction, with a pause
+between batches, so the write-behind writer and page scripts only ever wait
+for one batch. Freed pages are then returned to the filesystem with
+PRAGMA incremental_vacuum, a bounded number at a time.
+
+db.get_activity_counts answers over raw and compacted days alike, and
+user_summary keeps counting compacted activities.
+
+Usage:
+    python activity_retention.py --days 90
+    python activity_retention.py --enable-incremental-vacuum   # once, on databases created before this
+"""
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+
+from db import (
+    compact_activity_batch, enable_incremental_vacuum, flush_pending_writes, get_activity_compaction_state,
+    incremental_vacuum,
+)
+
+# Load environment variables
+load_dotenv()
+
+ACTIVITY_RETENTION_DAYS = float(os.getenv('ACTIVITY_RETENTION_DAYS', '90'))
+ACTIVITY_COMPACTION_BATCH = int(os.getenv('ACTIVITY_COMPACTION_BATCH', '1000'))
+ACTIVITY_COMPACTION_PAUSE = float(os.getenv('ACTIVITY_COMPACTION_PAUSE', '0.05'))
+ACTIVITY_VACUUM_PAGES = int(os.getenv('ACTIVITY_VACUUM_PAGES', '1000'))
+
+
+def retention_cutoff(days, now=None):
+    """
+    Returns the 'YYYY-MM-DD HH:MM:SS' UTC time before which activities are compacted.
+    """
+    now = time.time() if now is None else now
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - days * 86400))
+
+
+def compact_activities(days=ACTIVITY_RETENTION_DAYS, batch_size=ACTIVITY_COMPACTION_BATCH,
+                       pause=ACTIVITY_COMPACTION_PAUSE, vacuum_pages=ACTIVITY_VACUUM_PAGES, max_batches=None):
+    """
+    Compacts raw activities older than `days` in batches, then vacuums.
+
+    Args:
+        days (float): Retention age of raw rows.
+        batch_size (int): Rows per transaction.
+        pause (float): Seconds to sleep between batches, leaving the write
+                       lock to other writers.
+        vacuum_pages (int): Pages released per incremental_vacuum step; 0
+                            skips vacuuming.
+        max_batches (int): Stop after this many batches (None = until done).
+
+    Returns:
+        dict: cutoff, rows, batches, pages_released and elapsed seconds.
+    """
+    started = time.perf_counter()
+    cutoff = retention_cutoff(days)
+    # Queued activities are committed first so they are compacted in order
+    flush_pending_writes()
+    rows = batches = 0
+    while max_batches is None or batches < max_batches:
+        compacted = compact_activity_batch(cutoff, batch_size)
+        if not compacted:
+            break
+        rows += compacted
+        batches += 1
+        if compacted < batch_size:
+            break
+        time.sleep(pause)
+    pages_released = 0
+    while vacuum_pages:
+        released = incremental_vacuum(vacuum_pages)
+        pages_released += released
+        if released < vacuum_pages:
+            break
+        time.sleep(pause)
+    return {'cutoff': cutoff, 'rows': rows, 'batches': batches, 'pages_released': pages_released,
+            'elapsed': time.perf_counter() - started}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Roll up and delete old user_activities rows.")
+    parser.add_argument('--days', type=float, default=ACTIVITY_RETENTION_DAYS, help="Keep raw rows this many days")
+    parser.add_argument('--batch-size', type=int, default=ACTIVITY_COMPACTION_BATCH, help="Rows per transaction")
+    parser.add_argument('--pause', type=float, default=ACTIVITY_COMPACTION_PAUSE, help="Seconds between batches")
+    parser.add_argument('--vacuum-pages', type=int, default=ACTIVITY_VACUUM_PAGES,
+                        help="Pages per incremental vacuum step (0 = no vacuum)")
+    parser.add_argument('--max-batches', type=int, help="Stop after this many batches")
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help="Convert the database to auto_vacuum = INCREMENTAL (full VACUUM) and exit")
+    args = parser.parse_args()
+
+    if args.enable_incremental_vacuum:
+        enable_incremental_vacuum()
+        print(f"auto_vacuum is now {get_activity_compaction_state()['auto_vacuum']} (2 = incremental)")
+        return
+
+    report = compact_activities(args.days, args.batch_size, args.pause, args.vacuum_pages, args.max_batches)
+    print(
+        f"Compacted {report['rows']:,} activities before {report['cutoff']} in {report['batches']:,} batches, "
+        f"released {report['pages_released']:,} pages in {report['elapsed']:.1f}s"
+    )
+    if args.vacuum_pages and get_activity_compaction_state()['auto_vacuum'] != 2:
+        print("Database is not in incremental auto_vacuum mode; run with --enable-incremental-vacuum once.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+import streamlit as st
+from metrics import get_gauges, get_summaries, render_prometheus
+from utils import verify_admin_session
+
+# Only operators listed in ADMIN_EMAILS may see this page
+verify_admin_session()
+
+st.title("📈 Operator Metrics")
+st.caption("Latencies are per process and cover calls since the app started.")
+
+summaries = get_summaries()
+if summaries:
+    st.subheader("Call latency")
+    rows = [
+        {
+            'Function': s['name'],
+            'Calls': s['count'],
+            'Errors': s['errors'],
+            'Error rate': f"{s['error_rate']:.2%}",
+            'Mean (ms)': round(s['mean'] * 1000, 3),
+            'p50 (ms)': round(s['p50'] * 1000, 3),
+            'p95 (ms)': round(s['p95'] * 1000, 3),
+            'p99 (ms)': round(s['p99'] * 1000, 3),
+            'Max (ms)': round(s['max'] * 1000, 3),
+        }
+        for s in summaries
+    ]
+    st.dataframe(rows, hide_index=True)
+else:
+    st.info("No instrumented calls have been recorded yet.")
+
+gauges = get_gauges()
+if gauges:
+    st.subheader("Pools and caches")
+    st.dataframe([{'Metric': name, 'Value': value} for name, value in sorted(gauges.items())], hide_index=True)
+
+st.download_button("Download Prometheus metrics", render_prometheus(), file_name="precision_health.prom",
+                   mime="text/plain")
@@ -1,6 +1,8 @@
 import streamlit as st
 from signup import signup_page, login_page
 from db import get_user_by_email
+from metrics import start_textfile_exporter
+from utils import is_admin
 #from first import login
 
 def login():
@@ -13,6 +15,9 @@ def login():
         signup_page()
 
 def main():
+    # Rewrites METRICS_TEXTFILE periodically when it is set
+    start_textfile_exporter()
+
     if 'logged_in' not in st.session_state:
         st.session_state['logged_in'] = False
 
@@ -36,10 +41,13 @@ def main():
         user = get_user_by_email(user_email)
 
 
-        page = st.navigation([
+        pages = [
             st.Page("dashboard.py", url_path='dashboard', title="Dashboard", icon="🩺"),
             st.Page("consultation.py", url_path='consultation', title="Consultation", icon="👩🏾‍⚕️"),
-        ])
+        ]
+        if is_admin(user_email):
+            pages.append(st.Page("admin_metrics.py", url_path='metrics', title="Metrics", icon="📈"))
+        page = st.navigation(pages)
         page.run()
 
 
@@ -0,0 +1,244 @@
+"""
+Nightly batch job that precomputes health recommendations for every user.
+
+Users are streamed from the users table in id-ordered pages and each one is
+sent to the model through `get_health_recommendations` (so identical
+profiles still share the response cache), with at most `concurrency` calls in
+flight and at most `rate` calls started per second. Users whose latest
+recommendation was generated for the same profile hash are skipped.
+
+Results are written in batches together with a checkpoint of the highest user
+id below which every user is done, so an interrupted run resumes from there.
+Batches are committed on a separate writer thread, one at a time in order, so
+model calls and the rate limiter keep running while SQLite commits. The
+checkpoint is cleared when a pass completes.
+
+Usage:
+    python batch_recommendations.py --concurrency 16 --rate 8
+"""
+import argparse
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db import (
+    clear_recommendation_checkpoint, get_latest_recommendation_hashes, get_recommendation_checkpoint,
+    iter_user_pages, save_recommendation_batch,
+)
+from llm import get_model
+from recommendations import get_health_recommendations, recommendation_cache_key
+
+DEFAULT_JOB = 'nightly'
+DEFAULT_CONCURRENCY = 8
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_COMMIT_SIZE = 100
+DEFAULT_RETRIES = 2
+
+
+class RateLimiter:
+    """
+    Spaces calls at least 1 / `rate` seconds apart (no limit when rate is 0).
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def _print_progress(progress):
+    print(
+        f"{progress['processed']:>10,} users  {progress['generated']:>8,} generated  "
+        f"{progress['skipped']:>8,} skipped  {progress['failed']:>6,} failed  "
+        f"{progress['users_per_sec']:>8,.1f} users/s"
+    )
+
+
+class BatchRun:
+    """
+    State of one run: running totals, the pending batch and the checkpoint frontier.
+
+    Users are registered in id order; results may complete in any order. A
+    user's row joins the write batch only once every earlier user is done, so
+    the checkpoint written with a batch never skips an unfinished user.
+    Batches are written by a single worker thread in the order they were
+    committed, so checkpoints never move backwards.
+    """
+
+    def __init__(self, job, counts, commit_size, progress):
+        self.job = job
+        self.counts = dict(counts)
+        self.commit_size = commit_size
+        self.progress = progress
+        self.started = time.perf_counter()
+        self.processed_this_run = 0
+        self._order = []  # user ids in id order, not yet flushed past the frontier
+        self._results = {}  # user_id -> row tuple, or None when nothing is written
+        self._batch = []
+        self._frontier = None
+        self._since_commit = 0
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='batch-db')
+        self._writes = []
+
+    def register(self, user_id):
+        self._order.append(user_id)
+
+    def finish(self, user_id, row, outcome):
+        self._results[user_id] = row
+        self.counts[outcome] += 1
+        self.counts['processed'] += 1
+        self.processed_this_run += 1
+        self._since_commit += 1
+        flushed = 0
+        while flushed < len(self._order) and self._order[flushed] in self._results:
+            done = self._order[flushed]
+            row = self._results.pop(done)
+            if row is not None:
+                self._batch.append(row)
+            self._frontier = done
+            flushed += 1
+        del self._order[:flushed]
+        if self._since_commit >= self.commit_size:
+            self.commit()
+
+    def commit(self):
+        """
+        Queues the pending rows and checkpoint for the writer thread.
+        """
+        if self._frontier is None:
+            return
+        # A failed earlier write is raised here rather than at the end of the run
+        for write in self._writes:
+            if write.done():
+                write.result()
+        self._writes = [write for write in self._writes if not write.done()]
+        self._writes.append(asyncio.get_running_loop().run_in_executor(
+            self._writer, save_recommendation_batch, self._batch, self.job, self._frontier, dict(self.counts),
+        ))
+        self._batch = []
+        self._since_commit = 0
+        if self.progress:
+            self.progress(self.report())
+
+    async def close(self):
+        """
+        Commits what is left and waits for every queued write.
+        """
+        self.commit()
+        try:
+            await asyncio.gather(*self._writes)
+        finally:
+            self._writer.shutdown()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            **self.counts,
+            'last_user_id': self._frontier,
+            'elapsed': elapsed,
+            'users_per_sec': self.processed_this_run / elapsed if elapsed else 0.0,
+        }
+
+
+async def _process(user, model, profile_hash, run, limiter, semaphore, retries):
+    try:
+        for attempt in range(retries + 1):
+            try:
+                await limiter.wait()
+                text, _ = await asyncio.to_thread(get_health_recommendations, user, model)
+                run.finish(user['id'], (user['id'], text, profile_hash), 'generated')
+                return
+            except Exception as e:
+                if attempt == retries:
+                    logging.error(f"Error generating recommendations for user {user['id']}: {e}")
+                    run.finish(user['id'], None, 'failed')
+                    return
+                await asyncio.sleep(2 ** attempt)
+    finally:
+        semaphore.release()
+
+
+async def run_batch_async(job=DEFAULT_JOB, model=None, concurrency=DEFAULT_CONCURRENCY, rate=0.0,
+                          page_size=DEFAULT_PAGE_SIZE, commit_size=DEFAULT_COMMIT_SIZE,
+                          retries=DEFAULT_RETRIES, restart=False, progress=_print_progress):
+    """
+    Generates recommendations for every user whose profile changed; see module docstring.
+
+    Returns:
+        dict: Final totals plus elapsed seconds and users/sec for this run.
+    """
+    model = model or get_model()
+    if restart:
+        clear_recommendation_checkpoint(job)
+    checkpoint = get_recommendation_checkpoint(job)
+    after_id = checkpoint['last_user_id'] if checkpoint else 0
+    counts = {'processed': 0, 'generated': 0, 'skipped': 0, 'failed': 0}
+    if checkpoint:
+        counts = {name: checkpoint[name] for name in counts}
+        print(f"Resuming job {job!r} after user {after_id} ({counts['processed']:,} users done)")
+
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch-llm'))
+    run = BatchRun(job, counts, commit_size, progress)
+    limiter = RateLimiter(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = set()
+
+    for page in iter_user_pages(page_size, after_id):
+        hashes = get_latest_recommendation_hashes([user['id'] for user in page])
+        for user in page:
+            run.register(user['id'])
+            profile_hash = recommendation_cache_key(user, model.name)
+            if hashes.get(user['id']) == profile_hash:
+                run.finish(user['id'], None, 'skipped')
+                continue
+            await semaphore.acquire()
+            task = asyncio.create_task(_process(user, model, profile_hash, run, limiter, semaphore, retries))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    await run.close()
+    clear_recommendation_checkpoint(job)
+    return run.report()
+
+
+def run_batch(**kwargs):
+    """
+    Synchronous wrapper around `run_batch_async`.
+    """
+    return asyncio.run(run_batch_async(**kwargs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute health recommendations for all users.")
+    parser.add_argument('--job', default=DEFAULT_JOB, help="Checkpoint name")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help="Model calls in flight")
+    parser.add_argument('--rate', type=float, default=0.0, help="Maximum model calls started per second (0 = no limit)")
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE)
+    parser.add_argument('--commit-size', type=int, default=DEFAULT_COMMIT_SIZE, help="Recommendations per transaction")
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES)
+    parser.add_argument('--restart', action='store_true', help="Ignore the saved checkpoint")
+    args = parser.parse_args()
+
+    report = run_batch(job=args.job, concurrency=args.concurrency, rate=args.rate, page_size=args.page_size,
+                       commit_size=args.commit_size, retries=args.retries, restart=args.restart)
+    print(
+        f"Done: {report['processed']:,} users ({report['generated']:,} generated, {report['skipped']:,} skipped, "
+        f"{report['failed']:,} failed) in {report['elapsed']:.1f}s, {report['users_per_sec']:,.1f} users/s"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Scaling benchmark for the serial and parallel claims loaders.
+
+Generates a synthetic extract from the HHealth_truncated.csv header, loads it
+once with claims_ingest and then with claims_parallel at each worker count,
+each into a fresh database. Every parallel load is checked against the serial
+one (row counts, amount totals and a checksum over claim lines) before its
+timing is reported.
+
+Usage:
+    python benchmarks/bench_claims_ingest.py --rows 500000 --workers 1 2 4 8
+"""
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_claims import REPO_ROOT, write_synthetic_claims
+
+LOAD_SCRIPT = '''
+import json, sys
+from claims_ingest import ingest_claims
+from claims_parallel import ingest_claims_parallel
+path, workers = sys.argv[1], int(sys.argv[2])
+if workers == 0:
+    report = ingest_claims(path, progress=None)
+else:
+    report = ingest_claims_parallel(path, workers=workers, progress=None)
+print(json.dumps(report))
+'''
+
+SUMMARY_SQL = {
+    'claim_lines': 'SELECT COUNT(*) FROM claim_lines',
+    'claim_diagnoses': 'SELECT COUNT(*) FROM claim_diagnoses',
+    'claim_procedures': 'SELECT COUNT(*) FROM claim_procedures',
+    'amt_billed': 'SELECT ROUND(SUM(amt_billed), 2) FROM claim_lines',
+    'amt_allowed': 'SELECT ROUND(SUM(amt_allowed), 2) FROM claim_lines',
+    'amt_paid': 'SELECT ROUND(SUM(amt_paid), 2) FROM claim_lines',
+    'rx_drug_cost': 'SELECT ROUND(SUM(rx_drug_cost), 2) FROM claim_lines',
+    'line_checksum': "SELECT SUM(id * length(claim_id_key || member_id || COALESCE(icd_list, ''))) FROM claim_lines "
+                     "LEFT JOIN (SELECT claim_line_id, group_concat(icd_code) AS icd_list FROM claim_diagnoses "
+                     "GROUP BY claim_line_id) ON claim_line_id = id",
+}
+
+
+def run_load(csv_path, db_path, workers):
+    env = dict(os.environ, SQLITE_DB_PATH=db_path, WRITE_BEHIND_ENABLED='0')
+    result = subprocess.run(
+        [sys.executable, '-c', LOAD_SCRIPT, csv_path, str(workers)],
+        cwd=REPO_ROOT, env=env, check=True, capture_output=True, text=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return {name: conn.execute(sql).fetchone()[0] for name, sql in SUMMARY_SQL.items()}
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark serial vs parallel claims ingestion.")
+    parser.add_argument('--rows', type=int, default=500_000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--csv', help="Existing extract to load instead of generating one")
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = args.csv or write_synthetic_claims(os.path.join(tmp, 'claims.csv'), args.rows)
+        size_mb = os.path.getsize(csv_path) / (1024 * 1024)
+
+        serial_db = os.path.join(tmp, 'serial.db')
+        serial = run_load(csv_path, serial_db, 0)
+        expected = summarize(serial_db)
+        results = [{'mode': 'serial', 'workers': 0, 'rows_per_sec': serial['rows_per_sec'],
+                    'elapsed': serial['elapsed'], 'matches_serial': True}]
+        print(f"{'mode':<10}{'workers':>8}{'seconds':>10}{'rows/s':>14}{'speedup':>9}  match")
+        print(f"{'serial':<10}{0:>8}{serial['elapsed']:>10.2f}{serial['rows_per_sec']:>14,.0f}{1.0:>9.2f}  yes")
+
+        for workers in args.workers:
+            db_path = os.path.join(tmp, f'parallel_{workers}.db')
+            report = run_load(csv_path, db_path, workers)
+            matches = summarize(db_path) == expected
+            speedup = serial['elapsed'] / report['elapsed'] if report['elapsed'] else 0.0
+            results.append({'mode': 'parallel', 'workers': workers, 'rows_per_sec': report['rows_per_sec'],
+                            'elapsed': report['elapsed'], 'speedup': speedup, 'matches_serial': matches})
+            print(f"{'parallel':<10}{workers:>8}{report['elapsed']:>10.2f}{report['rows_per_sec']:>14,.0f}"
+                  f"{speedup:>9.2f}  {'yes' if matches else 'NO'}")
+
+    summary = {'rows': expected['claim_lines'], 'file_mb': round(size_mb, 1),
+               'cpu_count': os.cpu_count(), 'totals': expected, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    if not all(r['matches_serial'] for r in results):
+        sys.exit("Parallel output differs from the serial loader.")
+
+
+if __name__ == '__main__':
+    main()
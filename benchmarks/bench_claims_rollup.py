@@ -0,0 +1,99 @@
+"""
+Throughput benchmark for claims_rollup on synthetic encoded claim arrays.
+
+Arrays are generated directly in their encoded form (the shape a ClaimsStore
+hands to the engine), so the benchmark measures aggregation only. With
+--check, a pandas groupby over the same data verifies the member-month sums,
+and a one-member case checks that the trailing 12-month percentiles count a
+member in months without claims of their own.
+
+Usage:
+    python benchmarks/bench_claims_rollup.py --rows 10000000 --members 500000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from claims_rollup import ROLLUP_AMOUNTS, rollup
+
+
+def synthetic_arrays(rows, members, months=36, settings=5, lobs=5, seed=0):
+    rng = np.random.default_rng(seed)
+    month = rng.integers(0, months, rows)
+    yearmo = ((2021 + month // 12) * 100 + month % 12 + 1).astype(np.int32)
+    return {
+        'member': rng.integers(0, members, rows, dtype=np.int32),
+        'yearmo': yearmo,
+        'setting': rng.integers(0, settings, rows, dtype=np.int8),
+        'lob': rng.integers(0, lobs, rows, dtype=np.int8),
+        'amounts': {name: rng.lognormal(4.5, 1.5, rows).astype(np.float32) for name in ROLLUP_AMOUNTS},
+    }
+
+
+def check(data, result):
+    import pandas as pd
+
+    frame = pd.DataFrame({'member': data['member'], 'yearmo': data['yearmo'],
+                          'paid': data['amounts']['AMT_PAID'].astype(np.float64)})
+    expected = frame.groupby(['member', 'yearmo'], sort=True)['paid'].sum()
+    return bool(np.allclose(expected.to_numpy(), result.member_month['AMT_PAID']))
+
+
+def check_window_percentiles():
+    # Claims in 202201, 202206 and 202301: the member's trailing total is
+    # 100 through 202205 and 150 through 202212, although no claim falls there
+    result = rollup([0, 0, 0], [202201, 202206, 202301], [0, 0, 0], [0, 0, 0],
+                    {'AMT_PAID': np.array([100.0, 50.0, 10.0])})
+    percentiles = result.percentiles
+    return (percentiles['yearmo'].tolist() == [202201 + i for i in range(12)] + [202301]
+            and percentiles['members'].tolist() == [1] * 13
+            and percentiles['p50'].tolist() == [100.0] * 5 + [150.0] * 7 + [60.0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the claims rollup engine.")
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--members', type=int, default=500_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--check', action='store_true', help="Verify against a pandas groupby")
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    data = synthetic_arrays(args.rows, args.members)
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        result = rollup(data['member'], data['yearmo'], data['setting'], data['lob'], data['amounts'])
+        timings.append(time.perf_counter() - started)
+
+    best = min(timings)
+    summary = {
+        'rows': args.rows,
+        'members': args.members,
+        'groups': int(len(result.detail['member'])),
+        'member_months': int(len(result.member_month['member'])),
+        'best_seconds': best,
+        'rows_per_sec': args.rows / best,
+        'timings': timings,
+    }
+    if args.check:
+        summary['matches_pandas'] = check(data, result)
+        summary['window_percentiles_ok'] = check_window_percentiles()
+    print(f"{args.rows:,} rows -> {summary['groups']:,} groups, {summary['member_months']:,} member-months")
+    print(f"best of {args.repeat}: {best:.2f}s  ({summary['rows_per_sec']:,.0f} rows/s)")
+    if args.check:
+        print(f"matches pandas groupby: {summary['matches_pandas']}")
+        print(f"trailing-window percentiles: {'ok' if summary['window_percentiles_ok'] else 'WRONG'}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
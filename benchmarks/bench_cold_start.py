@@ -0,0 +1,182 @@
+"""
+Cold-start benchmark and startup budget check for the Streamlit entry points.
+
+Each target runs in a fresh interpreter against a scratch database with one
+logged-in user. After importing streamlit (shared by every page, reported
+separately) the child times:
+
+    import_seconds        importing the page's own top-level imports
+    first_render_seconds  the first AppTest run of the page
+    rerender_seconds      a second run, i.e. a warm rerun
+
+and records which of HEAVY_MODULES were loaded by the end of the first run.
+With --check the process exits non-zero when any page exceeds its BUDGETS
+entry (times scaled by --scale for slower machines) or loads a module its
+budget forbids at startup.
+
+Usage:
+    python benchmarks/bench_cold_start.py --check
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules whose import cost matters at startup
+HEAVY_MODULES = ['google.generativeai', 'pandas', 'plotly.graph_objects', 'plotly.express', 'bs4', 'requests']
+
+BUDGETS = {
+    'app.py': {
+        'import_seconds': 0.3,
+        'first_render_seconds': 1.0,
+        'forbidden_modules': ['google.generativeai', 'pandas', 'plotly.express', 'bs4', 'requests'],
+    },
+    'dashboard.py': {
+        'import_seconds': 0.3,
+        'first_render_seconds': 1.0,
+        'forbidden_modules': ['google.generativeai', 'pandas', 'plotly.express', 'bs4', 'requests'],
+    },
+    'consultation.py': {
+        'import_seconds': 0.3,
+        'first_render_seconds': 2.5,
+        'forbidden_modules': ['google.generativeai', 'plotly.express', 'bs4', 'requests'],
+    },
+}
+
+CHILD_SCRIPT = '''
+import ast, importlib, json, sys, time
+page, logged_in = sys.argv[1], sys.argv[2] == '1'
+heavy = json.loads(sys.argv[3])
+
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+streamlit_seconds = time.perf_counter() - started
+
+with open(page) as f:
+    tree = ast.parse(f.read())
+modules = []
+for node in tree.body:
+    if isinstance(node, ast.Import):
+        modules += [alias.name for alias in node.names]
+    elif isinstance(node, ast.ImportFrom) and node.level == 0:
+        modules.append(node.module)
+
+errors = []
+started = time.perf_counter()
+for module in modules:
+    try:
+        importlib.import_module(module)
+    except BaseException as e:
+        errors.append(f"import {module}: {type(e).__name__}: {e}")
+import_seconds = time.perf_counter() - started
+
+at = AppTest.from_file(page, default_timeout=120)
+if logged_in:
+    at.session_state['logged_in'] = True
+    at.session_state['email'] = 'bench@example.com'
+started = time.perf_counter()
+at.run()
+first_render_seconds = time.perf_counter() - started
+loaded = [name for name in heavy if name in sys.modules]
+
+started = time.perf_counter()
+at.run()
+rerender_seconds = time.perf_counter() - started
+
+print(json.dumps({
+    'streamlit_seconds': streamlit_seconds,
+    'import_seconds': import_seconds,
+    'first_render_seconds': first_render_seconds,
+    'rerender_seconds': rerender_seconds,
+    'loaded_modules': loaded,
+    'exceptions': errors + [str(e.value) for e in at.exception],
+}))
+'''
+
+SEED_SCRIPT = '''
+from db import create_user
+create_user('Bench', 'bench@example.com', 'pw', 40, 'Female', 165, 70, '', 'stay fit')
+'''
+
+
+def _environment(db_path):
+    return dict(
+        os.environ,
+        SQLITE_DB_PATH=db_path,
+        LLM_BACKEND='fake',
+        TRENDS_REFRESH_ENABLED='0',
+        WRITE_BEHIND_ENABLED='0',
+    )
+
+
+def measure(page, db_path):
+    """
+    Runs one cold start of `page` in a fresh interpreter and returns its timings.
+    """
+    logged_in = page != 'app.py'
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD_SCRIPT, page, '1' if logged_in else '0', json.dumps(HEAVY_MODULES)],
+        cwd=REPO_ROOT, env=_environment(db_path), check=True, capture_output=True, text=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def check_budget(page, result, scale=1.0):
+    """
+    Returns a list of budget violations (empty when the page is within budget).
+    """
+    budget = BUDGETS.get(page, {})
+    violations = []
+    for metric in ('import_seconds', 'first_render_seconds'):
+        if metric in budget and result[metric] > budget[metric] * scale:
+            violations.append(f"{page}: {metric} {result[metric]:.3f}s > {budget[metric] * scale:.3f}s")
+    for module in budget.get('forbidden_modules', []):
+        if module in result['loaded_modules']:
+            violations.append(f"{page}: {module} imported during cold start")
+    for error in result['exceptions']:
+        violations.append(f"{page}: raised {error}")
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start time of the Streamlit pages.")
+    parser.add_argument('pages', nargs='*', default=list(BUDGETS))
+    parser.add_argument('--repeat', type=int, default=3, help="Cold starts per page; the fastest is reported")
+    parser.add_argument('--check', action='store_true', help="Exit non-zero when a budget is exceeded")
+    parser.add_argument('--scale', type=float, default=float(os.getenv('COLD_START_BUDGET_SCALE', '1.0')),
+                        help="Multiplier applied to the time budgets")
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        subprocess.run([sys.executable, '-c', SEED_SCRIPT], cwd=REPO_ROOT, env=_environment(db_path), check=True,
+                       capture_output=True)
+        for page in args.pages:
+            runs = [measure(page, db_path) for _ in range(args.repeat)]
+            best = min(runs, key=lambda r: r['import_seconds'] + r['first_render_seconds'])
+            results[page] = best
+
+    print(f"{'page':<18}{'streamlit':>10}{'imports':>10}{'1st run':>10}{'rerun':>10}  heavy modules loaded")
+    for page, r in results.items():
+        print(f"{page:<18}{r['streamlit_seconds']:>10.3f}{r['import_seconds']:>10.3f}"
+              f"{r['first_render_seconds']:>10.3f}{r['rerender_seconds']:>10.3f}  {', '.join(r['loaded_modules']) or '-'}")
+
+    violations = [v for page, r in results.items() for v in check_budget(page, r, args.scale)]
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'results': results, 'budgets': BUDGETS, 'scale': args.scale, 'violations': violations},
+                      f, indent=2)
+    if args.check:
+        if violations:
+            sys.exit("Startup budget exceeded:\n  " + "\n  ".join(violations))
+        print("All pages within the startup budget.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Benchmark for the paged history and full-text search APIs in db.py.
+
+Seeds a scratch database with one heavy user owning --rows consultations and
+recommendations, plus --others users sharing the same number of rows between
+them, so searches have to ignore other users' matches. It then checks that
+walking every page of the heavy user's consultations returns each row once, in
+order, and that searches only return that user's rows, before timing:
+
+    full_log         get_consultation_log (every row, the old access path)
+    first_page       get_consultation_history, first page
+    deep_page        the page after a cursor half way through the history
+    search_common    search_consultations for a word in most rows
+    search_rare      search_consultations for a word in ~0.1% of rows
+    search_prefix    search_consultations for a prefix (search-as-you-type)
+    search_recs      search_recommendations for a common word
+
+Usage:
+    python benchmarks/bench_history.py --rows 100000 --others 1000
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_claims import REPO_ROOT
+
+CHILD_SCRIPT = '''
+import json, random, sys, time
+rows, others, repeat, seed = (int(value) for value in sys.argv[1:5])
+import db
+
+rng = random.Random(seed)
+words = ['sleep', 'stress', 'diet', 'exercise', 'blood', 'pressure', 'sugar', 'headache', 'fatigue', 'water',
+         'walking', 'vitamin', 'asthma', 'inhaler', 'medication', 'dose', 'morning', 'evening', 'heart', 'rate']
+
+def text(length, rare):
+    chosen = [rng.choice(words) for _ in range(length)] + ['health']
+    if rare:
+        chosen.append('zinc')
+    rng.shuffle(chosen)
+    return ' '.join(chosen)
+
+def stamp(i):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(1_600_000_000 + i * 60))
+
+db.create_user('Heavy', 'heavy@example.com', 'pw', 40, 'Female', 165, 70, 'asthma', 'stay fit')
+heavy = db.get_user_by_email('heavy@example.com')['id']
+with db.get_db_connection() as conn:
+    conn.executemany(
+        'INSERT INTO users (name, email, password) VALUES (?, ?, ?)',
+        [(f'Other {i}', f'other{i}@example.com', 'pw') for i in range(others)],
+    )
+    ids = [row[0] for row in conn.execute('SELECT id FROM users WHERE id != ?', (heavy,))]
+    started = time.perf_counter()
+    for user_ids in ([heavy] * rows, [rng.choice(ids) for _ in range(rows)]):
+        conn.executemany(
+            'INSERT INTO consultations (user_id, question, response, created_at) VALUES (?, ?, ?, ?)',
+            [(user_id, text(8, i % 1000 == 0), text(60, False), stamp(i)) for i, user_id in enumerate(user_ids)],
+        )
+        conn.executemany(
+            'INSERT INTO recommendations (user_id, health_recommendation, created_at) VALUES (?, ?, ?)',
+            [(user_id, text(80, False), stamp(i)) for i, user_id in enumerate(user_ids)],
+        )
+    seed_seconds = time.perf_counter() - started
+
+# Correctness: every row once, newest first; searches stay within the user
+seen, before, pages, middle = [], None, 0, None
+while True:
+    page, before = db.get_consultation_history(heavy, 100, before)
+    seen += [(row['created_at'], row['id']) for row in page]
+    pages += 1
+    if pages == rows // 200:
+        middle = before
+    if before is None:
+        break
+assert len(seen) == rows == len(set(seen)), (len(seen), rows)
+assert seen == sorted(seen, reverse=True)
+owned = {row['id'] for row in db.get_consultation_log(heavy)}
+for query in ('zinc', 'health', 'headac'):
+    assert all(row['id'] in owned for row in db.search_consultations(heavy, query, 50))
+rare = db.search_consultations(heavy, 'zinc', 1000)
+assert len(rare) == len(range(0, rows, 1000)), len(rare)
+assert '<mark>zinc</mark>' in rare[0]['question_highlight']
+
+cases = {
+    'full_log': lambda: db.get_consultation_log(heavy),
+    'first_page': lambda: db.get_consultation_history(heavy),
+    'deep_page': lambda: db.get_consultation_history(heavy, before=middle),
+    'search_common': lambda: db.search_consultations(heavy, 'blood pressure'),
+    'search_rare': lambda: db.search_consultations(heavy, 'zinc'),
+    'search_prefix': lambda: db.search_consultations(heavy, 'head'),
+    'search_recs': lambda: db.search_recommendations(heavy, 'vitamin'),
+}
+results = {'seed_seconds': seed_seconds}
+for name, call in cases.items():
+    call()
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - started)
+    times.sort()
+    results[name] = times[len(times) // 2]
+print(json.dumps(results))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark paged history and full-text search.")
+    parser.add_argument('--rows', type=int, default=100_000, help="Consultations and recommendations of the heavy user")
+    parser.add_argument('--others', type=int, default=1000, help="Other users sharing as many rows again")
+    parser.add_argument('--repeat', type=int, default=20, help="Timed calls per case; the median is reported")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    import json
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, SQLITE_DB_PATH=os.path.join(tmp, 'history.db'), WRITE_BEHIND_ENABLED='0')
+        result = subprocess.run(
+            [sys.executable, '-c', CHILD_SCRIPT, str(args.rows), str(args.others), str(args.repeat), str(args.seed)],
+            cwd=REPO_ROOT, env=env, check=True, capture_output=True, text=True,
+        )
+    results = json.loads(result.stdout.strip().splitlines()[-1])
+    print(f"seeded {2 * args.rows:,} consultations and recommendations in {results.pop('seed_seconds'):.1f}s")
+    for name, seconds in results.items():
+        print(f"{name:<16}{seconds * 1000:>10.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
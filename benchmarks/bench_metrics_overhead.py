@@ -0,0 +1,115 @@
+"""
+Overhead of the metrics instrumentation on DB calls and page reruns.
+
+Runs the same workload in two fresh interpreters, with METRICS_ENABLED=1 and
+METRICS_ENABLED=0, against scratch databases:
+
+    db_mix     a read-heavy mix of instrumented db.py calls (cached and
+               uncached user reads, latest plan, consultation log, trends,
+               one plan insert per ten operations)
+    rerun      warm AppTest reruns of dashboard.py
+
+and reports the per-operation time of each and the relative overhead. The
+two configurations alternate for --rounds rounds and the fastest result of
+each is kept, so drift on a noisy machine affects both sides alike.
+
+Usage:
+    python benchmarks/bench_metrics_overhead.py --ops 50000 --max-overhead 0.01
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD_SCRIPT = '''
+import json, sys, time
+ops, reruns = int(sys.argv[1]), int(sys.argv[2])
+import db
+db.create_user('Bench', 'bench@example.com', 'pw', 40, 'Female', 165, 70, 'asthma', 'stay fit')
+user = db.get_user_by_email('bench@example.com')
+for _ in range(20):
+    db.create_plan(user['id'], 'plan')
+    db.create_consultation_log(user['id'], 'question', 'answer')
+db.flush_pending_writes()
+
+def mix(i):
+    step = i % 10
+    if step < 3:
+        db.get_user_by_email('bench@example.com')
+    elif step < 5:
+        db.get_user_by_id(user['id'])
+    elif step < 7:
+        db.get_latest_plan(user['id'])
+    elif step == 7:
+        db.get_consultation_log(user['id'])
+    elif step == 8:
+        db.get_trending_topics()
+    else:
+        db.create_plan(user['id'], 'plan')
+
+best = None
+for _ in range(5):
+    started = time.perf_counter()
+    for i in range(ops):
+        mix(i)
+    elapsed = (time.perf_counter() - started) / ops
+    best = elapsed if best is None else min(best, elapsed)
+
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file('dashboard.py', default_timeout=120)
+at.session_state['logged_in'] = True
+at.session_state['email'] = 'bench@example.com'
+at.run()
+times = []
+for _ in range(reruns):
+    started = time.perf_counter()
+    at.run()
+    times.append(time.perf_counter() - started)
+times.sort()
+print(json.dumps({'db_mix': best, 'rerun': times[len(times) // 2]}))
+'''
+
+
+def run(enabled, ops, reruns, tmp):
+    env = dict(os.environ, SQLITE_DB_PATH=os.path.join(tmp, f'metrics_{enabled}_{os.urandom(4).hex()}.db'), METRICS_ENABLED=enabled,
+               LLM_BACKEND='fake', TRENDS_REFRESH_ENABLED='0')
+    result = subprocess.run([sys.executable, '-c', CHILD_SCRIPT, str(ops), str(reruns)], cwd=REPO_ROOT, env=env,
+                            check=True, capture_output=True, text=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure metrics instrumentation overhead.")
+    parser.add_argument('--ops', type=int, default=50_000, help="DB operations per timed pass")
+    parser.add_argument('--reruns', type=int, default=30, help="Dashboard reruns to time")
+    parser.add_argument('--rounds', type=int, default=3, help="Alternating off/on runs; the fastest is kept")
+    parser.add_argument('--max-overhead', type=float, help="Exit non-zero if db_mix overhead exceeds this fraction")
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    off, on = {}, {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for _ in range(args.rounds):
+            for enabled, best in (('0', off), ('1', on)):
+                for name, seconds in run(enabled, args.ops, args.reruns, tmp).items():
+                    best[name] = min(best.get(name, seconds), seconds)
+
+    results = {}
+    print(f"{'workload':<10}{'off':>14}{'on':>14}{'overhead':>10}")
+    for name in ('db_mix', 'rerun'):
+        overhead = on[name] / off[name] - 1
+        results[name] = {'off_seconds': off[name], 'on_seconds': on[name], 'overhead': overhead}
+        print(f"{name:<10}{off[name] * 1e6:>12.2f}us{on[name] * 1e6:>12.2f}us{overhead:>10.2%}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.max_overhead is not None and results['db_mix']['overhead'] > args.max_overhead:
+        sys.exit(f"db_mix overhead {results['db_mix']['overhead']:.2%} exceeds {args.max_overhead:.2%}")
+
+
+if __name__ == '__main__':
+    main()
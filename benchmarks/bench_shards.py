@@ -0,0 +1,129 @@
+"""
+Benchmark for write throughput against 1, 2, 4 and 8 SQLite shards.
+
+For each shard count a fresh SQLITE_SHARD_DIR gets --users accounts, then
+--writers processes (like separate Streamlit servers) each run create_plan
+for random users for --seconds, one transaction per call. With one file every
+commit queues behind the same write lock; with n shards up to n commits
+proceed at once, and their fsyncs overlap, so commits/s should grow with the
+shard count until the disk or CPU is the limit. SQLITE_SYNCHRONOUS defaults
+to FULL here so each commit waits on the disk, as it would on a server that
+cannot afford to lose one.
+
+Each run also times a cross-shard scan_shards count and checks every plan
+written is on its user's shard.
+
+Usage:
+    python benchmarks/bench_shards.py --writers 8 --seconds 5
+    python benchmarks/bench_shards.py --shards 1 4 16 --synchronous NORMAL
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_claims import REPO_ROOT
+
+SETUP_SCRIPT = '''
+import sys
+import db
+users = int(sys.argv[1])
+db.create_users_bulk([{'name': f'User {i}', 'email': f'user{i}@clinic.example', 'password': 'pw', 'age': 40,
+                       'height': 170, 'weight': 70} for i in range(users)])
+print(db.get_shard_layout()['shard_count'])
+'''
+
+WRITER_SCRIPT = '''
+import json, random, sqlite3, sys, time
+users, start, seconds, seed = int(sys.argv[1]), float(sys.argv[2]), float(sys.argv[3]), int(sys.argv[4])
+import db
+rng = random.Random(seed)
+db.get_user_by_id(1)  # opens the pools before the clock starts
+time.sleep(max(0.0, start - time.time()))
+commits = busy = 0
+deadline = time.time() + seconds
+while time.time() < deadline:
+    try:
+        db.create_plan(rng.randint(1, users), 'Walk 30 minutes a day and sleep 8 hours.')
+        commits += 1
+    except sqlite3.OperationalError:
+        busy += 1
+print(json.dumps({'commits': commits, 'busy': busy}))
+'''
+
+CHECK_SCRIPT = '''
+import json, time
+import db
+started = time.perf_counter()
+plans = sum(row[0] for row in db.scan_shards('SELECT COUNT(*) FROM user_plans'))
+scan_ms = (time.perf_counter() - started) * 1000
+misplaced = sum(row[0] for row in db.scan_shards('SELECT COUNT(*) FROM user_plans WHERE user_id NOT IN (SELECT id FROM users)'))
+print(json.dumps({'plans': plans, 'scan_ms': scan_ms, 'misplaced': misplaced}))
+'''
+
+
+def run(script, env, *args):
+    result = subprocess.run([sys.executable, '-c', script, *map(str, args)],
+                            cwd=REPO_ROOT, env=env, check=True, capture_output=True, text=True)
+    return result.stdout.strip().splitlines()[-1]
+
+
+def bench(shards, args):
+    """
+    Returns commits/s, busy errors and the check results for one shard count.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, SQLITE_SHARD_DIR=os.path.join(tmp, 'shards'), SQLITE_SHARDS=str(shards),
+                   SQLITE_SYNCHRONOUS=args.synchronous, WRITE_BEHIND_ENABLED='0')
+        run(SETUP_SCRIPT, env, args.users)
+        # Writers start together once all of them have imported db
+        start = time.time() + 2.0 + 0.2 * args.writers
+        writers = [
+            subprocess.Popen([sys.executable, '-c', WRITER_SCRIPT, str(args.users), str(start), str(args.seconds),
+                              str(seed)], cwd=REPO_ROOT, env=env, stdout=subprocess.PIPE, text=True)
+            for seed in range(args.writers)
+        ]
+        counts = []
+        for writer in writers:
+            out, _ = writer.communicate()
+            if writer.returncode:
+                sys.exit(f"writer exited with {writer.returncode}")
+            counts.append(json.loads(out.strip().splitlines()[-1]))
+        check = json.loads(run(CHECK_SCRIPT, env))
+    commits = sum(c['commits'] for c in counts)
+    return {'shards': shards, 'commits': commits, 'per_sec': commits / args.seconds,
+            'busy': sum(c['busy'] for c in counts), **check}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark write throughput against N SQLite shards.")
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8], help="Shard counts to compare")
+    parser.add_argument('--users', type=int, default=2000, help="Users spread across the shards")
+    parser.add_argument('--writers', type=int, default=8, help="Concurrent writer processes")
+    parser.add_argument('--seconds', type=float, default=5.0, help="Write time per shard count")
+    parser.add_argument('--synchronous', default='FULL', help="PRAGMA synchronous for the run")
+    args = parser.parse_args()
+
+    print(f"{args.writers} writers, {args.users:,} users, synchronous={args.synchronous}, {os.cpu_count()} CPUs")
+    baseline = None
+    failed = False
+    for shards in args.shards:
+        result = bench(shards, args)
+        baseline = baseline or result['per_sec']
+        print(f"{shards:>3} shards {result['per_sec']:>10,.0f} commits/s ({result['per_sec'] / baseline:.2f}x) "
+              f"{result['busy']:>5} busy  scan_shards {result['scan_ms']:>6.1f} ms")
+        if result['plans'] != result['commits'] or result['misplaced']:
+            print(f"    MISMATCH: {result['commits']:,} commits, {result['plans']:,} plans, "
+                  f"{result['misplaced']:,} on the wrong shard")
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,459 @@
+"""
+Reproducible benchmark suite for db.py and the Streamlit page renders.
+
+Seeds a scratch SQLite database with --users users and --history rows in
+each history table (plans, workouts, consultations, doctor visits,
+recommendations, activities), spread over the users with a fixed seed. Then:
+
+    db     every public function in db.py (see db_cases) is called
+           --iterations times with varying arguments; per-call latency gives
+           ops/sec, mean, p50 and p99. Argument preparation (e.g. dropping
+           a user from the cache for the "[uncached]" variants) is not timed.
+    pages  dashboard.py and consultation.py are rendered through AppTest:
+           the first run and --renders warm reruns (p50, p99).
+
+The model is the fake backend and the trends page and PubMed E-utilities are
+served by the fixtures in this directory, so no network access is needed.
+A db.py function without a case (and not in NOT_BENCHMARKED) fails the run,
+so new functions get measured from the start.
+
+Results are written as JSON with --output. --baseline FILE compares the run
+against an earlier result, and --compare OLD NEW compares two result files
+without running anything. Both exit non-zero when a p50 or p99 regresses by
+more than its threshold (and by more than --min-delta, so microsecond noise
+is not flagged).
+
+Usage:
+    python benchmarks/bench_suite.py --output baseline.json
+    python benchmarks/bench_suite.py --baseline baseline.json --output current.json
+    python benchmarks/bench_suite.py --compare baseline.json current.json
+"""
+import argparse
+import inspect
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_claims import REPO_ROOT
+
+HISTORY_TABLES = ['user_plans', 'workouts', 'consultations', 'doctor_visits', 'recommendations', 'user_activities']
+
+# Connection, schema and statistics helpers rather than data access paths
+NOT_BENCHMARKED = {
+    'get_db_connection', 'get_pool_stats', 'close_db_connections', 'flush_pending_writes', 'get_write_behind_stats',
+    'get_schema_version', 'apply_migrations', 'ensure_schema', 'create_tables', 'invalidate_user_cache',
+    'get_user_cache_stats', 'register_collector', 'timed', 'main', 'get_activity_compaction_state',
+    'incremental_vacuum', 'enable_incremental_vacuum',
+    # Shard layout and rebalancing, which need sharded storage (see bench_shards.py)
+    'shard_path', 'get_shard_layout', 'set_shard_count', 'get_directory_page', 'move_users', 'sweep_shard',
+    'import_single_database',
+}
+
+PAGES = ['dashboard.py', 'consultation.py']
+
+
+def percentile(sorted_values, q):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    return {
+        'iterations': len(latencies),
+        'ops_per_sec': len(latencies) / total if total else None,
+        'mean_seconds': total / len(latencies),
+        'p50_seconds': percentile(latencies, 0.5),
+        'p99_seconds': percentile(latencies, 0.99),
+    }
+
+
+def seed_database(db, users, history, rng):
+    """
+    Bulk-loads users and history rows; returns the seeded user ids and emails.
+    """
+    from medications import MEDICATION_INDEX
+
+    conditions = sorted(MEDICATION_INDEX.conditions)
+    now = time.time()
+
+    def timestamp():
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - rng.uniform(0, 365 * 86400)))
+
+    user_rows = [
+        (f'User {i}', f'user{i}@example.com', 'pw', rng.randint(18, 90), rng.choice(['Female', 'Male']),
+         rng.uniform(150, 200), rng.uniform(45, 120), ', '.join(rng.sample(conditions, 2)), 'stay fit')
+        for i in range(users)
+    ]
+    with db.get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO users (name, email, password, age, gender, height, weight, medical_conditions, health_goals)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', user_rows)
+        cursor.execute('SELECT id, email FROM users ORDER BY id')
+        seeded = [(row['id'], row['email']) for row in cursor.fetchall()]
+        ids = [user_id for user_id, _ in seeded]
+
+        statements = {
+            'user_plans': ('INSERT INTO user_plans (user_id, lifestyle_plan, created_at) VALUES (?, ?, ?)',
+                           lambda: ('Walk 30 minutes a day. ' * 8, timestamp())),
+            'workouts': ('INSERT INTO workouts (user_id, workout_plan, created_at) VALUES (?, ?, ?)',
+                         lambda: ('3 sets of 12 squats. ' * 8, timestamp())),
+            'consultations': ('INSERT INTO consultations (user_id, question, response, created_at) VALUES (?, ?, ?, ?)',
+                              lambda: ('How should I manage my condition?', 'Stay active and eat well. ' * 10,
+                                       timestamp())),
+            'doctor_visits': ('INSERT INTO doctor_visits (user_id, visit_reason, appointment_date, created_at) '
+                              'VALUES (?, ?, ?, ?)', lambda: ('Checkup', timestamp(), timestamp())),
+            'recommendations': ('INSERT INTO recommendations (user_id, health_recommendation, profile_hash, created_at) '
+                                'VALUES (?, ?, ?, ?)', lambda: ('Drink more water. ' * 10, None, timestamp())),
+            'user_activities': ('INSERT INTO user_activities (user_id, activity_description, timestamp) '
+                                'VALUES (?, ?, ?)', lambda: ('Viewed dashboard', timestamp())),
+        }
+        for table in HISTORY_TABLES:
+            sql, values = statements[table]
+            cursor.executemany(sql, [(rng.choice(ids), *values()) for _ in range(history)])
+        conn.commit()
+    return seeded
+
+
+def _first_page(db, page_size, after_id):
+    pages = db.iter_user_pages(page_size, after_id)
+    try:
+        return next(pages, [])
+    finally:
+        pages.close()
+
+
+def _first_exports(db, count, include_passwords):
+    records = db.iter_user_export(count, include_passwords)
+    try:
+        return list(itertools.islice(records, count))
+    finally:
+        records.close()
+
+
+def db_cases(db, seeded, rng):
+    """
+    Returns (name, function, prepare) triples; `prepare(i)` returns the
+    argument tuple for call i and runs untimed.
+    """
+    ids = [user_id for user_id, _ in seeded]
+    emails = [email for _, email in seeded]
+    new_users = itertools.count()
+    topics = [{'topic_name': f'topic {i}', 'search_volume': '10K+', 'explore_link': f'https://example.com/{i}'}
+              for i in range(25)]
+    pubmed_keys = [f'medication {i}' for i in range(200)]
+    db.save_cached_pubmed({key: json.dumps({'medication': key, 'count': 1, 'articles': []}) for key in pubmed_keys})
+    llm_keys = [f'prompt-{i}' for i in range(500)]
+    for key in llm_keys:
+        db.save_cached_llm_response(key, 'fake', 'Drink more water. ' * 20, 10_000)
+    db.save_trending_topics(topics, time.time(), 0)
+    db.save_trends_refresh_state('bench', time.time(), True)
+    counts = {'processed': 1, 'generated': 1, 'skipped': 0, 'failed': 0}
+    # A year of daily weights per user, so series reads pick day or week rollups
+    now = int(time.time())
+    with db.get_db_connection() as conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO body_measurements (user_id, metric, measured_at, value) VALUES (?, ?, ?, ?)',
+            [(user_id, 'weight', now - day * 86400, rng.uniform(50, 110)) for user_id in ids for day in range(365)],
+        )
+
+    def user_id(i):
+        return (rng.choice(ids),)
+
+    def uncached_id(i):
+        chosen = rng.choice(ids)
+        db.invalidate_user_cache(user_id=chosen)
+        return (chosen,)
+
+    def uncached_email(i):
+        chosen = rng.choice(emails)
+        db.invalidate_user_cache(email=chosen)
+        return (chosen,)
+
+    return [
+        ('save_user_activity', db.save_user_activity, lambda i: (rng.choice(ids), 'Viewed dashboard')),
+        ('create_user', db.create_user,
+         lambda i: ('New', f'new{next(new_users)}@example.com', 'pw', 40, 'Female', 165, 70, 'asthma', 'stay fit')),
+        ('get_user_by_email', db.get_user_by_email, lambda i: (rng.choice(emails),)),
+        ('get_user_by_email[uncached]', db.get_user_by_email, uncached_email),
+        ('get_user_by_id', db.get_user_by_id, user_id),
+        ('get_user_by_id[uncached]', db.get_user_by_id, uncached_id),
+        ('update_user_info', db.update_user_info, lambda i: (rng.choice(emails), {'weight': rng.uniform(45, 120)})),
+        ('create_plan', db.create_plan, lambda i: (rng.choice(ids), 'Walk 30 minutes a day.')),
+        ('get_latest_plan', db.get_latest_plan, user_id),
+        ('create_workout', db.create_workout, lambda i: (rng.choice(ids), '3 sets of 12 squats.')),
+        ('get_latest_workout', db.get_latest_workout, user_id),
+        ('create_consultation_log', db.create_consultation_log,
+         lambda i: (rng.choice(ids), 'How should I manage my condition?', 'Stay active.')),
+        ('get_consultation_log', db.get_consultation_log, user_id),
+        ('schedule_doctor_visit', db.schedule_doctor_visit, lambda i: (rng.choice(ids), 'Checkup', '2026-01-01 09:00')),
+        ('get_doctor_visits', db.get_doctor_visits, user_id),
+        ('create_health_recommendation', db.create_health_recommendation,
+         lambda i: (rng.choice(ids), 'Drink more water.', f'hash-{i}')),
+        ('get_health_recommendation_db', db.get_health_recommendation_db, user_id),
+        ('get_consultation_history', db.get_consultation_history, user_id),
+        ('get_recommendation_history', db.get_recommendation_history, user_id),
+        ('get_plan_history', db.get_plan_history, user_id),
+        ('get_workout_history', db.get_workout_history, user_id),
+        ('search_consultations', db.search_consultations,
+         lambda i: (rng.choice(ids), rng.choice(['condition', 'active', 'manage my', 'wel']))),
+        ('search_recommendations', db.search_recommendations, lambda i: (rng.choice(ids), 'water')),
+        ('get_dashboard_summary', db.get_dashboard_summary, lambda i: (rng.choice(emails),)),
+        ('rebuild_user_summary', db.rebuild_user_summary, user_id),
+        ('record_body_metrics', db.record_body_metrics,
+         lambda i: (rng.choice(ids), {'weight': rng.uniform(50, 110)}, now + i)),
+        ('get_body_metric_series', db.get_body_metric_series,
+         lambda i: (rng.choice(ids), 'weight', rng.choice([None, now - 90 * 86400]))),
+        ('rebuild_body_metric_rollups', db.rebuild_body_metric_rollups, user_id),
+        ('get_activity_counts', db.get_activity_counts, lambda i: (rng.choice(ids), rng.choice([None, '2025-01-01']))),
+        ('compact_activity_batch', db.compact_activity_batch,
+         lambda i: (time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - 30 * 86400)), 100)),
+        ('iter_user_pages', lambda page_size, after_id: _first_page(db, page_size, after_id),
+         lambda i: (100, rng.choice(ids))),
+        ('create_users_bulk', db.create_users_bulk,
+         lambda i: ([{'name': 'New', 'email': f'bulk{next(new_users)}@example.com', 'password': 'pw', 'age': 40,
+                      'height': 165, 'weight': 70} for _ in range(50)],)),
+        ('iter_user_export', lambda count, include_passwords: _first_exports(db, count, include_passwords),
+         lambda i: (20, False)),
+        ('get_latest_recommendation_hashes', db.get_latest_recommendation_hashes,
+         lambda i: (rng.sample(ids, min(100, len(ids))),)),
+        ('save_recommendation_batch', db.save_recommendation_batch,
+         lambda i: ([(rng.choice(ids), 'Drink more water.', f'hash-{i}') for _ in range(10)], 'bench', i, counts)),
+        ('get_recommendation_checkpoint', db.get_recommendation_checkpoint, lambda i: ('bench',)),
+        ('clear_recommendation_checkpoint', db.clear_recommendation_checkpoint, lambda i: (f'bench-{i}',)),
+        ('get_cached_llm_response', db.get_cached_llm_response, lambda i: (rng.choice(llm_keys), 86400)),
+        ('save_cached_llm_response', db.save_cached_llm_response,
+         lambda i: (f'new-prompt-{i % 1000}', 'fake', 'Drink more water.', 10_000)),
+        ('purge_llm_cache', db.purge_llm_cache, lambda i: (365 * 86400,)),
+        ('save_trending_topics', db.save_trending_topics, lambda i: (topics, time.time(), 3600)),
+        ('get_trending_topics', db.get_trending_topics, lambda i: ()),
+        ('get_trends_refresh_state', db.get_trends_refresh_state, lambda i: ('bench',)),
+        ('save_trends_refresh_state', db.save_trends_refresh_state, lambda i: ('bench', time.time(), i % 5 != 0)),
+        ('get_cached_pubmed', db.get_cached_pubmed, lambda i: (rng.sample(pubmed_keys, 5), 86400)),
+        ('save_cached_pubmed', db.save_cached_pubmed,
+         lambda i: ({rng.choice(pubmed_keys): '{"count": 1, "articles": []}'},)),
+        ('get_user_health_data', db.get_user_health_data, user_id),
+        ('place_user', db.place_user, lambda i: (rng.choice(ids), 16)),
+        ('get_user_shard', db.get_user_shard, user_id),
+        ('scan_shards', db.scan_shards,
+         lambda i: ('SELECT date(timestamp) AS day, COUNT(*) AS activities FROM user_activities '
+                    'WHERE timestamp >= ? GROUP BY day', (time.strftime('%Y-%m-%d', time.gmtime(now - 7 * 86400)),))),
+        ('get_shard_stats', db.get_shard_stats, lambda i: ()),
+    ]
+
+
+def check_coverage(db, cases):
+    """
+    Returns the public db.py functions that have no benchmark case.
+    """
+    covered = {name.split('[')[0] for name, _, _ in cases}
+    public = {name for name, member in inspect.getmembers(db, inspect.isfunction)
+              if not name.startswith('_') and member.__module__ == 'db'}
+    return sorted(public - covered - NOT_BENCHMARKED)
+
+
+def bench_db(db, cases, iterations, warmup, only=None):
+    results = {}
+    for name, function, prepare in cases:
+        if only and not any(pattern in name for pattern in only):
+            continue
+        for i in range(warmup):
+            function(*prepare(i))
+        latencies = []
+        for i in range(warmup, warmup + iterations):
+            args = prepare(i)
+            started = time.perf_counter()
+            function(*args)
+            latencies.append(time.perf_counter() - started)
+        # Queued write-behind rows are committed outside the timed calls
+        db.flush_pending_writes()
+        results[name] = summarize(latencies)
+    return results
+
+
+def bench_pages(email, renders, only=None):
+    from streamlit.testing.v1 import AppTest
+
+    results = {}
+    for page in PAGES:
+        if only and not any(pattern in page for pattern in only):
+            continue
+        at = AppTest.from_file(os.path.join(REPO_ROOT, page), default_timeout=120)
+        at.session_state['logged_in'] = True
+        at.session_state['email'] = email
+        started = time.perf_counter()
+        at.run()
+        first = time.perf_counter() - started
+        if at.exception:
+            raise RuntimeError(f"{page} raised: {at.exception[0].value}")
+        latencies = []
+        for _ in range(renders):
+            started = time.perf_counter()
+            at.run()
+            latencies.append(time.perf_counter() - started)
+        results[page] = dict(summarize(latencies), first_seconds=first)
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args):
+    """
+    Runs the whole suite against a scratch database and returns the results dict.
+    """
+    from trends_fixture import serve as serve_trends
+    from pubmed_fixture import serve as serve_pubmed
+
+    trends_server = serve_trends()
+    pubmed_server = serve_pubmed()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(
+            SQLITE_DB_PATH=os.path.join(tmp, 'bench.db'),
+            SQLITE_SHARD_DIR='',  # seeded with plain INSERTs; bench_shards.py covers sharded storage
+            LLM_BACKEND='fake',
+            FAKE_MODEL_DELAY='0',
+            FAKE_MODEL_TOKEN_DELAY='0',
+            TRENDS_URL=f'http://127.0.0.1:{trends_server.server_port}/trending',
+            TRENDS_REFRESH_ENABLED='0',
+            PUBMED_EUTILS_URL=f'http://127.0.0.1:{pubmed_server.server_port}',
+        )
+        sys.path.insert(0, REPO_ROOT)
+        os.chdir(REPO_ROOT)
+        import db
+        from trends import refresh_trends
+
+        rng = random.Random(args.seed)
+        started = time.perf_counter()
+        seeded = seed_database(db, args.users, args.history, rng)
+        seed_seconds = time.perf_counter() - started
+        refresh_trends()
+
+        cases = db_cases(db, seeded, rng)
+        missing = check_coverage(db, cases)
+        if missing:
+            sys.exit(f"No benchmark case for db.py functions: {', '.join(missing)}")
+
+        results = {
+            'meta': {
+                'commit': _git_commit(),
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'users': args.users,
+                'history': args.history,
+                'iterations': args.iterations,
+                'renders': args.renders,
+                'seed': args.seed,
+                'seed_seconds': seed_seconds,
+            },
+            'db': bench_db(db, cases, args.iterations, args.warmup, args.only),
+            'pages': bench_pages(seeded[0][1], args.renders, args.only),
+        }
+        db.close_db_connections()
+    trends_server.shutdown()
+    pubmed_server.shutdown()
+    return results
+
+
+def compare(baseline, current, threshold=0.2, p99_threshold=0.5, min_delta=0.00005):
+    """
+    Compares two results dicts.
+
+    Returns:
+        list: (section, name, metric, old, new, change) for every p50/p99 that
+              got slower by more than its threshold and by more than `min_delta` seconds.
+    """
+    regressions = []
+    for section in ('db', 'pages'):
+        for name, new in current.get(section, {}).items():
+            old = baseline.get(section, {}).get(name)
+            if not old:
+                continue
+            for metric, limit in (('p50_seconds', threshold), ('p99_seconds', p99_threshold)):
+                change = new[metric] / old[metric] - 1 if old[metric] else 0.0
+                if change > limit and new[metric] - old[metric] > min_delta:
+                    regressions.append((section, name, metric, old[metric], new[metric], change))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    print(f"{'benchmark':<40}{'ops/s':>12}{'p50':>12}{'p99':>12}{'p50 vs base':>14}")
+    for section in ('db', 'pages'):
+        for name, r in results[section].items():
+            old = (baseline or {}).get(section, {}).get(name)
+            change = f"{r['p50_seconds'] / old['p50_seconds'] - 1:>+13.1%}" if old and old['p50_seconds'] else ''
+            print(f"{section + ':' + name:<40}{r['ops_per_sec']:>12,.0f}{r['p50_seconds'] * 1e6:>10.1f}us"
+                  f"{r['p99_seconds'] * 1e6:>10.1f}us{change:>14}")
+
+
+def report_regressions(regressions):
+    if not regressions:
+        print("No regressions.")
+        return
+    print("Regressions:")
+    for section, name, metric, old, new, change in regressions:
+        print(f"  {section}:{name} {metric} {old * 1e6:.1f}us -> {new * 1e6:.1f}us ({change:+.1%})")
+    sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark db.py functions and page renders.")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--history', type=int, default=20_000, help="Rows seeded into each history table")
+    parser.add_argument('--iterations', type=int, default=500, help="Timed calls per db.py benchmark")
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--renders', type=int, default=20, help="Timed warm reruns per page")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', nargs='*', help="Run only benchmarks whose name contains one of these")
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    parser.add_argument('--baseline', help="Compare this run against a results file")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="Compare two results files and exit")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Allowed p50 slowdown (fraction)")
+    parser.add_argument('--p99-threshold', type=float, default=0.5, help="Allowed p99 slowdown (fraction)")
+    parser.add_argument('--min-delta', type=float, default=0.00005, help="Ignore slowdowns below this many seconds")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        print_results(current, baseline)
+        report_regressions(compare(baseline, current, args.threshold, args.p99_threshold, args.min_delta))
+        return
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    output = os.path.abspath(args.output) if args.output else None
+    results = run_suite(args)
+    print_results(results, baseline)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if baseline:
+        report_regressions(compare(baseline, results, args.threshold, args.p99_threshold, args.min_delta))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+Benchmark for bulk user import and streaming export (user_transfer.py).
+
+Writes a CSV of --users accounts, with some emails repeated inside the file,
+some already registered and some rows malformed, then times:
+
+    create_user      --baseline rows through create_user, one transaction each
+    import           the whole file through import_users (chunked executemany)
+
+and checks every bad row was reported with its line. It then gives each user
+--history rows in every history table and exports twice, once with --users
+and once with 4x as many, reporting rows/s and the tracemalloc peak of each
+export so a flat memory profile is visible. Finally the export is imported
+into an empty database and compared with the source.
+
+Usage:
+    python benchmarks/bench_user_transfer.py --users 20000 --history 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_claims import REPO_ROOT
+
+CHILD_SCRIPT = '''
+import csv, io, json, os, sys, time, tracemalloc
+users, history, baseline, tmp = int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3]), sys.argv[4]
+import db, user_transfer
+
+def write_csv(path, count, offset):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(db.USER_IMPORT_FIELDS)
+        for i in range(offset, offset + count):
+            writer.writerow([f'User {i}', f'user{i}@clinic.example', 'pw', 30 + i % 50, 'Female', 165, 60 + i % 40,
+                             'asthma', 'stay fit'])
+
+results = {}
+started = time.perf_counter()
+for i in range(baseline):
+    db.create_user(f'Base {i}', f'base{i}@clinic.example', 'pw', 40, 'Male', 180, 80, '', '')
+results['create_user_per_sec'] = baseline / (time.perf_counter() - started)
+
+path = os.path.join(tmp, 'users.csv')
+write_csv(path, users, 0)
+with open(path, 'a', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(['Again', 'user5@clinic.example', 'pw', 1, '', '', '', '', ''])       # repeated in file
+    writer.writerow(['Base', 'base1@clinic.example', 'pw', 1, '', '', '', '', ''])        # already registered
+    writer.writerow(['No email', '', 'pw', 1, '', '', '', '', ''])                          # missing field
+    writer.writerow(['Bad age', 'bad@clinic.example', 'pw', 'old', '', '', '', '', ''])     # malformed
+reported = []
+with open(path, newline='') as f:
+    result = user_transfer.import_users(f, 'csv', on_conflict=lambda *args: reported.append(args))
+assert result['inserted'] == users and result['skipped'] == 4, result
+assert {line for line, _, _ in reported} == {users + 2, users + 3, users + 4, users + 5}, reported
+results['import_per_sec'] = users / result['elapsed']
+
+def add_history(user_ids):
+    stamp = '2026-01-01 00:00:00'
+    with db.get_db_connection() as conn:
+        for table, column in (('user_plans', 'lifestyle_plan'), ('workouts', 'workout_plan'),
+                              ('recommendations', 'health_recommendation')):
+            conn.executemany(f'INSERT INTO {table} (user_id, {column}, created_at) VALUES (?, ?, ?)',
+                             [(u, 'Walk 30 minutes a day. ' * 10, stamp) for u in user_ids for _ in range(history)])
+        conn.executemany('INSERT INTO consultations (user_id, question, response, created_at) VALUES (?, ?, ?, ?)',
+                         [(u, 'How do I sleep better?', 'Keep a regular bedtime. ' * 10, stamp)
+                          for u in user_ids for _ in range(history)])
+
+class Counter(io.TextIOBase):
+    size = 0
+    def write(self, text):
+        self.size += len(text)
+        return len(text)
+
+def export():
+    out = Counter()
+    started = time.perf_counter()
+    written = user_transfer.export_users(out, include_passwords=True)
+    elapsed = time.perf_counter() - started
+    # Measured on a second pass; tracemalloc slows the export down
+    tracemalloc.start()
+    user_transfer.export_users(Counter(), include_passwords=True)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'users': written, 'per_sec': written / elapsed, 'mb': out.size / 1e6, 'peak_kb': peak / 1024}
+
+add_history([row['id'] for row in db.get_db_connection().execute('SELECT id FROM users')])
+results['export_small'] = export()
+write_csv(path, 3 * users, users)
+with open(path, newline='') as f:
+    user_transfer.import_users(f, 'csv')
+add_history([row['id'] for row in db.get_db_connection().execute('SELECT id FROM users WHERE id > ?', (baseline + users,))])
+results['export_large'] = export()
+
+# Round trip: the export (with passwords) imports into an empty database
+dump = os.path.join(tmp, 'users.jsonl')
+with open(dump, 'w') as f:
+    user_transfer.export_users(f, include_passwords=True)
+with open(os.path.join(tmp, 'source.json'), 'w') as f:
+    json.dump([list(r) for r in db.get_db_connection().execute(
+        f'SELECT {", ".join(db.USER_IMPORT_FIELDS)} FROM users ORDER BY id')], f)
+print(json.dumps(results))
+'''
+
+ROUND_TRIP_SCRIPT = '''
+import json, os, sys
+import db, user_transfer
+tmp = sys.argv[1]
+with open(os.path.join(tmp, 'users.jsonl')) as f:
+    result = user_transfer.import_users(f, 'jsonl')
+with open(os.path.join(tmp, 'source.json')) as f:
+    source = json.load(f)
+target = [list(r) for r in db.get_db_connection().execute(
+    f'SELECT {", ".join(db.USER_IMPORT_FIELDS)} FROM users ORDER BY id')]
+print(json.dumps({'inserted': result['inserted'], 'source': len(source), 'match': source == target,
+                  'per_sec': result['inserted'] / result['elapsed']}))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bulk user import and streaming export.")
+    parser.add_argument('--users', type=int, default=20_000, help="Users in the import file")
+    parser.add_argument('--history', type=int, default=5, help="Rows per user in each history table")
+    parser.add_argument('--baseline', type=int, default=2000, help="Users created one at a time with create_user")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, SQLITE_DB_PATH=os.path.join(tmp, 'source.db'), WRITE_BEHIND_ENABLED='0')
+        result = subprocess.run(
+            [sys.executable, '-c', CHILD_SCRIPT, str(args.users), str(args.history), str(args.baseline), tmp],
+            cwd=REPO_ROOT, env=env, check=True, capture_output=True, text=True,
+        )
+        results = json.loads(result.stdout.strip().splitlines()[-1])
+        env['SQLITE_DB_PATH'] = os.path.join(tmp, 'target.db')
+        result = subprocess.run(
+            [sys.executable, '-c', ROUND_TRIP_SCRIPT, tmp],
+            cwd=REPO_ROOT, env=env, check=True, capture_output=True, text=True,
+        )
+        round_trip = json.loads(result.stdout.strip().splitlines()[-1])
+
+    print(f"create_user      {results['create_user_per_sec']:>12,.0f} users/s")
+    print(f"bulk import      {results['import_per_sec']:>12,.0f} users/s "
+          f"({results['import_per_sec'] / results['create_user_per_sec']:.0f}x)")
+    for name in ('export_small', 'export_large'):
+        export = results[name]
+        print(f"export {export['users']:>8,} users {export['per_sec']:>10,.0f} users/s "
+              f"{export['mb']:>8.1f} MB written, peak {export['peak_kb']:,.0f} KiB")
+    print(f"round trip       {round_trip['inserted']:,} of {round_trip['source']:,} users re-imported "
+          f"at {round_trip['per_sec']:,.0f} users/s, {'identical' if round_trip['match'] else 'MISMATCH'}")
+    if not round_trip['match']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
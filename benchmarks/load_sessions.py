@@ -0,0 +1,385 @@
+"""
+Concurrent-session load generator for the Streamlit app.
+
+Starts one `streamlit run app.py` server process and drives it with headless
+sessions that speak Streamlit's websocket protocol (the BackMsg / ForwardMsg
+protobufs a browser sends and receives), so every simulated user has its own
+server-side session, script runs and session state, exactly as with real
+browsers. (AppTest cannot be used here: it swaps process-global runtime state
+on every run, so concurrent AppTests in one process break each other.)
+
+Each session walks the journey
+
+    login            render login_page, then submit email and password
+    dashboard        the default page after login
+    recommendations  press "Get Health Recommendations" (model stream)
+    consultation     switch to the consultation page (trends, PubMed evidence)
+    trend_search     type into the trend filter
+
+with an exponentially distributed think time (mean --think-time seconds)
+between steps, then disconnects and starts again as another user. A step
+fails when the script raises, does not finish within --timeout, the
+connection drops, or the widget the next step needs is missing (e.g. a
+login that did not log in). Sessions start staggered over --ramp seconds.
+
+For each --concurrency level the run reports journeys and steps per second,
+p50/p95/p99 latency and error rate per step, plus the server's own
+connection-pool, write-behind and error counters read from its metrics
+textfile (see metrics.py).
+
+The server uses a scratch database seeded with --users users and one trends
+batch, the fake model backend (--model-delay, --token-delay) and the local
+Trends and PubMed fixtures (--trends-delay, --pubmed-delay); the trends
+refresher runs every --trends-interval seconds, so scraping happens under
+load too.
+
+Usage:
+    python benchmarks/load_sessions.py --concurrency 10 50 100 200 --duration 60 --think-time 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_suite import percentile, seed_database
+from synthetic_claims import REPO_ROOT
+
+STEPS = ['login', 'dashboard', 'recommendations', 'consultation', 'trend_search']
+
+SEARCH_TERMS = ['flu', 'sleep', 'diet', 'vitamin', 'heart']
+
+
+class StepFailed(Exception):
+    pass
+
+
+class LevelRecorder:
+    """
+    Collects step latencies and errors from all sessions of one level.
+    """
+
+    def __init__(self):
+        self.samples = {step: [] for step in STEPS}
+        self.errors = {step: 0 for step in STEPS}
+        self.error_messages = {}
+        self.journeys = 0
+
+    def record(self, step, seconds, error=None):
+        self.samples[step].append(seconds)
+        if error is not None:
+            self.errors[step] += 1
+            self.error_messages[error] = self.error_messages.get(error, 0) + 1
+
+    def report(self, concurrency, elapsed):
+        steps = {}
+        for step in STEPS:
+            latencies = sorted(self.samples[step])
+            count = len(latencies)
+            steps[step] = {
+                'count': count,
+                'errors': self.errors[step],
+                'error_rate': self.errors[step] / count if count else 0.0,
+                'p50_seconds': percentile(latencies, 0.5) if count else None,
+                'p95_seconds': percentile(latencies, 0.95) if count else None,
+                'p99_seconds': percentile(latencies, 0.99) if count else None,
+            }
+        total = sum(step['count'] for step in steps.values())
+        errors = sum(step['errors'] for step in steps.values())
+        return {
+            'concurrency': concurrency,
+            'elapsed_seconds': elapsed,
+            'journeys': self.journeys,
+            'journeys_per_sec': self.journeys / elapsed,
+            'steps_per_sec': total / elapsed,
+            'error_rate': errors / total if total else 0.0,
+            'steps': steps,
+            'top_errors': sorted(self.error_messages.items(), key=lambda item: -item[1])[:5],
+        }
+
+
+class Session:
+    """
+    One headless browser session on a websocket to the server.
+    """
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.widgets = {}  # label -> widget id, from the last script run
+        self.pages = {}  # page title -> page_script_hash
+        self.page = ''
+
+    async def run(self, widgets=(), page=None):
+        """
+        Requests a script run with the given widget values and waits for it
+        to finish. Raises StepFailed if the script raised.
+
+        Args:
+            widgets (list): (label, WidgetState field, value) triples, e.g.
+                            ('Login', 'trigger_value', True).
+            page (str): Page title to switch to; defaults to the current page.
+        """
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        if page is not None:
+            self.page = self.pages[page]
+        message = BackMsg()
+        message.rerun_script.query_string = ''
+        message.rerun_script.page_script_hash = self.page
+        for label, field, value in widgets:
+            if label not in self.widgets:
+                raise StepFailed(f"no {label!r} widget")
+            state = message.rerun_script.widget_states.widgets.add()
+            state.id = self.widgets[label]
+            setattr(state, field, value)
+        await self.websocket.send(message.SerializeToString())
+
+        self.widgets = {}
+        errors = []
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(await self.websocket.recv())
+            kind = forward.WhichOneof('type')
+            if kind == 'delta' and forward.delta.WhichOneof('type') == 'new_element':
+                element = forward.delta.new_element
+                element_type = element.WhichOneof('type')
+                if element_type == 'exception':
+                    errors.append(element.exception.message.splitlines()[0] if element.exception.message else
+                                  element.exception.type)
+                elif hasattr(getattr(element, element_type), 'label') and hasattr(getattr(element, element_type), 'id'):
+                    widget = getattr(element, element_type)
+                    self.widgets[widget.label] = widget.id
+            elif kind == 'navigation':
+                self.pages = {page.page_name: page.page_script_hash for page in forward.navigation.app_pages}
+            elif kind == 'script_finished':
+                if forward.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    errors.append('compile error')
+                break
+        if errors:
+            raise StepFailed(f"script raised: {errors[0]}"[:200])
+
+
+async def run_journey(url, email, password, recorder, args, rng):
+    """
+    Walks one session through the journey; stops at the first failed step.
+    """
+    import websockets
+
+    async def login(session):
+        await session.run()
+        await session.run([('Email', 'string_value', email), ('Password', 'string_value', password),
+                           ('Login', 'trigger_value', True)])
+        if 'Go to Dashboard' not in session.widgets:
+            raise StepFailed('still logged out')
+
+    async def dashboard(session):
+        await session.run()
+        if 'Dashboard' not in session.pages:
+            raise StepFailed('no navigation after login')
+
+    async def recommendations(session):
+        await session.run([('Get Health Recommendations', 'trigger_value', True)])
+
+    async def consultation(session):
+        await session.run(page='Consultation')
+
+    async def trend_search(session):
+        await session.run([('Search for a specific trend:', 'string_value', rng.choice(SEARCH_TERMS))])
+
+    try:
+        async with websockets.connect(url, subprotocols=['streamlit'], max_size=None, open_timeout=args.timeout,
+                                      close_timeout=1) as websocket:
+            session = Session(websocket)
+            for step, action in zip(STEPS, [login, dashboard, recommendations, consultation, trend_search]):
+                started = time.perf_counter()
+                try:
+                    await asyncio.wait_for(action(session), args.timeout)
+                except (StepFailed, asyncio.TimeoutError, OSError, websockets.ConnectionClosed) as e:
+                    recorder.record(step, time.perf_counter() - started, f"{step}: {type(e).__name__}: {e}"[:200])
+                    return
+                recorder.record(step, time.perf_counter() - started)
+                if args.think_time:
+                    await asyncio.sleep(rng.expovariate(1.0 / args.think_time))
+    except (asyncio.TimeoutError, OSError, websockets.InvalidHandshake) as e:
+        recorder.record('login', args.timeout, f"connect: {type(e).__name__}: {e}"[:200])
+        return
+    recorder.journeys += 1
+
+
+async def run_level(url, concurrency, users, args):
+    """
+    Runs `concurrency` sessions for `args.duration` seconds and returns the report.
+    """
+    recorder = LevelRecorder()
+    deadline = time.perf_counter() + args.ramp + args.duration
+
+    async def session(index):
+        rng = random.Random(args.seed * 100_003 + concurrency * 1009 + index)
+        await asyncio.sleep(args.ramp * index / concurrency)
+        while time.perf_counter() < deadline:
+            _, email = users[rng.randrange(len(users))]
+            await run_journey(url, email, 'pw', recorder, args, rng)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(i) for i in range(concurrency)))
+    return recorder.report(concurrency, time.perf_counter() - started)
+
+
+def read_server_metrics(path):
+    """
+    Parses the server's metrics textfile into unlabelled gauges and the
+    per-function error counters that are non-zero.
+    """
+    gauges, errors = {}, {}
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return {'gauges': gauges, 'call_errors': errors}
+    for line in lines:
+        if not line or line.startswith('#'):
+            continue
+        name, value = line.rsplit(' ', 1)
+        if '_call_errors_total{' in name:
+            if float(value):
+                errors[name.split('"')[1]] = int(float(value))
+        elif '{' not in name:
+            gauges[name.replace('precision_health_', '', 1)] = float(value)
+    return {'gauges': gauges, 'call_errors': errors}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, env, log, timeout=60.0):
+    """
+    Starts `streamlit run app.py` and waits for its health endpoint.
+    """
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'streamlit', 'run', 'app.py', '--server.headless', 'true', '--server.port', str(port),
+         '--server.address', '127.0.0.1', '--server.enableXsrfProtection', 'false', '--server.fileWatcherType', 'none',
+         '--browser.gatherUsageStats', 'false'],
+        cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            sys.exit(f"Streamlit server exited with code {server.returncode}; see {log.name}")
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/_stcore/health', timeout=1) as response:
+                if response.status == 200:
+                    return server
+        except OSError:
+            time.sleep(0.25)
+    server.terminate()
+    sys.exit(f"Streamlit server did not become healthy within {timeout:.0f}s; see {log.name}")
+
+
+def print_level(report):
+    print(f"\nconcurrency {report['concurrency']}: {report['journeys']} journeys, "
+          f"{report['journeys_per_sec']:.2f} journeys/s, {report['steps_per_sec']:.1f} steps/s, "
+          f"{report['error_rate']:.1%} errors")
+    print(f"  {'step':<16}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'errors':>9}")
+    for step, r in report['steps'].items():
+        if not r['count']:
+            continue
+        print(f"  {step:<16}{r['count']:>8}{r['p50_seconds']:>9.3f}s{r['p95_seconds']:>9.3f}s"
+              f"{r['p99_seconds']:>9.3f}s{r['error_rate']:>9.1%}")
+    for message, count in report['top_errors']:
+        print(f"  {count:>6} x {message}")
+    gauges = report['server']['gauges']
+    if gauges:
+        print(f"  server: sqlite connections created {gauges.get('sqlite_pool_created', 0):.0f}, "
+              f"write-behind pending {gauges.get('write_behind_pending', 0):.0f}, "
+              f"call errors {sum(report['server']['call_errors'].values())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent logged-in sessions against the app.")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 100, 200],
+                        help="Concurrent sessions per level")
+    parser.add_argument('--duration', type=float, default=60.0, help="Seconds per level after the ramp")
+    parser.add_argument('--ramp', type=float, default=5.0, help="Seconds over which sessions start")
+    parser.add_argument('--think-time', type=float, default=2.0, help="Mean pause between steps (0 = none)")
+    parser.add_argument('--timeout', type=float, default=60.0, help="Seconds before a step counts as failed")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--model-delay', type=float, default=0.5, help="Fake model latency before the first token")
+    parser.add_argument('--token-delay', type=float, default=0.01, help="Fake model delay per streamed chunk")
+    parser.add_argument('--trends-delay', type=float, default=0.5, help="Trends fixture response delay")
+    parser.add_argument('--trends-interval', type=float, default=30.0, help="Trends refresh interval")
+    parser.add_argument('--pubmed-delay', type=float, default=0.2, help="PubMed fixture response delay")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    from trends_fixture import serve as serve_trends
+    from pubmed_fixture import serve as serve_pubmed
+
+    trends_server = serve_trends(delay=args.trends_delay)
+    pubmed_server = serve_pubmed(delay=args.pubmed_delay)
+    output = os.path.abspath(args.output) if args.output else None
+    with tempfile.TemporaryDirectory() as tmp:
+        metrics_path = os.path.join(tmp, 'metrics.prom')
+        env = dict(
+            os.environ,
+            SQLITE_DB_PATH=os.path.join(tmp, 'load.db'),
+            LLM_BACKEND='fake',
+            FAKE_MODEL_DELAY=str(args.model_delay),
+            FAKE_MODEL_TOKEN_DELAY=str(args.token_delay),
+            TRENDS_URL=f'http://127.0.0.1:{trends_server.server_port}/trending',
+            TRENDS_REFRESH_ENABLED='1',
+            TRENDS_REFRESH_INTERVAL=str(args.trends_interval),
+            PUBMED_EUTILS_URL=f'http://127.0.0.1:{pubmed_server.server_port}',
+            METRICS_ENABLED='1',
+            METRICS_TEXTFILE=metrics_path,
+            METRICS_EXPORT_INTERVAL='1',
+        )
+        os.environ.update(SQLITE_DB_PATH=env['SQLITE_DB_PATH'], TRENDS_REFRESH_ENABLED='0')
+        sys.path.insert(0, REPO_ROOT)
+        import db
+        from trends import refresh_trends
+
+        users = seed_database(db, args.users, 0, random.Random(args.seed))
+        # Start from a stored trends batch, as a long-running server would
+        refresh_trends(env['TRENDS_URL'])
+        db.close_db_connections()
+
+        port = _free_port()
+        with open(os.path.join(tmp, 'server.log'), 'w') as log:
+            server = start_server(port, env, log)
+            levels = []
+            try:
+                for concurrency in args.concurrency:
+                    report = asyncio.run(run_level(f'ws://127.0.0.1:{port}/_stcore/stream', concurrency, users, args))
+                    # Give the exporter a moment to write counters from the end of the level
+                    time.sleep(1.5)
+                    report['server'] = read_server_metrics(metrics_path)
+                    report['trends_requests'] = trends_server.requests
+                    report['pubmed_requests'] = pubmed_server.requests
+                    print_level(report)
+                    levels.append(report)
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+    trends_server.shutdown()
+    pubmed_server.shutdown()
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'settings': vars(args), 'levels': levels}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
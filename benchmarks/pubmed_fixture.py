@@ -0,0 +1,97 @@
+"""
+Local stand-in for the NCBI E-utilities esearch / esummary endpoints.
+
+Answers with deterministic counts, PMIDs and titles derived from the search
+term, so pubmed.get_medication_evidence can be exercised without network
+access. --delay holds each response to simulate upstream latency and
+--fail-every makes every Nth request return 503 to exercise retries.
+
+Usage:
+    python benchmarks/pubmed_fixture.py --port 8766 --delay 0.3
+    PUBMED_EUTILS_URL=http://127.0.0.1:8766 streamlit run app.py
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def _pmids(term, retmax):
+    seed = int(hashlib.sha256(term.casefold().encode('utf-8')).hexdigest()[:8], 16)
+    return seed % 50_000, [str(30_000_000 + (seed + i * 7919) % 9_000_000) for i in range(retmax)]
+
+
+def serve(port=0, delay=0.0, fail_every=0):
+    """
+    Starts the fixture server on a daemon thread.
+
+    Returns:
+        ThreadingHTTPServer: Call `.shutdown()` to stop it; its base URL is
+                             f"http://127.0.0.1:{server.server_port}".
+                             `server.requests` counts requests and
+                             `server.max_concurrent` the peak in flight.
+    """
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                self.server.requests += 1
+                number = self.server.requests
+                self.server.in_flight += 1
+                self.server.max_concurrent = max(self.server.max_concurrent, self.server.in_flight)
+            try:
+                time.sleep(delay)
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if fail_every and number % fail_every == 0:
+                    return self._send(503, {'error': 'busy'})
+                if url.path.endswith('/esearch.fcgi'):
+                    count, pmids = _pmids(query.get('term', ''), int(query.get('retmax', 3)))
+                    return self._send(200, {'esearchresult': {'count': str(count), 'idlist': pmids}})
+                if url.path.endswith('/esummary.fcgi'):
+                    ids = query.get('id', '').split(',')
+                    result = {'uids': ids, **{pmid: {'uid': pmid, 'title': f"Fixture article {pmid}"} for pmid in ids}}
+                    return self._send(200, {'result': result})
+                self._send(404, {'error': 'not found'})
+            finally:
+                with lock:
+                    self.server.in_flight -= 1
+
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.requests = server.in_flight = server.max_concurrent = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve fixture PubMed E-utilities responses.")
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--delay', type=float, default=0.0, help="Seconds to hold each response")
+    parser.add_argument('--fail-every', type=int, default=0, help="Return 503 for every Nth request")
+    args = parser.parse_args()
+
+    server = serve(args.port, args.delay, args.fail_every)
+    print(f"Serving http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+Synthetic claims extracts with the same header as HHealth_truncated.csv.
+
+Columns are filled according to their name (keys, dates, amounts, ICD slots,
+categorical flags) so the loaders see realistic shapes and sparsity without
+any real member data.
+
+Usage:
+    python benchmarks/synthetic_claims.py out.csv --rows 1000000
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_CSV = os.path.join(REPO_ROOT, 'HHealth_truncated.csv')
+
+CATEGORY_VALUES = {
+    'SV_STAT': ['P', 'D', 'R', 'A', 'O'],
+    'RELATION': ['SUBSCRIBER', 'SPOUSE', 'DEPENDENT', 'UNKNOWN'],
+    'PAYER_LOB': ['COMMERCIAL', 'MEDICAID', 'MEDICARE', 'MEDICARE SUPPLEMENT', 'MEDICARE ADVANTAGE'],
+    'PAYER_TYPE': ['PPO', 'HMO', 'MD', 'MS', 'EPO', 'POS'],
+    'MEM_STAT': ['ACTIVE', 'TERMED', ''],
+    'CLAIM_IN_NETWORK': ['Y', 'N', ''],
+    'SERVICE_SETTING': ['RX', 'INPATIENT', 'OUTPATIENT', 'PROFESSIONAL', 'OTHER'],
+    'FORM_TYPE': ['D', 'U', 'H', 'P'],
+    'POS': ['01', '11', '21', '22', '23', '81', ''],
+    'RX_FILL_SRC': ['R', 'M', ''],
+}
+ICD_LETTERS = np.array(list('ABCDEFGHIJKLMNOPQRSTZ'))
+PROC_PREFIXES = np.array(['0D', '0U', '3E', '5A', 'B3', '8E', '0W'])
+
+
+def read_header(path=SAMPLE_CSV):
+    with open(path) as f:
+        return f.readline().strip().split(',')
+
+
+def _hex_keys(rng, count, width=25):
+    digits = np.array(list('0123456789ABCDEF'))
+    return np.array([''.join(row) for row in digits[rng.integers(0, 16, size=(count, width))]])
+
+
+def _icd_codes(rng, count):
+    letters = ICD_LETTERS[rng.integers(0, len(ICD_LETTERS), count)]
+    numbers = rng.integers(0, 99999, count).astype(str)
+    return np.char.add(letters, np.char.zfill(numbers, 5))
+
+
+def _sparse(rng, values, fill_rate):
+    return np.where(rng.random(len(values)) < fill_rate, values, '')
+
+
+def _dates(rng, count, start='2022-01-01', days=365):
+    base = np.datetime64(start)
+    return (base + rng.integers(0, days, count).astype('timedelta64[D]')).astype(str)
+
+
+def synthetic_frame(header, rows, members=None, seed=0, chunk=0):
+    """
+    Builds a DataFrame of synthetic claim lines with the given header.
+
+    Args:
+        header (list): Column names, normally read from HHealth_truncated.csv.
+        rows (int): Number of claim lines.
+        members (int): Distinct members; defaults to one per 20 lines.
+        seed (int): Random seed, so runs are reproducible.
+        chunk (int): Chunk number; chunks of one file share member and
+                     provider pools but draw different claim lines.
+    """
+    pool_rng = np.random.default_rng(seed)
+    members = members or max(1, rows // 20)
+    member_pool = _hex_keys(pool_rng, members)
+    provider_pool = _hex_keys(pool_rng, max(1, members // 5))
+    rng = np.random.default_rng([seed, chunk])
+    member = member_pool[rng.integers(0, members, rows)]
+    from_date = _dates(rng, rows)
+
+    columns = {}
+    for name in header:
+        if name in ('PRIMARY_PERSON_KEY', 'MEMBER_ID'):
+            values = member
+        elif name.endswith('_PROV_KEY'):
+            values = provider_pool[rng.integers(0, len(provider_pool), rows)]
+        elif name == 'CLAIM_ID_KEY':
+            values = rng.integers(10**8, 10**15, rows).astype(str)
+        elif name == 'SERVICE_LINE':
+            values = rng.integers(1, 30, rows).astype(str)
+        elif name == 'YEARMO':
+            values = np.char.replace(np.char.ljust(from_date, 7).astype('<U7'), '-', '')
+        elif name == 'FROM_DATE':
+            values = from_date
+        elif name.endswith('_DATE'):
+            values = _dates(rng, rows)
+            if name in ('ADM_DATE', 'DIS_DATE'):
+                values = _sparse(rng, values, 0.04)
+        elif name == 'AGE_ON_DOS':
+            ages = rng.integers(0, 95, rows)
+            values = np.where(ages >= 89, '89+', ages.astype(str))
+        elif name in CATEGORY_VALUES:
+            pool = np.array(CATEGORY_VALUES[name])
+            values = pool[rng.integers(0, len(pool), rows)]
+        elif name.startswith('ICD_DIAG_') and name.endswith('_POA'):
+            values = _sparse(rng, np.full(rows, 'Y'), 0.1)
+        elif name.startswith('ICD_DIAG_'):
+            slot = 0 if name == 'ICD_DIAG_ADMIT' else int(name[-2:])
+            rate = 0.08 if slot == 0 else 0.7 * 0.75 ** (slot - 1)
+            values = _sparse(rng, _icd_codes(rng, rows), rate)
+        elif name.startswith('ICD_PROC_CODE_'):
+            rate = 0.03 * 0.8 ** (int(name[-2:]) - 1)
+            codes = np.char.add(PROC_PREFIXES[rng.integers(0, len(PROC_PREFIXES), rows)],
+                                rng.integers(10000, 99999, rows).astype(str))
+            values = _sparse(rng, codes, rate)
+        elif name == 'PROC_CODE':
+            values = _sparse(rng, rng.integers(10000, 99999, rows).astype(str), 0.67)
+        elif name == 'NDC_CODE':
+            values = _sparse(rng, np.char.zfill(rng.integers(0, 10**11, rows).astype(str), 11), 0.27)
+        elif name.startswith('AMT_') or name in ('RX_DRUG_COST', 'RX_INGR_COST', 'RX_DISP_FEE'):
+            amounts = np.round(rng.lognormal(4.5, 1.5, rows), 2)
+            values = np.where(rng.random(rows) < 0.3, 0.0, amounts).astype(str)
+        elif name in ('RX_DAYS_SUPPLY', 'RX_REFILLS', 'RX_QTY_DISPENSED', 'SV_UNITS', 'RX_FORM'):
+            values = rng.integers(0, 90, rows).astype(float).astype(str)
+        elif name == 'DIAGNOSTIC_CONDITION_CATEGORY_ID':
+            values = rng.integers(1, 100, rows).astype(str)
+        else:
+            values = np.full(rows, '')
+        columns[name] = values
+    return pd.DataFrame(columns, columns=header)
+
+
+def write_synthetic_claims(path, rows, members=None, seed=0, chunk_rows=200_000, header=None):
+    """
+    Writes a synthetic claims CSV of `rows` lines in chunks of `chunk_rows`.
+    """
+    header = header or read_header()
+    members = members or max(1, rows // 20)
+    with open(path, 'w', newline='') as f:
+        f.write(','.join(header) + '\n')
+        for i, start in enumerate(range(0, rows, chunk_rows)):
+            count = min(chunk_rows, rows - start)
+            frame = synthetic_frame(header, count, members=members, seed=seed, chunk=i)
+            frame.to_csv(f, header=False, index=False)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic claims extract.")
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--members', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_synthetic_claims(args.path, args.rows, members=args.members, seed=args.seed)
+    print(f"Wrote {args.rows:,} rows to {args.path}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
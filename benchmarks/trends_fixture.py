@@ -0,0 +1,86 @@
+"""
+Local stand-in for the Google Trends "trending" page.
+
+Serves a page with the feed-item markup trends.parse_trends reads, so the
+trends refresher can be exercised without network access. --delay holds each
+response to simulate a slow upstream and --status makes it fail.
+
+Usage:
+    python benchmarks/trends_fixture.py --port 8765 --delay 5
+    TRENDS_URL=http://127.0.0.1:8765/trending streamlit run app.py
+"""
+import argparse
+import html
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_TOPICS = [
+    ('Wegovy', '200K+'),
+    ('Ozempic shortage', '100K+'),
+    ('Flu symptoms', '50K+'),
+    ('Metformin', '20K+'),
+    ('Sleep apnea', '10K+'),
+]
+
+
+def render_trends_page(topics=DEFAULT_TOPICS):
+    """
+    Returns trending-page markup for (name, search volume) pairs.
+    """
+    items = ''.join(
+        f'<div class="feed-item"><div class="feed-item-title">{html.escape(name)}</div>'
+        f'<div class="feed-item-stats">{html.escape(volume)}</div>'
+        f'<a href="/trends/explore?q={html.escape(name.replace(" ", "+"))}">Explore</a></div>'
+        for name, volume in topics
+    )
+    return f'<html><body><div class="feed-list">{items}</div></body></html>'
+
+
+def serve(port=0, topics=DEFAULT_TOPICS, delay=0.0, status=200):
+    """
+    Starts the fixture server on a daemon thread.
+
+    Returns:
+        ThreadingHTTPServer: Call `.shutdown()` to stop it; the page is at
+                             f"http://127.0.0.1:{server.server_port}/trending".
+                             `server.requests` counts the requests served.
+    """
+    page = render_trends_page(topics).encode('utf-8')
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.server.requests += 1
+            time.sleep(delay)
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fixture Google Trends page.")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay', type=float, default=0.0, help="Seconds to hold each response")
+    parser.add_argument('--status', type=int, default=200)
+    args = parser.parse_args()
+
+    server = serve(args.port, delay=args.delay, status=args.status)
+    print(f"Serving http://127.0.0.1:{server.server_port}/trending")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Vectorized BMI, trend and downsampling over body-metric series.
+
+Readings are appended to body_measurements and folded into day, week and
+month rollups by a trigger (see db.py), so a range read costs at most
+max_points rows whatever the length of the history: `get_series` asks
+db.get_body_metric_series for the finest resolution that fits, and
+`downsample` merges adjacent buckets with NumPy reductions when even months
+do not. BMI joins each weight bucket to the height in effect at that time
+(np.searchsorted), and trends are least-squares slopes over the same arrays.
+"""
+import numpy as np
+
+from db import BODY_METRIC_MAX_POINTS, get_body_metric_series
+
+SERIES_FIELDS = ('time', 'count', 'min', 'max', 'mean', 'last')
+SECONDS_PER_WEEK = 7 * 86400
+
+
+def bmi(weight_kg, height_cm):
+    """
+    BMI for arrays of weights (kg) and heights (cm); NaN where height is not positive.
+    """
+    weight = np.asarray(weight_kg, dtype=np.float64)
+    height_m = np.asarray(height_cm, dtype=np.float64) / 100
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(height_m > 0, weight / height_m ** 2, np.nan)
+
+
+def as_of(times, source_times, source_values):
+    """
+    The latest source value at or before each time (the first one for times
+    before any source reading); NaN when there is no source reading.
+    """
+    times = np.asarray(times)
+    if len(source_times) == 0:
+        return np.full(len(times), np.nan)
+    index = np.searchsorted(source_times, times, side='right') - 1
+    return np.asarray(source_values, dtype=np.float64)[np.maximum(index, 0)]
+
+
+def linear_trend(times, values):
+    """
+    Least-squares slope of values per week; NaN with fewer than two readings
+    or when all readings share one time.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    keep = ~np.isnan(values)
+    times, values = times[keep], values[keep]
+    if len(times) < 2:
+        return np.nan
+    dt = times - times.mean()
+    spread = np.dot(dt, dt)
+    if spread == 0:
+        return np.nan
+    return np.dot(dt, values - values.mean()) / spread * SECONDS_PER_WEEK
+
+
+def downsample(series, max_points):
+    """
+    Merges adjacent buckets of a series (dict of SERIES_FIELDS arrays) into
+    at most max_points buckets, keeping counts, extremes, the count-weighted
+    mean and the last value exact.
+    """
+    n = len(series['time'])
+    if n <= max_points:
+        return series
+    group = np.arange(n) * max_points // n
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    count = np.add.reduceat(series['count'], starts)
+    return {
+        'time': series['time'][starts],
+        'count': count,
+        'min': np.minimum.reduceat(series['min'], starts),
+        'max': np.maximum.reduceat(series['max'], starts),
+        'mean': np.add.reduceat(series['mean'] * series['count'], starts) / count,
+        'last': series['last'][ends],
+    }
+
+
+def get_series(user_id, metric, start=None, end=None, max_points=BODY_METRIC_MAX_POINTS):
+    """
+    Reads a metric as NumPy arrays with at most max_points buckets.
+
+    Returns:
+        tuple: (resolution, series) where series maps SERIES_FIELDS to arrays,
+               time being the bucket's unix start time.
+    """
+    resolution, rows = get_body_metric_series(user_id, metric, start, end, max_points)
+    columns = list(zip(*rows)) or [()] * len(SERIES_FIELDS)
+    series = {
+        field: np.asarray(column, dtype=np.int64 if field in ('time', 'count') else np.float64)
+        for field, column in zip(SERIES_FIELDS, columns)
+    }
+    if len(series['time']) > max_points:
+        resolution, series = f'{resolution}+', downsample(series, max_points)
+    return resolution, series
+
+
+def get_bmi_trend(user_id, start=None, end=None, max_points=BODY_METRIC_MAX_POINTS):
+    """
+    Weight and BMI over time for a chart, with weekly trends.
+
+    Returns:
+        dict: resolution, time (datetime64[s] bucket starts), weight_mean,
+              weight_min, weight_max, bmi_mean, bmi_min, bmi_max (arrays of
+              equal length, at most max_points), latest_bmi (from the latest
+              weight reading), and
+              weight_per_week and bmi_per_week slopes (NaN when undefined).
+    """
+    resolution, weight = get_series(user_id, 'weight', start, end, max_points)
+    # Heights rarely change, so their full history is small
+    _, height = get_series(user_id, 'height', max_points=max_points)
+    height_cm = as_of(weight['time'], height['time'], height['last'])
+    bmi_mean = bmi(weight['mean'], height_cm)
+    return {
+        'resolution': resolution,
+        'time': weight['time'].astype('datetime64[s]'),
+        'weight_mean': weight['mean'],
+        'weight_min': weight['min'],
+        'weight_max': weight['max'],
+        'bmi_mean': bmi_mean,
+        'bmi_min': bmi(weight['min'], height_cm),
+        'bmi_max': bmi(weight['max'], height_cm),
+        # The last bucket's mean can span a month of readings; its last value is the latest reading
+        'latest_bmi': float(bmi(weight['last'][-1], height_cm[-1])) if len(bmi_mean) else np.nan,
+        'weight_per_week': linear_trend(weight['time'], weight['mean']),
+        'bmi_per_week': linear_trend(weight['time'], bmi_mean),
+    }
@@ -0,0 +1,449 @@
+"""
+Inverted index from diagnosis, procedure and drug codes to members and claims.
+
+For each code namespace (ICD-10 diagnoses, ICD-10-PCS procedures, NDC and
+PROC_CODE) the index keeps the distinct codes in sorted order with CSR posting
+lists of sorted member ids and claim ids. An exact code, a prefix such as
+"E11" and a category range such as "I10-I16" are all a binary search over
+the sorted codes followed by a union of posting lists, so cohort lookups never
+touch the claim rows.
+
+New claim batches go to a small pending segment that is searched alongside
+the main one and merged into it once it grows past `merge_threshold` pairs.
+
+Usage:
+    python claims_index.py build claims_store/ claims_index/
+    python claims_index.py query claims_index/ icd E11 "I10-I16"
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from claims_ingest import DIAG_COLUMNS, PROC_COLUMNS
+from claims_store import ClaimsStore, KeyDictionary
+
+NAMESPACES = ('icd', 'icd_proc', 'ndc', 'proc_code')
+
+# Parsed-block columns feeding each namespace
+NAMESPACE_COLUMNS = {
+    'icd': ['ICD_DIAG_ADMIT'] + DIAG_COLUMNS,
+    'icd_proc': PROC_COLUMNS,
+    'ndc': ['NDC_CODE'],
+    'proc_code': ['PROC_CODE'],
+}
+
+# App-level condition names (see users.medical_conditions) -> ICD-10 patterns
+CONDITION_ICD_PATTERNS = {
+    'obesity': ['E66'],
+    'diabetes': ['E08-E13'],
+    'high blood pressure': ['I10-I16'],
+    'arthritis': ['M05-M19'],
+    'depression': ['F32', 'F33'],
+    'anxiety': ['F41'],
+    'asthma': ['J45'],
+    'copd': ['J44'],
+    'cholesterol': ['E78'],
+    'sleep apnea': ['G473'],
+    'eczema': ['L20', 'L30'],
+    'insomnia': ['G470', 'F510'],
+    'acne': ['L70'],
+    'allergies': ['J30', 'T78'],
+    'migraine': ['G43'],
+    'heart disease': ['I20-I25', 'I50'],
+    'gout': ['M10'],
+    'cancer': ['C00-C96'],
+    'stroke': ['I63', 'I64'],
+    'thyroid problems': ['E00-E07'],
+    'kidney disease': ['N18'],
+    'liver disease': ['K70-K77'],
+}
+
+DEFAULT_MERGE_THRESHOLD = 1_000_000
+
+_RANGE = re.compile(r'^\s*([A-Z0-9.]+)\s*[-–—]\s*([A-Z0-9.]+)\s*$')
+
+
+def normalize_code(code):
+    """
+    Upper-cases a code and strips dots and whitespace ("e11.9" -> "E119").
+    """
+    return code.strip().upper().replace('.', '')
+
+
+def _csr(codes, pair_codes, ids):
+    """
+    CSR posting lists of `ids` grouped by their code's position in sorted `codes`.
+    """
+    code_idx = np.searchsorted(codes, pair_codes).astype(np.int64)
+    keys = np.unique((code_idx << 32) | np.asarray(ids, dtype=np.int64))
+    counts = np.bincount(keys >> 32, minlength=len(codes))
+    offsets = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets, (keys & 0xFFFFFFFF).astype(np.int32)
+
+
+def _present(values):
+    # Empty strings count as missing, like empty CSV cells.
+    return pd.notna(values) & (values != '')
+
+
+class _Segment:
+    """
+    Sorted codes with CSR member and claim posting lists.
+    """
+
+    def __init__(self, codes, member_offsets, member_postings, claim_offsets, claim_postings):
+        self.codes = codes
+        self.member_offsets = member_offsets
+        self.member_postings = member_postings
+        self.claim_offsets = claim_offsets
+        self.claim_postings = claim_postings
+
+    @classmethod
+    def from_pairs(cls, member_codes, member_ids, claim_codes=None, claim_ids=None):
+        """
+        Builds a segment from (code, member id) and (code, claim id) pairs.
+
+        When `claim_codes` is omitted the claim pairs share `member_codes`.
+        """
+        member_codes = np.asarray(member_codes, dtype=str)
+        claim_codes = member_codes if claim_codes is None else np.asarray(claim_codes, dtype=str)
+        codes = np.unique(np.concatenate([member_codes, claim_codes]))
+        return cls(codes, *_csr(codes, member_codes, member_ids), *_csr(codes, claim_codes, claim_ids))
+
+    def code_span(self, lo, hi):
+        """
+        Returns the index range of codes c with lo <= c < hi.
+        """
+        return np.searchsorted(self.codes, lo, 'left'), np.searchsorted(self.codes, hi, 'left')
+
+    def postings(self, kind, start, stop):
+        offsets = self.member_offsets if kind == 'member' else self.claim_offsets
+        values = self.member_postings if kind == 'member' else self.claim_postings
+        if stop <= start:
+            return np.empty(0, dtype=np.int32)
+        if stop - start == 1:
+            return np.asarray(values[offsets[start]:offsets[stop]])
+        return np.unique(values[offsets[start]:offsets[stop]])
+
+    def to_pairs(self):
+        """
+        Expands the segment back into (codes, member_ids, claim_ids) pairs.
+        """
+        member_codes = np.repeat(self.codes, np.diff(self.member_offsets))
+        claim_codes = np.repeat(self.codes, np.diff(self.claim_offsets))
+        return member_codes, np.asarray(self.member_postings), claim_codes, np.asarray(self.claim_postings)
+
+
+class ClaimsIndex:
+    """
+    Code -> member / claim inverted index with incremental batch updates.
+
+    Member and claim ids come from the index's `member_dictionary` and
+    `claim_dictionary`; when built from a ClaimsStore they are the store's ids.
+    """
+
+    def __init__(self, members=None, claims=None, merge_threshold=DEFAULT_MERGE_THRESHOLD):
+        self.member_dictionary = members or KeyDictionary('int32')
+        self.claim_dictionary = claims or KeyDictionary('int32')
+        self.merge_threshold = merge_threshold
+        self._segments = {ns: _Segment.from_pairs([], [], [], []) for ns in NAMESPACES}
+        self._pending = {ns: [] for ns in NAMESPACES}  # lists of (codes, member_ids, claim_ids)
+        self._pending_segments = {}
+        self._pending_size = {ns: 0 for ns in NAMESPACES}
+
+    # -- building -------------------------------------------------------
+
+    def add_batch(self, namespace, codes, member_ids, claim_ids):
+        """
+        Adds (code, member id, claim id) occurrences to one namespace.
+
+        Args:
+            namespace (str): One of NAMESPACES.
+            codes: Array of code strings.
+            member_ids: Array of member ids, parallel to `codes`.
+            claim_ids: Array of claim ids, parallel to `codes`.
+        """
+        if not len(codes):
+            return
+        codes = np.char.replace(np.char.upper(np.asarray(codes, dtype=str)), '.', '')
+        self._pending[namespace].append((codes, np.asarray(member_ids, dtype=np.int32),
+                                         np.asarray(claim_ids, dtype=np.int32)))
+        self._pending_segments.pop(namespace, None)
+        self._pending_size[namespace] += len(codes)
+        if self._pending_size[namespace] >= self.merge_threshold:
+            self.merge(namespace)
+
+    def add_frame(self, df):
+        """
+        Indexes one parsed claims block (see claims_ingest.parse_block).
+
+        Suitable as a per-block hook while ingesting new claim batches.
+        """
+        member_ids = self.member_dictionary.encode(df['MEMBER_ID'])
+        claim_ids = self.claim_dictionary.encode(df['CLAIM_ID_KEY'])
+        for namespace, columns in NAMESPACE_COLUMNS.items():
+            values = df[columns].to_numpy(dtype=object)
+            rows, slots = np.nonzero(_present(values))
+            keep = (member_ids[rows] >= 0) & (claim_ids[rows] >= 0)
+            rows, slots = rows[keep], slots[keep]
+            self.add_batch(namespace, values[rows, slots].astype(str), member_ids[rows], claim_ids[rows])
+
+    @classmethod
+    def from_store(cls, store, merge_threshold=DEFAULT_MERGE_THRESHOLD):
+        """
+        Builds an index over every claim line in a ClaimsStore.
+        """
+        index = cls(
+            members=KeyDictionary('int32', store.dictionary('person')),
+            claims=KeyDictionary('int32', store.dictionary('claim')),
+            merge_threshold=merge_threshold,
+        )
+        member = np.asarray(store.column('MEMBER_ID'))
+        claim = np.asarray(store.column('CLAIM_ID_KEY'))
+
+        def add_rows(namespace, rows, code_ids, dictionary):
+            keep = (code_ids >= 0) & (member[rows] >= 0) & (claim[rows] >= 0)
+            rows, code_ids = rows[keep], code_ids[keep]
+            codes = np.asarray(store.dictionary(dictionary), dtype=str)[code_ids] if len(code_ids) else []
+            index.add_batch(namespace, codes, member[rows], claim[rows])
+
+        all_rows = np.arange(store.rows)
+        diag_offsets = np.asarray(store.csr('diag_offsets'))
+        diag_rows = np.repeat(all_rows, np.diff(diag_offsets))
+        add_rows('icd', np.concatenate([all_rows, diag_rows]),
+                 np.concatenate([np.asarray(store.column('ICD_DIAG_ADMIT')), np.asarray(store.csr('diag_codes'))]),
+                 'icd')
+        proc_rows = np.repeat(all_rows, np.diff(np.asarray(store.csr('proc_offsets'))))
+        add_rows('icd_proc', proc_rows, np.asarray(store.csr('proc_codes')), 'icd_proc')
+        add_rows('ndc', all_rows, np.asarray(store.column('NDC_CODE')), 'ndc')
+        add_rows('proc_code', all_rows, np.asarray(store.column('PROC_CODE')), 'proc_code')
+        index.merge()
+        return index
+
+    def merge(self, namespace=None):
+        """
+        Folds pending batches into the main segment of one or all namespaces.
+        """
+        for ns in ([namespace] if namespace else NAMESPACES):
+            if not self._pending[ns]:
+                continue
+            member_codes, member_ids, claim_codes, claim_ids = self._segments[ns].to_pairs()
+            batches = self._pending[ns]
+            pending_codes = [batch[0] for batch in batches]
+            self._segments[ns] = _Segment.from_pairs(
+                np.concatenate([member_codes.astype(str)] + pending_codes),
+                np.concatenate([member_ids] + [batch[1] for batch in batches]),
+                np.concatenate([claim_codes.astype(str)] + pending_codes),
+                np.concatenate([claim_ids] + [batch[2] for batch in batches]),
+            )
+            self._pending[ns] = []
+            self._pending_segments.pop(ns, None)
+            self._pending_size[ns] = 0
+
+    # -- querying -------------------------------------------------------
+
+    def _pending_segment(self, namespace):
+        if not self._pending[namespace]:
+            return None
+        segment = self._pending_segments.get(namespace)
+        if segment is None:
+            batches = self._pending[namespace]
+            codes = np.concatenate([b[0] for b in batches])
+            segment = _Segment.from_pairs(
+                codes, np.concatenate([b[1] for b in batches]),
+                codes, np.concatenate([b[2] for b in batches]),
+            )
+            self._pending_segments[namespace] = segment
+        return segment
+
+    def _lookup(self, namespace, pattern, kind):
+        lo, hi = pattern_bounds(pattern)
+        results = []
+        for segment in (self._segments[namespace], self._pending_segment(namespace)):
+            if segment is not None:
+                results.append(segment.postings(kind, *segment.code_span(lo, hi)))
+        return union(*results)
+
+    def members(self, namespace, *patterns):
+        """
+        Returns sorted member ids with any code matching any of `patterns`.
+
+        A pattern is an exact code or prefix ("E11", "E11*") or an inclusive
+        category range ("I10-I16").
+        """
+        return union(*(self._lookup(namespace, p, 'member') for p in patterns))
+
+    def claims(self, namespace, *patterns):
+        """
+        Returns sorted claim ids with any code matching any of `patterns`.
+        """
+        return union(*(self._lookup(namespace, p, 'claim') for p in patterns))
+
+    def cohort(self, all_of=(), any_of=(), none_of=()):
+        """
+        Combines code criteria into a member cohort.
+
+        Each criterion is a (namespace, pattern) pair. Members must match every
+        `all_of` criterion, at least one `any_of` criterion (if given) and no
+        `none_of` criterion.
+
+        Returns:
+            np.ndarray: Sorted member ids.
+        """
+        sets = [self.members(ns, p) for ns, p in all_of]
+        if any_of:
+            sets.append(union(*(self.members(ns, p) for ns, p in any_of)))
+        if not sets:
+            return np.empty(0, dtype=np.int32)
+        result = intersect(*sets)
+        if none_of:
+            result = np.setdiff1d(result, union(*(self.members(ns, p) for ns, p in none_of)),
+                                  assume_unique=True)
+        return result
+
+    def member_keys(self, member_ids):
+        """
+        Decodes member ids back to MEMBER_ID keys.
+        """
+        return [self.member_dictionary.values[i] for i in member_ids]
+
+    def codes(self, namespace):
+        """
+        Returns the distinct indexed codes of a namespace in sorted order.
+        """
+        self.merge(namespace)
+        return self._segments[namespace].codes
+
+    # -- persistence ----------------------------------------------------
+
+    def save(self, path):
+        """
+        Writes the index as .npy arrays plus dictionaries; replaces `path`.
+        """
+        self.merge()
+        tmp_path = os.path.abspath(path) + '.building'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for ns, segment in self._segments.items():
+            for name in ('codes', 'member_offsets', 'member_postings', 'claim_offsets', 'claim_postings'):
+                np.save(os.path.join(tmp_path, f'{ns}.{name}.npy'), np.asarray(getattr(segment, name)))
+        with open(os.path.join(tmp_path, 'dictionaries.json'), 'w') as f:
+            json.dump({'member': self.member_dictionary.values, 'claim': self.claim_dictionary.values}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, merge_threshold=DEFAULT_MERGE_THRESHOLD):
+        """
+        Opens a saved index; posting lists are memory-mapped.
+        """
+        with open(os.path.join(path, 'dictionaries.json')) as f:
+            dictionaries = json.load(f)
+        index = cls(KeyDictionary('int32', dictionaries['member']),
+                    KeyDictionary('int32', dictionaries['claim']),
+                    merge_threshold=merge_threshold)
+        for ns in NAMESPACES:
+            arrays = [
+                np.load(os.path.join(path, f'{ns}.{name}.npy'), mmap_mode=None if name == 'codes' else 'r')
+                for name in ('codes', 'member_offsets', 'member_postings', 'claim_offsets', 'claim_postings')
+            ]
+            index._segments[ns] = _Segment(*arrays)
+        return index
+
+
+def pattern_bounds(pattern):
+    """
+    Converts a code pattern into a half-open [lo, hi) range over sorted codes.
+
+    "E11" and "E11*" match every code starting with E11; "I10-I16" matches
+    every code whose prefix falls between I10 and I16 inclusive.
+    """
+    match = _RANGE.match(pattern.upper())
+    if match:
+        lo, hi = normalize_code(match.group(1)), normalize_code(match.group(2))
+    else:
+        lo = hi = normalize_code(pattern.rstrip('*'))
+    return lo, hi + '\U0010FFFF'
+
+
+def union(*arrays):
+    """
+    Sorted union of sorted id arrays.
+    """
+    arrays = [a for a in arrays if len(a)]
+    if not arrays:
+        return np.empty(0, dtype=np.int32)
+    if len(arrays) == 1:
+        return arrays[0]
+    return np.unique(np.concatenate(arrays))
+
+
+def intersect(*arrays):
+    """
+    Sorted intersection of sorted, duplicate-free id arrays, smallest first.
+    """
+    if not arrays:
+        return np.empty(0, dtype=np.int32)
+    arrays = sorted(arrays, key=len)
+    result = arrays[0]
+    for other in arrays[1:]:
+        if not len(result):
+            break
+        result = np.intersect1d(result, other, assume_unique=True)
+    return result
+
+
+def members_for_conditions(index, medical_conditions):
+    """
+    Maps an app user's medical conditions to claim members with matching diagnoses.
+
+    Args:
+        index (ClaimsIndex): Index to search.
+        medical_conditions (str): Free text as stored in users.medical_conditions.
+
+    Returns:
+        dict: Condition name -> sorted member ids; unknown conditions are omitted.
+    """
+    from medications import MEDICATION_INDEX
+
+    matches = {}
+    # Synonyms and conditions embedded in longer text resolve through the
+    # medication index to the canonical app names used as keys here.
+    for condition in MEDICATION_INDEX.match_conditions(medical_conditions):
+        patterns = CONDITION_ICD_PATTERNS.get(condition.casefold())
+        if patterns:
+            matches[condition] = index.members('icd', *patterns)
+    return matches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the claims code index.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="Build an index from a claims store")
+    build.add_argument('store_path')
+    build.add_argument('index_path')
+    query = subparsers.add_parser('query', help="Count members matching code patterns")
+    query.add_argument('index_path')
+    query.add_argument('namespace', choices=NAMESPACES)
+    query.add_argument('patterns', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        index = ClaimsIndex.from_store(ClaimsStore(args.store_path))
+        index.save(args.index_path)
+        print(f"Indexed {', '.join(f'{len(index.codes(ns)):,} {ns}' for ns in NAMESPACES)} codes.")
+    else:
+        index = ClaimsIndex.load(args.index_path)
+        for pattern in args.patterns:
+            print(f"{pattern:<12}{len(index.members(args.namespace, pattern)):>10,} members"
+                  f"{len(index.claims(args.namespace, pattern)):>10,} claims")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,395 @@
+"""
+Streaming loader for claims extracts in the HHealth_truncated.csv layout.
+
+The file is read in newline-aligned byte blocks, so memory is bounded by the
+block size no matter how large the extract is. Each block is parsed with
+compact dtypes, split into the normalized claim_lines / claim_diagnoses /
+claim_procedures tables and bulk-inserted. The byte offset reached is
+committed in the same transaction as the rows, which makes a resumed load
+pick up exactly where the previous one stopped.
+
+Records are assumed not to contain embedded newlines, which holds for the
+claims extract format.
+
+Usage:
+    python claims_ingest.py HHealth_truncated.csv [--block-mb 32] [--restart]
+"""
+import argparse
+import io
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from db import get_db_connection
+
+DIAG_SLOTS = 30
+PROC_SLOTS = 30
+
+DIAG_COLUMNS = [f'ICD_DIAG_{i:02d}' for i in range(1, DIAG_SLOTS + 1)]
+POA_COLUMNS = [f'ICD_DIAG_{i:02d}_POA' for i in range(1, DIAG_SLOTS + 1)]
+PROC_COLUMNS = [f'ICD_PROC_CODE_{i:02d}' for i in range(1, PROC_SLOTS + 1)]
+
+# Low-cardinality text columns, parsed as pandas categoricals
+CATEGORY_COLUMNS = [
+    'SV_STAT', 'RELATION', 'PAYER_LOB', 'PAYER_TYPE', 'SERVICE_SETTING',
+    'FORM_TYPE', 'CLAIM_IN_NETWORK',
+]
+# Identifiers and codes; kept as text so leading zeros survive
+TEXT_COLUMNS = [
+    'CLAIM_ID_KEY', 'PRIMARY_PERSON_KEY', 'MEMBER_ID', 'BILL_PROV_KEY',
+    'REF_PROV_KEY', 'ATT_PROV_KEY', 'POS', 'MS_DRG', 'REV_CODE', 'PROC_CODE',
+    'NDC_CODE', 'ICD_DIAG_ADMIT',
+]
+INT_COLUMNS = ['SERVICE_LINE', 'YEARMO', 'DIAGNOSTIC_CONDITION_CATEGORY_ID']
+DATE_COLUMNS = ['FROM_DATE', 'TO_DATE', 'PAID_DATE', 'ADM_DATE', 'DIS_DATE']
+AMOUNT_COLUMNS = [
+    'RX_DAYS_SUPPLY', 'RX_QTY_DISPENSED', 'RX_DRUG_COST', 'RX_INGR_COST',
+    'AMT_BILLED', 'AMT_ALLOWED', 'AMT_COB', 'AMT_COPAY', 'AMT_DEDUCT',
+    'AMT_COINS', 'AMT_PAID', 'AMT_DISALLOWED', 'SV_UNITS',
+]
+
+CLAIM_DTYPES = {
+    **{col: 'category' for col in CATEGORY_COLUMNS},
+    **{col: str for col in TEXT_COLUMNS + DIAG_COLUMNS + POA_COLUMNS + PROC_COLUMNS},
+    # Top-coded ages arrive as e.g. "89+"; converted in parse_block
+    'AGE_ON_DOS': str,
+    **{col: 'Int32' for col in INT_COLUMNS},
+    **{col: 'float32' for col in AMOUNT_COLUMNS},
+}
+
+# claim_lines column order; table columns are the lower-cased CSV names
+LINE_COLUMNS = [
+    'CLAIM_ID_KEY', 'SERVICE_LINE', 'SV_STAT', 'PRIMARY_PERSON_KEY', 'MEMBER_ID',
+    'BILL_PROV_KEY', 'REF_PROV_KEY', 'ATT_PROV_KEY', 'YEARMO',
+    *DATE_COLUMNS,
+    'AGE_ON_DOS', 'RELATION', 'PAYER_LOB', 'PAYER_TYPE', 'SERVICE_SETTING',
+    'FORM_TYPE', 'CLAIM_IN_NETWORK', 'POS', 'MS_DRG', 'REV_CODE', 'PROC_CODE',
+    'NDC_CODE',
+    *AMOUNT_COLUMNS,
+    'DIAGNOSTIC_CONDITION_CATEGORY_ID',
+]
+
+USE_COLUMNS = LINE_COLUMNS + ['ICD_DIAG_ADMIT'] + DIAG_COLUMNS + POA_COLUMNS + PROC_COLUMNS
+
+INSERT_LINE_SQL = 'INSERT INTO claim_lines (id, {}) VALUES (?, {})'.format(
+    ', '.join(col.lower() for col in LINE_COLUMNS),
+    ', '.join('?' for _ in LINE_COLUMNS),
+)
+INSERT_DIAG_SQL = 'INSERT INTO claim_diagnoses (claim_line_id, position, icd_code, poa) VALUES (?, ?, ?, ?)'
+INSERT_PROC_SQL = 'INSERT INTO claim_procedures (claim_line_id, position, icd_proc_code) VALUES (?, ?, ?)'
+
+DEFAULT_BLOCK_BYTES = 32 * 1024 * 1024
+DEFAULT_COMMIT_ROWS = 200_000
+
+
+def read_header(path):
+    """
+    Returns the raw header line (including its newline) and its length in bytes.
+    """
+    with open(path, 'rb') as f:
+        header = f.readline()
+    return header, len(header)
+
+
+def iter_blocks(path, start, end=None, block_bytes=DEFAULT_BLOCK_BYTES):
+    """
+    Yields (end_offset, block) pairs of whole lines between two byte offsets.
+
+    `start` must sit on a line boundary. Each block holds up to roughly
+    `block_bytes` bytes and always ends at a newline (or the end of the range),
+    so a block never splits a record.
+    """
+    end = os.path.getsize(path) if end is None else end
+    with open(path, 'rb') as f:
+        f.seek(start)
+        offset = start
+        carry = b''
+        while offset < end:
+            data = f.read(min(block_bytes, end - offset))
+            if not data:
+                break
+            offset += len(data)
+            data = carry + data
+            if offset >= end:
+                block, carry = data, b''
+            else:
+                cut = data.rfind(b'\n') + 1
+                if cut == 0:
+                    carry = data
+                    continue
+                block, carry = data[:cut], data[cut:]
+            if block.strip():
+                yield offset - len(carry), block
+        if carry.strip():
+            yield offset, carry
+
+
+def parse_block(header, block):
+    """
+    Parses a block of CSV lines into a DataFrame with compact dtypes.
+    """
+    df = pd.read_csv(
+        io.BytesIO(header + block),
+        usecols=USE_COLUMNS,
+        dtype=CLAIM_DTYPES,
+        parse_dates=DATE_COLUMNS,
+        date_format='%Y-%m-%d',
+    )
+    df['AGE_ON_DOS'] = pd.to_numeric(df['AGE_ON_DOS'].str.rstrip('+'), errors='coerce').astype('Int16')
+    return df
+
+
+def _column_values(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        values = series.dt.strftime('%Y-%m-%d').astype(object)
+    elif series.dtype == np.float32:
+        # float32 keeps memory down while parsing; store cents-rounded doubles.
+        values = series.astype(np.float64).round(2).astype(object)
+    else:
+        values = series.astype(object)
+    return values.where(series.notna(), None).tolist()
+
+
+def frame_to_rows(df):
+    """
+    Splits a parsed block into claim line, diagnosis and procedure rows.
+
+    Line rows are returned without their id; diagnosis and procedure rows
+    reference lines by their position within the block, so the writer can
+    assign ids at insert time.
+
+    Returns:
+        tuple: (line_rows, diag_rows, proc_rows)
+    """
+    line_rows = list(zip(*(_column_values(df[col]) for col in LINE_COLUMNS)))
+
+    diag_rows = []
+    admit = df['ICD_DIAG_ADMIT']
+    for local in np.flatnonzero(admit.notna().to_numpy()):
+        diag_rows.append((int(local), 0, admit.iat[local], None))
+    for position, (code_col, poa_col) in enumerate(zip(DIAG_COLUMNS, POA_COLUMNS), start=1):
+        codes = df[code_col]
+        present = np.flatnonzero(codes.notna().to_numpy())
+        if not len(present):
+            continue
+        poa = df[poa_col].iloc[present]
+        poa = poa.astype(object).where(poa.notna(), None).tolist()
+        diag_rows.extend(zip(present.tolist(), [position] * len(present), codes.iloc[present].tolist(), poa))
+
+    proc_rows = []
+    for position, code_col in enumerate(PROC_COLUMNS, start=1):
+        codes = df[code_col]
+        present = np.flatnonzero(codes.notna().to_numpy())
+        if len(present):
+            proc_rows.extend(zip(present.tolist(), [position] * len(present), codes.iloc[present].tolist()))
+
+    return line_rows, diag_rows, proc_rows
+
+
+def write_rows(conn, line_rows, diag_rows, proc_rows):
+    """
+    Inserts one parsed block, assigning claim line ids after the current maximum.
+
+    Must be called inside the caller's transaction.
+
+    Returns:
+        int: Number of claim lines written.
+    """
+    base = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM claim_lines').fetchone()[0]
+    conn.executemany(INSERT_LINE_SQL, ((base + i, *row) for i, row in enumerate(line_rows)))
+    conn.executemany(INSERT_DIAG_SQL, ((base + local, pos, code, poa) for local, pos, code, poa in diag_rows))
+    conn.executemany(INSERT_PROC_SQL, ((base + local, pos, code) for local, pos, code in proc_rows))
+    return len(line_rows)
+
+
+def get_checkpoint(conn, source):
+    """
+    Returns the saved checkpoint row for `source`, or None.
+    """
+    return conn.execute(
+        'SELECT file_size, byte_offset, rows_loaded FROM claims_ingest_checkpoints WHERE source = ?',
+        (source,),
+    ).fetchone()
+
+
+def save_checkpoint(conn, source, file_size, byte_offset, rows_loaded):
+    conn.execute('''
+        INSERT INTO claims_ingest_checkpoints (source, file_size, byte_offset, rows_loaded, updated_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (source) DO UPDATE SET
+            file_size = excluded.file_size,
+            byte_offset = excluded.byte_offset,
+            rows_loaded = excluded.rows_loaded,
+            updated_at = excluded.updated_at
+    ''', (source, file_size, byte_offset, rows_loaded))
+
+
+def _print_progress(progress):
+    print(
+        f"{progress['rows']:>12,} rows  {progress['rows_per_sec']:>10,.0f} rows/s  "
+        f"{progress['fraction'] * 100:5.1f}%"
+    )
+
+
+class ClaimsWriter:
+    """
+    Accumulates parsed blocks and commits them in large transactions.
+
+    The checkpoint is advanced in the same transaction as the rows, so a crash
+    never records rows that were not committed, or vice versa.
+    """
+
+    def __init__(self, conn, source, file_size, byte_offset, rows_loaded,
+                 commit_rows=DEFAULT_COMMIT_ROWS, progress=_print_progress):
+        self.conn = conn
+        self.source = source
+        self.file_size = file_size
+        self.byte_offset = byte_offset
+        self.rows_loaded = rows_loaded
+        self.commit_rows = commit_rows
+        self.progress = progress
+        self.started = time.perf_counter()
+        self.rows_this_run = 0
+        self._pending_rows = 0
+
+    def write(self, end_offset, line_rows, diag_rows, proc_rows):
+        if not self.conn.in_transaction:
+            self.conn.execute('BEGIN IMMEDIATE')
+        written = write_rows(self.conn, line_rows, diag_rows, proc_rows)
+        self.byte_offset = end_offset
+        self.rows_loaded += written
+        self.rows_this_run += written
+        self._pending_rows += written
+        if self._pending_rows >= self.commit_rows:
+            self.commit()
+
+    def commit(self):
+        if not self.conn.in_transaction:
+            return
+        save_checkpoint(self.conn, self.source, self.file_size, self.byte_offset, self.rows_loaded)
+        self.conn.commit()
+        self._pending_rows = 0
+        if self.progress:
+            self.progress(self.report())
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            'rows': self.rows_loaded,
+            'rows_this_run': self.rows_this_run,
+            'byte_offset': self.byte_offset,
+            'fraction': self.byte_offset / self.file_size if self.file_size else 1.0,
+            'elapsed': elapsed,
+            'rows_per_sec': self.rows_this_run / elapsed if elapsed else 0.0,
+        }
+
+
+def discard_loaded_rows(conn, source, file_size, header_len):
+    """
+    Deletes the claim rows loaded under a discarded checkpoint and resets the
+    checkpoint to the first data row, in one transaction, so reloading the
+    file does not count its rows twice.
+
+    Claim rows do not record which file they came from, so this is only done
+    while `source` is the only file with rows loaded.
+
+    Raises:
+        ValueError: Another file has rows loaded; nothing is changed.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        others = conn.execute(
+            'SELECT COUNT(*) FROM claims_ingest_checkpoints WHERE source != ? AND rows_loaded > 0', (source,)
+        ).fetchone()[0]
+        if others:
+            raise ValueError(
+                f"cannot restart {source}: rows from {others} other claims file(s) are loaded and claim rows "
+                f"do not record their source; clear the claims tables and reload every file instead"
+            )
+        for table in ('claim_diagnoses', 'claim_procedures', 'claim_lines'):
+            conn.execute(f'DELETE FROM {table}')
+        save_checkpoint(conn, source, file_size, header_len, 0)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def open_writer(path, restart=False, commit_rows=DEFAULT_COMMIT_ROWS, progress=_print_progress):
+    """
+    Returns a ClaimsWriter positioned at the saved checkpoint for `path`.
+
+    The checkpoint is discarded (and loading starts at the first data row)
+    when `restart` is set or the file is now smaller than the saved offset.
+    Rows loaded under a discarded checkpoint are deleted first (see
+    discard_loaded_rows).
+    """
+    source = os.path.abspath(path)
+    file_size = os.path.getsize(path)
+    _, header_len = read_header(path)
+    conn = get_db_connection()
+
+    checkpoint = get_checkpoint(conn, source)
+    if checkpoint is not None and not restart and checkpoint['byte_offset'] <= file_size:
+        byte_offset, rows_loaded = checkpoint['byte_offset'], checkpoint['rows_loaded']
+    else:
+        byte_offset, rows_loaded = header_len, 0
+        if checkpoint is not None and checkpoint['rows_loaded']:
+            discard_loaded_rows(conn, source, file_size, header_len)
+    return ClaimsWriter(conn, source, file_size, byte_offset, rows_loaded,
+                        commit_rows=commit_rows, progress=progress)
+
+
+def ingest_claims(path, block_bytes=DEFAULT_BLOCK_BYTES, commit_rows=DEFAULT_COMMIT_ROWS,
+                  restart=False, progress=_print_progress):
+    """
+    Streams a claims CSV into the claims tables, resuming from the last checkpoint.
+
+    Args:
+        path (str): Path to the claims extract.
+        block_bytes (int): Approximate bytes parsed per block; bounds memory use.
+        commit_rows (int): Claim lines per transaction.
+        restart (bool): Delete the rows loaded from this file and start from the top.
+        progress (callable): Called with a progress dict after every commit.
+
+    Returns:
+        dict: Final progress report (rows, rows_per_sec, elapsed, ...).
+    """
+    header, _ = read_header(path)
+    writer = open_writer(path, restart=restart, commit_rows=commit_rows, progress=progress)
+    try:
+        for end_offset, block in iter_blocks(path, writer.byte_offset, block_bytes=block_bytes):
+            writer.write(end_offset, *frame_to_rows(parse_block(header, block)))
+        writer.commit()
+    except BaseException:
+        if writer.conn.in_transaction:
+            writer.conn.rollback()
+        raise
+    return writer.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load a claims extract into the claims tables.")
+    parser.add_argument('path', help="Claims CSV in the HHealth_truncated.csv layout")
+    parser.add_argument('--block-mb', type=float, default=DEFAULT_BLOCK_BYTES / (1024 * 1024),
+                        help="Approximate megabytes parsed per block")
+    parser.add_argument('--commit-rows', type=int, default=DEFAULT_COMMIT_ROWS,
+                        help="Claim lines per transaction")
+    parser.add_argument('--restart', action='store_true',
+                        help="Delete this file's loaded rows and load it again from the top")
+    args = parser.parse_args()
+
+    report = ingest_claims(
+        args.path,
+        block_bytes=int(args.block_mb * 1024 * 1024),
+        commit_rows=args.commit_rows,
+        restart=args.restart,
+    )
+    print(f"Loaded {report['rows_this_run']:,} rows in {report['elapsed']:.1f}s "
+          f"({report['rows_per_sec']:,.0f} rows/s); {report['rows']:,} rows total.")
+
+
+if __name__ == '__main__':
+    main()
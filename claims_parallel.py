@@ -0,0 +1,141 @@
+"""
+Parallel claims loader: byte-range sharding over a process pool.
+
+The file is cut into newline-aligned byte ranges. Worker processes parse
+ranges into claim rows (the CPU-heavy part) while this process stays the
+only SQLite writer. Results are consumed in file order, so the final claim
+rows, ids and amount totals match the serial loader in claims_ingest.py, and
+either loader can resume the other's checkpoint. Commit and checkpoint
+boundaries differ, since ranges are smaller than the serial loader's blocks.
+
+Usage:
+    python claims_parallel.py HHealth_truncated.csv --workers 4
+"""
+import argparse
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from claims_ingest import (
+    DEFAULT_BLOCK_BYTES,
+    DEFAULT_COMMIT_ROWS,
+    _print_progress,
+    frame_to_rows,
+    iter_blocks,
+    open_writer,
+    parse_block,
+    read_header,
+)
+
+
+def split_ranges(path, start, range_bytes, end=None):
+    """
+    Splits [start, end) into consecutive ranges of about `range_bytes` bytes.
+
+    Every boundary is moved forward to the next line start, so no record is
+    split between two ranges.
+
+    Returns:
+        list: (start, end) byte offset pairs covering the whole span.
+    """
+    end = os.path.getsize(path) if end is None else end
+    ranges = []
+    with open(path, 'rb') as f:
+        lo = start
+        while lo < end:
+            target = lo + range_bytes
+            if target >= end:
+                hi = end
+            else:
+                f.seek(target)
+                f.readline()
+                hi = min(f.tell(), end)
+            ranges.append((lo, hi))
+            lo = hi
+    return ranges
+
+
+def parse_range(path, header, start, end):
+    """
+    Parses one byte range into claim rows. Runs in a worker process.
+
+    Returns:
+        tuple: (end, line_rows, diag_rows, proc_rows) with diagnosis and
+               procedure rows indexed relative to the start of the range.
+    """
+    line_rows, diag_rows, proc_rows = [], [], []
+    for _, block in iter_blocks(path, start, end, block_bytes=end - start):
+        lines, diags, procs = frame_to_rows(parse_block(header, block))
+        base = len(line_rows)
+        line_rows.extend(lines)
+        diag_rows.extend((base + local, pos, code, poa) for local, pos, code, poa in diags)
+        proc_rows.extend((base + local, pos, code) for local, pos, code in procs)
+    return end, line_rows, diag_rows, proc_rows
+
+
+def ingest_claims_parallel(path, workers=None, range_bytes=DEFAULT_BLOCK_BYTES // 4,
+                           commit_rows=DEFAULT_COMMIT_ROWS, restart=False,
+                           progress=_print_progress):
+    """
+    Loads a claims CSV using `workers` parser processes and a single writer.
+
+    At most `2 * workers` parsed ranges are held in memory at once, so memory
+    stays bounded by the range size rather than the file size.
+
+    Args:
+        path (str): Path to the claims extract.
+        workers (int): Parser processes; defaults to the CPU count.
+        range_bytes (int): Approximate bytes per shard handed to a worker.
+        commit_rows (int): Claim lines per transaction.
+        restart (bool): Delete the rows loaded from this file and start from the top.
+        progress (callable): Called with a progress dict after every commit.
+
+    Returns:
+        dict: Final progress report, as from `claims_ingest.ingest_claims`.
+    """
+    workers = workers or os.cpu_count() or 1
+    header, _ = read_header(path)
+    writer = open_writer(path, restart=restart, commit_rows=commit_rows, progress=progress)
+    ranges = deque(split_ranges(path, writer.byte_offset, range_bytes))
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            while ranges or pending:
+                while ranges and len(pending) < 2 * workers:
+                    start, end = ranges.popleft()
+                    pending.append(executor.submit(parse_range, path, header, start, end))
+                writer.write(*pending.popleft().result())
+        writer.commit()
+    except BaseException:
+        if writer.conn.in_transaction:
+            writer.conn.rollback()
+        raise
+    return writer.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load a claims extract with parallel parsing.")
+    parser.add_argument('path', help="Claims CSV in the HHealth_truncated.csv layout")
+    parser.add_argument('--workers', type=int, default=None, help="Parser processes (default: CPU count)")
+    parser.add_argument('--range-mb', type=float, default=DEFAULT_BLOCK_BYTES / 4 / (1024 * 1024),
+                        help="Approximate megabytes per shard")
+    parser.add_argument('--commit-rows', type=int, default=DEFAULT_COMMIT_ROWS,
+                        help="Claim lines per transaction")
+    parser.add_argument('--restart', action='store_true',
+                        help="Delete this file's loaded rows and load it again from the top")
+    args = parser.parse_args()
+
+    report = ingest_claims_parallel(
+        args.path,
+        workers=args.workers,
+        range_bytes=int(args.range_mb * 1024 * 1024),
+        commit_rows=args.commit_rows,
+        restart=args.restart,
+    )
+    print(f"Loaded {report['rows_this_run']:,} rows in {report['elapsed']:.1f}s "
+          f"({report['rows_per_sec']:,.0f} rows/s); {report['rows']:,} rows total.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""
+Vectorized per-member cost and utilization rollups over encoded claims.
+
+All aggregation is done with NumPy over integer-encoded member, month,
+SERVICE_SETTING and PAYER_LOB ids: rows are mapped to one int64 group key,
+grouped once with a sort (np.unique), and every amount is reduced with
+np.bincount over the same group index. Member-month totals are segmented
+sums over the already sorted groups; they feed trailing 12-month windows
+(cumulative sums differenced at the window start) and per-month percentiles
+(a value sort plus a radix sort on month), so a full rollup is a fixed number
+of passes over the arrays regardless of how many members or months exist.
+Percentiles rank every member whose trailing window covers the month, also
+in months without claims of their own (see _covered_windows).
+
+Usage:
+    python claims_rollup.py claims_store/ [--member MEMBER_ID]
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from claims_store import ClaimsStore
+
+ROLLUP_AMOUNTS = ['AMT_BILLED', 'AMT_ALLOWED', 'AMT_PAID', 'AMT_COPAY', 'RX_DRUG_COST']
+DEFAULT_QUANTILES = (50, 90, 99)
+WINDOW_MONTHS = 12
+
+
+def yearmo_to_month(yearmo):
+    """
+    Converts YYYYMM integers to a running month number (year * 12 + month - 1).
+    """
+    yearmo = np.asarray(yearmo, dtype=np.int64)
+    return (yearmo // 100) * 12 + (yearmo % 100) - 1
+
+
+def valid_yearmo(yearmo):
+    """
+    Boolean mask of YYYYMM values with a positive year and a month of 1-12;
+    missing or sentinel values (0, -1) are False.
+    """
+    yearmo = np.asarray(yearmo, dtype=np.int64)
+    month = yearmo % 100
+    return (yearmo // 100 > 0) & (month >= 1) & (month <= 12)
+
+
+def month_to_yearmo(month):
+    month = np.asarray(month, dtype=np.int64)
+    return ((month // 12) * 100 + month % 12 + 1).astype(np.int32)
+
+
+class Rollup:
+    """
+    Result of `rollup`: grouped totals, trailing 12-month windows and percentiles.
+
+    Attributes:
+        detail (dict): Arrays keyed by member, yearmo, setting, lob, lines and
+                       one sum per amount, one entry per non-empty
+                       (member, month, setting, lob) group.
+        member_month (dict): Arrays keyed by member, yearmo, lines, each amount
+                             and `<amount>_12M` trailing 12-month totals.
+        percentiles (dict): yearmo, members and `p<q>` arrays: the
+                            distribution of the trailing 12-month
+                            `percentile_amount` across every member with a
+                            claim line in the 12 months up to that month.
+        rows (int): Claim lines passed in.
+        dropped (int): Lines left out because their YEARMO was missing or invalid.
+    """
+
+    def __init__(self, detail, member_month, percentiles, rows, dropped=0):
+        self.detail = detail
+        self.member_month = member_month
+        self.percentiles = percentiles
+        self.rows = rows
+        self.dropped = dropped
+
+    def member(self, member_id):
+        """
+        Returns the member-month rows for one member as a dict of arrays.
+        """
+        members = self.member_month['member']
+        start, stop = np.searchsorted(members, member_id, 'left'), np.searchsorted(members, member_id, 'right')
+        return {name: values[start:stop] for name, values in self.member_month.items()}
+
+    def to_frames(self):
+        """
+        Returns (detail, member_month, percentiles) as pandas DataFrames.
+        """
+        return pd.DataFrame(self.detail), pd.DataFrame(self.member_month), pd.DataFrame(self.percentiles)
+
+
+def _group(keys):
+    groups, inverse = np.unique(keys, return_inverse=True)
+    return groups, inverse.ravel()
+
+
+def _sums(inverse, count, amounts):
+    sums = {'lines': np.bincount(inverse, minlength=count).astype(np.int64)}
+    for name, values in amounts.items():
+        sums[name] = np.bincount(inverse, weights=values, minlength=count)
+    return sums
+
+
+def _window_starts(member, month, window):
+    """
+    Index of the first row inside each row's trailing `window` months.
+
+    Rows must be sorted by (member, month) with unique pairs.
+    """
+    key = member.astype(np.int64) * (1 << 32) + month
+    return np.searchsorted(key, key - (window - 1), 'left')
+
+
+def _trailing_window(starts, values):
+    """
+    Sum of `values` from each row's window start through the row itself.
+    """
+    cumulative = np.cumsum(values)
+    before = np.where(starts > 0, cumulative[np.maximum(starts - 1, 0)], 0.0)
+    return cumulative - before
+
+
+def _covered_windows(member, month, values, window, last_month):
+    """
+    Trailing `window`-month totals for every (member, month) a window covers.
+
+    Rows must be sorted by (member, month) with unique pairs. A member with a
+    claim in month m has a trailing total in months m .. m + window - 1 (up
+    to last_month), so each row is repeated for the months until the
+    member's next row or the end of its window, and the totals are read off
+    one cumulative sum.
+
+    Returns:
+        tuple: (member, month, total) arrays, sorted by member then month.
+    """
+    n = len(member)
+    same_member = np.r_[member[1:] == member[:-1], False]
+    gap = np.where(same_member, np.r_[np.diff(month), 0], window)
+    span = np.clip(np.minimum(gap, last_month - month + 1), 0, window)
+    row = np.repeat(np.arange(n), span)
+    covered_month = month[row] + (np.arange(len(row)) - np.repeat(np.cumsum(span) - span, span))
+    covered_member = member[row]
+    key = member.astype(np.int64) * (1 << 32) + month
+    starts = np.searchsorted(key, covered_member.astype(np.int64) * (1 << 32) + covered_month - (window - 1), 'left')
+    cumulative = np.cumsum(values)
+    totals = cumulative[row] - np.where(starts > 0, cumulative[np.maximum(starts - 1, 0)], 0.0)
+    return covered_member, covered_month, totals
+
+
+def _percentiles_by_month(month, values, quantiles):
+    """
+    Per-month percentiles (nearest rank) from one value sort plus a radix sort on month.
+    """
+    order = np.argsort(values, kind='stable')
+    # Month numbers span a small range, so a stable sort on int16 offsets is a radix sort.
+    month_offset = (month - month.min()).astype(np.int16)
+    order = order[np.argsort(month_offset[order], kind='stable')]
+    month_sorted, values_sorted = month[order], values[order]
+    starts = np.flatnonzero(np.r_[True, month_sorted[1:] != month_sorted[:-1]])
+    counts = np.diff(np.r_[starts, len(month_sorted)])
+    result = {'yearmo': month_to_yearmo(month_sorted[starts]), 'members': counts}
+    for q in quantiles:
+        rank = starts + np.clip(np.ceil(counts * q / 100.0).astype(np.int64) - 1, 0, counts - 1)
+        result[f'p{q}'] = values_sorted[rank]
+    return result
+
+
+def rollup(member, yearmo, setting, lob, amounts, percentile_amount='AMT_PAID',
+           quantiles=DEFAULT_QUANTILES, window=WINDOW_MONTHS):
+    """
+    Aggregates claim lines per member, month, service setting and line of business.
+
+    Args:
+        member: Non-negative int member ids, one per claim line.
+        yearmo: YYYYMM integers. Lines with a missing or invalid value (see
+                valid_yearmo) are left out and counted in Rollup.dropped.
+        setting: Non-negative SERVICE_SETTING codes (-1 for missing).
+        lob: Non-negative PAYER_LOB codes (-1 for missing).
+        amounts (dict): Amount name -> float array; NaN counts as 0.
+        percentile_amount (str): Amount whose trailing-window distribution
+                                 is summarized per month, over every member
+                                 whose window covers the month.
+        quantiles (tuple): Percentiles to report, in 0-100.
+        window (int): Trailing window length in months.
+
+    Returns:
+        Rollup
+    """
+    rows = len(member)
+    valid = valid_yearmo(yearmo)
+    dropped = int(len(valid) - np.count_nonzero(valid))
+    if dropped:
+        member, yearmo, setting, lob = (np.asarray(values)[valid] for values in (member, yearmo, setting, lob))
+        amounts = {name: np.asarray(values)[valid] for name, values in amounts.items()}
+    member = np.asarray(member, dtype=np.int64)
+    month = yearmo_to_month(yearmo)
+    base_month = month.min() if len(month) else 0
+    month = month - base_month
+    # Missing setting / lob (-1) get their own bucket at code 0.
+    setting = np.asarray(setting, dtype=np.int64) + 1
+    lob = np.asarray(lob, dtype=np.int64) + 1
+    n_months = int(month.max()) + 1 if len(month) else 1
+    n_settings = int(setting.max()) + 1 if len(setting) else 1
+    n_lobs = int(lob.max()) + 1 if len(lob) else 1
+    amounts = {name: np.nan_to_num(np.asarray(values, dtype=np.float64)) for name, values in amounts.items()}
+
+    keys = ((member * n_months + month) * n_settings + setting) * n_lobs + lob
+    groups, inverse = _group(keys)
+    sums = _sums(inverse, len(groups), amounts)
+    group_lob = groups % n_lobs
+    rest = groups // n_lobs
+    group_setting = rest % n_settings
+    rest //= n_settings
+    group_month = rest % n_months
+    group_member = rest // n_months
+    detail = {
+        'member': group_member.astype(np.int32),
+        'yearmo': month_to_yearmo(group_month + base_month),
+        'setting': (group_setting - 1).astype(np.int16),
+        'lob': (group_lob - 1).astype(np.int16),
+        **sums,
+    }
+
+    # Detail groups are sorted by member then month, so member-month totals
+    # are segmented sums over the runs of equal (member, month).
+    mm_keys = group_member * n_months + group_month
+    run_starts = np.flatnonzero(np.r_[True, mm_keys[1:] != mm_keys[:-1]]) if len(mm_keys) else np.empty(0, np.int64)
+    mm_member = group_member[run_starts]
+    mm_month = group_month[run_starts]
+    member_month = {'member': mm_member.astype(np.int32), 'yearmo': month_to_yearmo(mm_month + base_month)}
+    for name, values in sums.items():
+        member_month[name] = np.add.reduceat(values, run_starts) if len(run_starts) else values[:0]
+    window_starts = _window_starts(mm_member, mm_month, window)
+    for name in amounts:
+        member_month[f'{name}_12M'] = _trailing_window(window_starts, member_month[name])
+
+    percentiles = {}
+    if percentile_amount in amounts and len(run_starts):
+        _, covered_month, totals = _covered_windows(mm_member, mm_month, member_month[percentile_amount], window,
+                                                    int(mm_month.max()))
+        percentiles = _percentiles_by_month(covered_month + base_month, totals, quantiles)
+
+    return Rollup(detail, member_month, percentiles, rows=rows, dropped=dropped)
+
+
+def rollup_store(store, amounts=ROLLUP_AMOUNTS, **kwargs):
+    """
+    Runs `rollup` over every claim line of a ClaimsStore.
+
+    The store's memory-mapped columns are used directly; setting and lob
+    codes index `store.dictionary('service_setting')` / `('payer_lob')`.
+    """
+    return rollup(
+        store.column('MEMBER_ID'),
+        store.column('YEARMO'),
+        store.column('SERVICE_SETTING'),
+        store.column('PAYER_LOB'),
+        {name: store.column(name) for name in amounts},
+        **kwargs,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-member cost rollups from a claims store.")
+    parser.add_argument('store_path')
+    parser.add_argument('--member', help="MEMBER_ID to print monthly totals for")
+    args = parser.parse_args()
+
+    store = ClaimsStore(args.store_path)
+    result = rollup_store(store)
+    _, member_month, percentiles = result.to_frames()
+    print(f"{result.rows:,} claim lines -> {len(result.detail['member']):,} groups, "
+          f"{len(member_month):,} member-months")
+    if result.dropped:
+        print(f"{result.dropped:,} claim lines without a valid YEARMO were left out")
+    print(percentiles.to_string(index=False))
+    if args.member:
+        member_id = store.lookup('person', args.member)
+        print(pd.DataFrame(result.member(member_id)).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
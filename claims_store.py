@@ -0,0 +1,401 @@
+"""
+Compact columnar store for claims extracts, read through np.memmap.
+
+A store is a directory of raw fixed-width NumPy column files plus JSON
+dictionaries and a meta.json describing them:
+
+- 25-character keys (PRIMARY_PERSON_KEY/MEMBER_ID, the BILL/REF/ATT_PROV_KEYs,
+  CLAIM_ID_KEY) and codes (PROC_CODE, NDC_CODE, ...) are dictionary-encoded
+  to int32 ids (int8/int16 for low-cardinality flags); -1 means missing.
+- Amounts are float32, dates int32 days since 1970-01-01 (MISSING_DATE when
+  absent), small integers int16/int32.
+- The 30 ICD_DIAG slots and 30 ICD_PROC_CODE slots are stored sparsely in
+  CSR form: per-row offsets into flat code, slot-position and POA arrays.
+
+Readers map the column files with np.memmap, so opening a store is instant
+and concurrent analytics processes share the page cache instead of each
+re-parsing the CSV.
+
+Usage:
+    python claims_store.py build HHealth_truncated.csv claims_store/
+    python claims_store.py info claims_store/
+"""
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from claims_ingest import (
+    DEFAULT_BLOCK_BYTES,
+    DIAG_COLUMNS,
+    POA_COLUMNS,
+    PROC_COLUMNS,
+    iter_blocks,
+    parse_block,
+    read_header,
+)
+
+FORMAT_VERSION = 1
+MISSING_DATE = np.iinfo(np.int32).min
+
+# column -> (dictionary name, id dtype); columns sharing a dictionary share ids
+DICTIONARY_COLUMNS = {
+    'PRIMARY_PERSON_KEY': ('person', 'int32'),
+    'MEMBER_ID': ('person', 'int32'),
+    'CLAIM_ID_KEY': ('claim', 'int32'),
+    'BILL_PROV_KEY': ('provider', 'int32'),
+    'REF_PROV_KEY': ('provider', 'int32'),
+    'ATT_PROV_KEY': ('provider', 'int32'),
+    'PROC_CODE': ('proc_code', 'int32'),
+    'NDC_CODE': ('ndc', 'int32'),
+    'ICD_DIAG_ADMIT': ('icd', 'int32'),
+    'REV_CODE': ('rev_code', 'int16'),
+    'MS_DRG': ('ms_drg', 'int16'),
+    'POS': ('pos', 'int16'),
+    'SV_STAT': ('sv_stat', 'int8'),
+    'RELATION': ('relation', 'int8'),
+    'PAYER_LOB': ('payer_lob', 'int8'),
+    'PAYER_TYPE': ('payer_type', 'int8'),
+    'SERVICE_SETTING': ('service_setting', 'int8'),
+    'FORM_TYPE': ('form_type', 'int8'),
+    'CLAIM_IN_NETWORK': ('claim_in_network', 'int8'),
+}
+INTEGER_COLUMNS = {
+    'SERVICE_LINE': 'int16',
+    'YEARMO': 'int32',
+    'AGE_ON_DOS': 'int16',
+    'DIAGNOSTIC_CONDITION_CATEGORY_ID': 'int16',
+}
+DATE_COLUMNS = ['FROM_DATE', 'TO_DATE', 'PAID_DATE', 'ADM_DATE', 'DIS_DATE']
+FLOAT_COLUMNS = [
+    'RX_DAYS_SUPPLY', 'RX_QTY_DISPENSED', 'RX_DRUG_COST', 'RX_INGR_COST',
+    'AMT_BILLED', 'AMT_ALLOWED', 'AMT_COB', 'AMT_COPAY', 'AMT_DEDUCT',
+    'AMT_COINS', 'AMT_PAID', 'AMT_DISALLOWED', 'SV_UNITS',
+]
+
+# CSR arrays: name -> (dtype, dictionary name or None)
+CSR_ARRAYS = {
+    'diag_offsets': ('int64', None),
+    'diag_codes': ('int32', 'icd'),
+    'diag_positions': ('int8', None),
+    'diag_poa': ('int8', 'poa'),
+    'proc_offsets': ('int64', None),
+    'proc_codes': ('int32', 'icd_proc'),
+    'proc_positions': ('int8', None),
+}
+
+
+class KeyDictionary:
+    """
+    Append-only value -> id mapping, grown block by block.
+    """
+
+    def __init__(self, dtype='int32', values=()):
+        self.dtype = np.dtype(dtype)
+        self.values = list(values)
+        self.ids = {value: i for i, value in enumerate(self.values)}
+
+    def encode(self, values):
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        mapping = np.empty(len(uniques), dtype=self.dtype)
+        for i, value in enumerate(np.asarray(uniques, dtype=object)):
+            value_id = self.ids.get(value)
+            if value_id is None:
+                value_id = len(self.values)
+                if value_id > np.iinfo(self.dtype).max:
+                    raise ValueError(f"Dictionary overflow: more than {value_id} values for {self.dtype}")
+                self.ids[value] = value_id
+                self.values.append(value)
+            mapping[i] = value_id
+        codes = np.asarray(codes)
+        if not len(mapping):
+            return np.full(len(codes), -1, dtype=self.dtype)
+        encoded = mapping[np.maximum(codes, 0)]
+        encoded[codes < 0] = -1
+        return encoded
+
+
+def _encode_dates(series):
+    days = series.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]').astype(np.int64)
+    return np.where(series.isna().to_numpy(), MISSING_DATE, days).astype(np.int32)
+
+
+def _encode_csr(df, code_columns, dictionary, poa_columns=None, poa_dictionary=None):
+    codes = df[code_columns].to_numpy(dtype=object)
+    present = pd.notna(codes)
+    counts = present.sum(axis=1)
+    rows, slots = np.nonzero(present)
+    flat_codes = dictionary.encode(codes[rows, slots])
+    positions = (slots + 1).astype(np.int8)
+    poa = None
+    if poa_columns is not None:
+        poa = poa_dictionary.encode(df[poa_columns].to_numpy(dtype=object)[rows, slots])
+    return counts, flat_codes, positions, poa
+
+
+class ClaimsStoreBuilder:
+    """
+    Streams parsed claim blocks into column files in a new store directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path)
+        self.rows = 0
+        self.dictionaries = {}
+        self._files = {}
+        self._diag_total = 0
+        self._proc_total = 0
+        self._write('diag_offsets', np.zeros(1, dtype=np.int64))
+        self._write('proc_offsets', np.zeros(1, dtype=np.int64))
+
+    def _dictionary(self, name, dtype):
+        if name not in self.dictionaries:
+            self.dictionaries[name] = KeyDictionary(dtype)
+        return self.dictionaries[name]
+
+    def _write(self, name, array):
+        f = self._files.get(name)
+        if f is None:
+            f = self._files[name] = open(os.path.join(self.path, f'{name}.bin'), 'wb')
+        np.ascontiguousarray(array).tofile(f)
+
+    def append(self, df):
+        """
+        Encodes and appends one parsed block (see claims_ingest.parse_block).
+        """
+        for column, (dictionary, dtype) in DICTIONARY_COLUMNS.items():
+            self._write(column, self._dictionary(dictionary, dtype).encode(df[column]))
+        for column, dtype in INTEGER_COLUMNS.items():
+            self._write(column, df[column].fillna(-1).to_numpy(dtype=dtype))
+        for column in DATE_COLUMNS:
+            self._write(column, _encode_dates(df[column]))
+        for column in FLOAT_COLUMNS:
+            self._write(column, df[column].to_numpy(dtype=np.float32, na_value=np.nan))
+
+        counts, codes, positions, poa = _encode_csr(
+            df, DIAG_COLUMNS, self._dictionary('icd', 'int32'),
+            POA_COLUMNS, self._dictionary('poa', 'int8'),
+        )
+        self._write('diag_offsets', self._diag_total + np.cumsum(counts, dtype=np.int64))
+        self._write('diag_codes', codes)
+        self._write('diag_positions', positions)
+        self._write('diag_poa', poa)
+        self._diag_total += len(codes)
+
+        counts, codes, positions, _ = _encode_csr(df, PROC_COLUMNS, self._dictionary('icd_proc', 'int32'))
+        self._write('proc_offsets', self._proc_total + np.cumsum(counts, dtype=np.int64))
+        self._write('proc_codes', codes)
+        self._write('proc_positions', positions)
+        self._proc_total += len(codes)
+
+        self.rows += len(df)
+
+    def finish(self, source=None):
+        """
+        Closes the column files and writes the dictionaries and meta.json.
+        """
+        for f in self._files.values():
+            f.close()
+        os.makedirs(os.path.join(self.path, 'dictionaries'), exist_ok=True)
+        for name, dictionary in self.dictionaries.items():
+            with open(os.path.join(self.path, 'dictionaries', f'{name}.json'), 'w') as f:
+                json.dump(dictionary.values, f)
+
+        columns = {}
+        for column, (dictionary, dtype) in DICTIONARY_COLUMNS.items():
+            columns[column] = {'dtype': dtype, 'dictionary': dictionary}
+        for column, dtype in INTEGER_COLUMNS.items():
+            columns[column] = {'dtype': dtype, 'missing': -1}
+        for column in DATE_COLUMNS:
+            columns[column] = {'dtype': 'int32', 'unit': 'days', 'missing': int(MISSING_DATE)}
+        for column in FLOAT_COLUMNS:
+            columns[column] = {'dtype': 'float32'}
+        meta = {
+            'format_version': FORMAT_VERSION,
+            'rows': self.rows,
+            'source': source,
+            'columns': columns,
+            'csr': {
+                name: {'dtype': dtype, 'dictionary': dictionary,
+                       'length': self.rows + 1 if name.endswith('_offsets')
+                       else self._diag_total if name.startswith('diag') else self._proc_total}
+                for name, (dtype, dictionary) in CSR_ARRAYS.items()
+            },
+        }
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        return meta
+
+
+def build_claims_store(csv_path, store_path, block_bytes=DEFAULT_BLOCK_BYTES, overwrite=False):
+    """
+    Builds a columnar store from a claims CSV in one streaming pass.
+
+    The store is written to a temporary sibling directory and renamed into
+    place, so readers never observe a half-built store.
+
+    Returns:
+        dict: The store's meta.json contents.
+    """
+    store_path = os.path.abspath(store_path)
+    if os.path.exists(store_path) and not overwrite:
+        raise FileExistsError(f"Claims store already exists: {store_path}")
+    tmp_path = store_path + '.building'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+
+    header, header_len = read_header(csv_path)
+    builder = ClaimsStoreBuilder(tmp_path)
+    try:
+        for _, block in iter_blocks(csv_path, header_len, block_bytes=block_bytes):
+            builder.append(parse_block(header, block))
+        meta = builder.finish(source=os.path.abspath(csv_path))
+    except BaseException:
+        for f in builder._files.values():
+            f.close()
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    if os.path.exists(store_path):
+        shutil.rmtree(store_path)
+    os.rename(tmp_path, store_path)
+    return meta
+
+
+class ClaimsStore:
+    """
+    Read-only view of a claims store; columns are memory-mapped on first access.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta['format_version'] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported claims store format: {self.meta['format_version']}")
+        self.rows = self.meta['rows']
+        self._arrays = {}
+        self._dictionaries = {}
+        self._lookups = {}
+
+    def __len__(self):
+        return self.rows
+
+    def _map(self, name, dtype, length):
+        if name not in self._arrays:
+            if length == 0:
+                self._arrays[name] = np.empty(0, dtype=dtype)
+            else:
+                self._arrays[name] = np.memmap(os.path.join(self.path, f'{name}.bin'),
+                                               dtype=dtype, mode='r', shape=(length,))
+        return self._arrays[name]
+
+    @property
+    def columns(self):
+        return list(self.meta['columns'])
+
+    def column(self, name):
+        """
+        Returns the raw (encoded) column as a read-only memory-mapped array.
+        """
+        spec = self.meta['columns'][name]
+        return self._map(name, spec['dtype'], self.rows)
+
+    def csr(self, name):
+        """
+        Returns one CSR array: diag_offsets/codes/positions/poa or proc_offsets/codes/positions.
+        """
+        spec = self.meta['csr'][name]
+        return self._map(name, spec['dtype'], spec['length'])
+
+    def dictionary(self, name):
+        """
+        Returns the values of a dictionary as an object array indexed by id.
+        """
+        if name not in self._dictionaries:
+            with open(os.path.join(self.path, 'dictionaries', f'{name}.json')) as f:
+                self._dictionaries[name] = np.array(json.load(f), dtype=object)
+        return self._dictionaries[name]
+
+    def lookup(self, dictionary, value):
+        """
+        Returns the id of `value` in a dictionary, or -1 if it never occurs.
+        """
+        if dictionary not in self._lookups:
+            self._lookups[dictionary] = {v: i for i, v in enumerate(self.dictionary(dictionary))}
+        return self._lookups[dictionary].get(value, -1)
+
+    def decode(self, name, ids=None):
+        """
+        Decodes a dictionary-encoded column (or the given ids) back to values.
+        """
+        dictionary = self.dictionary(self.meta['columns'][name]['dictionary'])
+        ids = self.column(name) if ids is None else np.asarray(ids)
+        if not len(dictionary):
+            return np.full(len(ids), None, dtype=object)
+        values = dictionary[np.maximum(ids, 0)]
+        values[ids < 0] = None
+        return values
+
+    def dates(self, name):
+        """
+        Returns a date column as datetime64[D], with NaT for missing dates.
+        """
+        days = self.column(name)
+        out = days.astype('datetime64[D]')
+        out[days == MISSING_DATE] = np.datetime64('NaT')
+        return out
+
+    def diagnoses(self, row):
+        """
+        Returns the ICD diagnosis codes of one claim line in slot order.
+        """
+        offsets = self.csr('diag_offsets')
+        ids = self.csr('diag_codes')[offsets[row]:offsets[row + 1]]
+        return self.dictionary('icd')[ids].tolist()
+
+    def procedures(self, row):
+        """
+        Returns the ICD procedure codes of one claim line in slot order.
+        """
+        offsets = self.csr('proc_offsets')
+        ids = self.csr('proc_codes')[offsets[row]:offsets[row + 1]]
+        return self.dictionary('icd_proc')[ids].tolist()
+
+    def nbytes(self):
+        """
+        Returns the on-disk size of all column and CSR files.
+        """
+        return sum(
+            os.path.getsize(os.path.join(self.path, name))
+            for name in os.listdir(self.path) if name.endswith('.bin')
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or inspect a columnar claims store.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="Build a store from a claims CSV")
+    build.add_argument('csv_path')
+    build.add_argument('store_path')
+    build.add_argument('--overwrite', action='store_true')
+    info = subparsers.add_parser('info', help="Print a store's size and dictionary counts")
+    info.add_argument('store_path')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        meta = build_claims_store(args.csv_path, args.store_path, overwrite=args.overwrite)
+        print(f"Built {args.store_path} with {meta['rows']:,} claim lines.")
+    else:
+        store = ClaimsStore(args.store_path)
+        print(f"{store.rows:,} claim lines, {store.nbytes() / (1024 * 1024):.1f} MB of column data")
+        for name in sorted({spec['dictionary'] for spec in store.meta['columns'].values()
+                            if spec.get('dictionary')} | {'icd', 'icd_proc', 'poa'}):
+            print(f"  {name:<18}{len(store.dictionary(name)):>12,} values")
+
+
+if __name__ == '__main__':
+    main()
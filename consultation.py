@@ -1,118 +1,41 @@
 import streamlit as st
-import pandas as pd
 import datetime
-import requests
-from bs4 import BeautifulSoup
-import plotly.express as px
-import plotly.graph_objects as go
-import json
-import time
 import logging
-import google.generativeai as genai
-import os
-from dotenv import load_dotenv
 
 # Import the user data fetching code
-from dashboard import get_user_by_email, verify_user_session
+from db import get_user_by_email
+from utils import verify_user_session
+
+# Trends are refreshed in the background into the trending_topics table
+from trends import get_trending_data
+
+# Condition -> medication lookups
+from medications import MEDICATION_INDEX
+
+# PubMed evidence counts and top articles
+from pubmed import get_medication_evidence, search_url
 
 # Configure logging for debugging purposes
 logging.basicConfig(level=logging.DEBUG)
 
-# Load environment variables
-load_dotenv()
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-
-# Select the Generative AI model
-model = genai.GenerativeModel('gemini-pro')
-
-# Function to get Google Trends data via a simple request
-def get_trending_data():
-    url = "https://trends.google.com/trending?geo=US&category=7&hours=168"
-    try:
-        # Make a GET request to the trends URL
-        response = requests.get(url)
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'html.parser')
-            trending_items = []
-            for trend_item in soup.find_all('div', class_='feed-item'):
-                trend_name = trend_item.find('div', class_='feed-item-title').text.strip()
-                search_volume = trend_item.find('div', class_='feed-item-stats').text.strip() if trend_item.find('div', class_='feed-item-stats') else "N/A"
-                explore_link = trend_item.find('a', href=True)['href']
-                trending_items.append({
-                    'Trends': trend_name,
-                    'Search volume': search_volume,
-                    'Explore link': f"https://trends.google.com{explore_link}"
-                })
-            return pd.DataFrame(trending_items)
-        else:
-            st.error("Failed to retrieve Google Trends data.")
-            return pd.DataFrame()
-    except Exception as e:
-        st.error(f"Error fetching data: {e}")
-        logging.error(f"Error fetching data: {e}")
-        return pd.DataFrame()
-
 # Function to get medication recommendations based on health conditions
 def get_medication_recommendations(health_conditions):
-    medication_data = {
-        "obesity": ["Wegovy", "Ozempic", "Mounjaro", "Phentermine"],  
-        "diabetes": ["Metformin", "Insulin", "GLP-1 Agonists", "SGLT2 Inhibitors"],
-        "high blood pressure": ["Atenolol", "Lisinopril", "Losartan", "Amlodipine"],
-        "sunset anxiety": ["Xanax", "Zoloft", "Lexapro", "Ativan"],
-        "arthritis": ["Methotrexate", "Sulfasalazine", "Humira", "Corticosteroids"],
-        "depression": ["SSRIs", "SNRIs", "Citalopram", "Sertraline", "Fluoxetine"],
-        "anxiety": ["Buspirone", "Xanax", "Ativan", "Valium"],
-        "asthma": ["Albuterol", "Salbutamol", "Advair", "Fluticasone"],
-        "COPD": ["Spiriva", "Symbicort", "Albuterol", "Fluticasone"],
-        "cholesterol": ["Statins", "Lipitor", "Atorvastatin", "Zocor"],
-        "sleep apnea": ["CPAP therapy", "BiPAP", "Oxygen therapy"],
-        "eczema": ["Topical steroids", "Hydrocortisone", "Tacrolimus"],
-        "insomnia": ["Ambien", "Melatonin", "Zolpidem"],
-        "acne": ["Benzoyl Peroxide", "Tretinoin", "Accutane", "Doxycycline"],
-        "allergies": ["Antihistamines", "Claritin", "Zyrtec", "Benadryl"],
-        "migraine": ["Sumatriptan", "Zolmitriptan", "Amitriptyline", "Topiramate"],
-        "heart disease": ["Beta-blockers", "Aspirin", "ACE inhibitors", "Statins"],
-        "gout": ["Allopurinol", "Colchicine", "Indomethacin"],
-        "cancer": ["Chemotherapy", "Immunotherapy", "Radiation therapy"],
-        "stroke": ["Aspirin", "Clopidogrel", "Warfarin"],
-        "thyroid problems": ["Levothyroxine", "Methimazole", "Liothyronine"],
-        "kidney disease": ["ACE inhibitors", "Diuretics"],
-        "liver disease": ["Antivirals", "Interferon", "Ribavirin"]
-    }
-    
-    recommendations = {}
-    for condition in health_conditions:
-        if condition in medication_data:
-            recommendations[condition] = medication_data[condition]
-        else:
-            recommendations[condition] = "No specific medications found"
-    return recommendations
+    return MEDICATION_INDEX.recommendations(health_conditions)
 
 # Function to get PubMed links for medications
 def get_pubmed_links(medications):
-    pubmed_links = {}
-    for medication in medications:
-        search_url = f"https://pubmed.ncbi.nlm.nih.gov/?term={medication.replace(' ', '+')}"
-        pubmed_links[medication] = search_url
-    return pubmed_links
+    return {medication: search_url(medication) for medication in medications}
 
 # Function to plot a health trend graph
 def plot_health_trend(health_conditions, trending_data):
-    trend_conditions = {
-        "obesity": "Wegovy, Ozempic",
-        "diabetes": "Metformin, Insulin",
-        "high blood pressure": "Atenolol, Lisinopril",
-        "sunset anxiety": "Xanax, Zoloft",
-    }
-
-    trend_counts = []
-    for condition in health_conditions:
-        if condition in trend_conditions:
-            meds = trend_conditions[condition].split(", ")
-            trend_counts.append(len(meds))
+    # Imported on first use so the page renders before plotly is loaded
+    import plotly.graph_objects as go
+
+    conditions = [c for c in health_conditions if MEDICATION_INDEX.trending_medications(c)]
+    trend_counts = [len(MEDICATION_INDEX.trending_medications(c)) for c in conditions]
 
     fig = go.Figure()
-    fig.add_trace(go.Bar(x=health_conditions, y=trend_counts, name="Trending Health Medications"))
+    fig.add_trace(go.Bar(x=conditions, y=trend_counts, name="Trending Health Medications"))
     fig.update_layout(title="Trending Medications for Health Conditions", xaxis_title="Conditions", yaxis_title="Count of Medications")
     return fig
 
@@ -128,30 +51,39 @@ st.title("Trending Medications Based on Your Health")
 st.markdown(f"<h2>Welcome, {user['name']}!</h2>", unsafe_allow_html=True)
 health_conditions = st.multiselect(
     "Select Your Health Conditions:",
-    ["obesity", "diabetes", "high blood pressure", "sunset anxiety", "arthritis", "depression", "anxiety", "asthma", "COPD", "cholesterol", "sleep apnea", "eczema", "insomnia", "acne", "allergies", "migraine", "heart disease", "gout", "cancer", "stroke", "thyroid problems", "kidney disease", "liver disease"]
+    MEDICATION_INDEX.conditions,
+    # Preselect the conditions recognized in the user's profile
+    default=MEDICATION_INDEX.match_conditions(user['medical_conditions']),
 )
 
 if health_conditions:
     recommendations = get_medication_recommendations(health_conditions)
     st.subheader("Recommended Medications:")
     for condition, meds in recommendations.items():
-        st.write(f"**{condition.capitalize()}**: {', '.join(meds)}")
-
-    # Display PubMed links for the medications
-    pubmed_links = get_pubmed_links([med for meds in recommendations.values() for med in meds])
-    st.subheader("PubMed Links for Medications:")
-    for medication, link in pubmed_links.items():
-        st.write(f"[{medication}]({link})")
+        st.write(f"**{condition.capitalize()}**: {', '.join(meds) if isinstance(meds, list) else meds}")
+
+    # Display PubMed evidence for the medications (fetched concurrently, cached in SQLite)
+    medications = [med for meds in recommendations.values() if isinstance(meds, list) for med in meds]
+    with st.spinner("Looking up PubMed evidence..."):
+        evidence = get_medication_evidence(medications)
+    st.subheader("PubMed Evidence for Medications:")
+    for medication, found in evidence.items():
+        count = f"{found['count']:,} articles" if found['count'] is not None else "evidence unavailable"
+        st.write(f"[{medication}]({found['search_url']}) — {count}")
+        for article in found['articles']:
+            st.caption(f"[{article['title']}]({article['url']})")
 
 else:
     st.write("Select your health conditions to get medication recommendations.")
 
-# Load and display the trending data (if available)
+# Load and display the trending data (if available); a stale batch is
+# shown while the background refresher fetches a new one
 df = get_trending_data()
 
 if not df.empty:
     st.subheader("Trending Topics")
-    st.write(f"Data loaded at {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    fetched_at = datetime.datetime.fromtimestamp(df.attrs['fetched_at'])
+    st.write(f"Data loaded at {fetched_at.strftime('%Y-%m-%d %H:%M:%S')}")
     
     # Filter data based on user selection or other criteria
     trending_filter = st.text_input("Search for a specific trend:")
@@ -167,7 +99,7 @@ if not df.empty:
     st.plotly_chart(health_trend_fig)
 
 else:
-    st.warning("No trending data available.")
+    st.warning("No trending data available yet. It is being refreshed in the background.")
 
 # Display additional information (e.g., about the trend, its breakdown)
 if not df.empty:
@@ -178,8 +110,3 @@ if not df.empty:
 
 # Log successful data fetch for debugging
 logging.debug(f"Data loaded at {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-
-def verify_user_session():
-    if 'logged_in' not in st.session_state or not st.session_state['logged_in']:
-        st.error("You need to log in to access this page.")
-        st.stop()
\ No newline at end of file
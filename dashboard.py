@@ -1,16 +1,7 @@
 import streamlit as st
-from db import create_health_recommendation, get_health_recommendation_db, get_user_by_email
+from db import create_health_recommendation, get_dashboard_summary, update_user_info
 from utils import apply_custom_css, verify_user_session
-import google.generativeai as genai
-import os
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-
-# Select the Generative AI model
-model = genai.GenerativeModel('gemini-pro')
+from recommendations import stream_health_recommendations
 
 # Apply custom styling
 apply_custom_css()
@@ -18,9 +9,10 @@ apply_custom_css()
 # Ensure user is logged in
 verify_user_session()
 
-# Retrieve the user's email from session state
+# Retrieve the user's email from session state; the profile and latest records come from one summary read
 user_email = st.session_state['email']
-user = get_user_by_email(user_email)
+summary = get_dashboard_summary(user_email)
+user = summary['user']
 
 # Dashboard layout
 st.markdown("<h1 class='title'>🏥 Health Dashboard</h1>", unsafe_allow_html=True)
@@ -39,30 +31,59 @@ if user['weight'] and user['height'] > 0:
 else:
     st.markdown(f"<div class='box'>Add your Weight and Height to get your **BMI**</div>", unsafe_allow_html=True)
 
-st.markdown("---")
+# Weight readings are kept as a history, so BMI can be followed over time
+with st.form("log_weight"):
+    new_weight = st.number_input("Log your weight (kg)", min_value=1.0, value=float(user['weight'] or 70))
+    if st.form_submit_button("Save weight"):
+        update_user_info(user_email, {'weight': new_weight})
+        st.rerun()
 
-# Get health recommendations from Google's Generative AI
-def get_health_recommendations(user):
-    # Construct the user health profile for the AI model
-    user_profile = f"Name: {user['name']}, Age: {user['age']}, Gender: {user['gender']}, Weight: {user['weight']} kg, Height: {user['height']} cm, Medical Conditions: {user['medical_conditions']}, Health Goals: {user['health_goals']}"
-    
-    # Using `generate_text()` method for text generation
-    response = model.generate_text(prompt=f"Based on the following user profile, provide personalized health recommendations:\n{user_profile}")
+if st.toggle("Show weight and BMI history"):
+    # Imported on first use so the page renders before numpy and plotly are loaded
+    import plotly.graph_objects as go
+    from body_metrics import get_bmi_trend
 
-    # Return the generated text
-    return response['text']
+    trend = get_bmi_trend(user['id'])
+    if len(trend['time']) < 2:
+        st.info("Log your weight on a few different days to see a trend.")
+    else:
+        fig = go.Figure()
+        if trend['resolution'] != 'raw':
+            # Long histories are rolled up: show each period's range around its mean
+            fig.add_trace(go.Scatter(x=trend['time'], y=trend['bmi_max'], mode='lines', line_width=0, showlegend=False))
+            fig.add_trace(go.Scatter(x=trend['time'], y=trend['bmi_min'], mode='lines', line_width=0, fill='tonexty',
+                                     name="Range"))
+        fig.add_trace(go.Scatter(x=trend['time'], y=trend['bmi_mean'], mode='lines+markers', name="BMI"))
+        fig.update_layout(title="BMI over time", xaxis_title="Date", yaxis_title="BMI")
+        st.plotly_chart(fig)
+        st.caption(f"Trend: {trend['bmi_per_week']:+.2f} BMI ({trend['weight_per_week']:+.2f} kg) per week")
+
+st.markdown("---")
 
 # Recommendations Button
 if st.button("Get Health Recommendations"):
-    recommendations = get_health_recommendations(user)
     st.markdown("<h3 class='subtitle'>Health Recommendations</h3>", unsafe_allow_html=True)
-    st.markdown(f"<div class='recommendations'>{recommendations}</div>", unsafe_allow_html=True)
-    
-    # Save recommendations in the database
-    create_health_recommendation(user['id'], recommendations)
+    recommendations_box = st.empty()
+    # Identical profiles are answered from the response cache without calling the model;
+    # otherwise the text is rendered chunk by chunk as the model streams it
+    stream = stream_health_recommendations(user)
+    try:
+        for _ in stream:
+            recommendations_box.markdown(f"<div class='recommendations'>{stream.text}</div>", unsafe_allow_html=True)
+    finally:
+        # Stops the model stream when the script is interrupted (rerun or page change)
+        stream.close()
+
+    if stream.from_cache:
+        st.caption("Served from cache: your profile has not changed since these were generated.")
+    elif stream.completed:
+        # Save recommendations in the database
+        create_health_recommendation(user['id'], stream.text, stream.key)
+        summary = get_dashboard_summary(user_email)
+        st.caption(f"Generated in {stream.elapsed:.1f}s (first words after {stream.ttft:.2f}s).")
 
 # Display Previous Health Recommendations
-health_recommendation = get_health_recommendation_db(user['id'])
+health_recommendation = summary['latest_recommendation']
 if health_recommendation:
     st.markdown("<h3 class='subtitle'>Previous Health Recommendations</h3>", unsafe_allow_html=True)
     st.markdown(f"<div class='recommendations'>{health_recommendation['health_recommendation']}</div>", unsafe_allow_html=True)
@@ -1,6 +1,17 @@
 import os
+import atexit
+import functools
+import itertools
+import re
 import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from cache import TTLCache
+from metrics import record_error, register_collector, timed
+from write_behind import WriteBehindWriter
 
 # Load environment variables
 load_dotenv()
@@ -8,162 +19,1418 @@ load_dotenv()
 # SQLite connection setup
 DATABASE_PATH = os.getenv('SQLITE_DB_PATH', 'precision_health.db')
 
+# Sharded storage (see rebalance_shards.py). When SQLITE_SHARD_DIR is set,
+# each user's rows live in one shard file there, placed by user id, and
+# DATABASE_PATH becomes the directory database: the email -> (user_id, shard)
+# directory plus the tables that are not per user (caches, trends, jobs).
+SQLITE_SHARD_DIR = os.getenv('SQLITE_SHARD_DIR', '')
+SQLITE_SHARDS = int(os.getenv('SQLITE_SHARDS', '4'))  # shard count of a new directory
+SHARD_SCAN_WORKERS = int(os.getenv('SHARD_SCAN_WORKERS', '8'))
+if SQLITE_SHARD_DIR:
+    os.makedirs(SQLITE_SHARD_DIR, exist_ok=True)
+    DATABASE_PATH = os.path.join(SQLITE_SHARD_DIR, 'directory.db')
 
-def get_db_connection():
+# Connection tuning (see ConnectionPool._configure)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', '20000'))
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_POOL_MAX_IDLE = int(os.getenv('SQLITE_POOL_MAX_IDLE', '8'))
+
+# Write-behind logging for activities and consultations (see write_behind.py)
+WRITE_BEHIND_ENABLED = os.getenv('WRITE_BEHIND_ENABLED', '1') == '1'
+WRITE_BEHIND_MAX_BATCH = int(os.getenv('WRITE_BEHIND_MAX_BATCH', '500'))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', '0.5'))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv('WRITE_BEHIND_MAX_PENDING', '10000'))
+
+# Process-wide cache of users rows, keyed by ('email', email) and ('id', id)
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '4096'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))
+
+
+class ConnectionPool:
+    """
+    Keeps one long-lived SQLite connection per thread.
+
+    Streamlit runs every script rerun on a worker thread, so a connection is
+    bound to the calling thread on first use and handed back to the idle list
+    once that thread has exited. New threads then reuse an idle connection
+    instead of paying for a fresh connect and pragma setup.
+    """
+
+    def __init__(self, database_path, max_idle=SQLITE_POOL_MAX_IDLE):
+        self.database_path = database_path
+        self.max_idle = max_idle
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._bound = {}  # thread ident -> (thread, connection)
+        # thread ident -> [acquires since binding]; each list is only
+        # incremented by its own thread, so the fast path takes no lock
+        self._acquires = {}
+        self._idle = []
+        self._stats = {'created': 0, 'reused': 0, 'reclaimed': 0, 'closed': 0, 'acquired': 0}
+
+    def _configure(self, connection):
+        connection.row_factory = sqlite3.Row  # To return dictionary-like rows
+        connection.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+        # Only takes effect on a new, empty database; lets compaction return
+        # freed pages with PRAGMA incremental_vacuum (see activity_retention.py)
+        connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        if self.database_path != ':memory:':
+            connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute(f'PRAGMA synchronous = {SQLITE_SYNCHRONOUS}')
+        connection.execute(f'PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}')
+        connection.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+        return connection
+
+    def _reclaim_dead_threads(self):
+        # Caller must hold self._lock.
+        for ident, (thread, connection) in list(self._bound.items()):
+            if thread.is_alive():
+                continue
+            del self._bound[ident]
+            self._stats['acquired'] += self._acquires.pop(ident, [0])[0]
+            self._stats['reclaimed'] += 1
+            if connection.in_transaction:
+                connection.rollback()
+            if len(self._idle) < self.max_idle:
+                self._idle.append(connection)
+            else:
+                connection.close()
+                self._stats['closed'] += 1
+
+    def acquire(self):
+        """
+        Returns the connection bound to the current thread, binding one if needed.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            self._local.acquires[0] += 1
+            return connection
+
+        with self._lock:
+            self._reclaim_dead_threads()
+            if self._idle:
+                connection = self._idle.pop()
+                self._stats['reused'] += 1
+            else:
+                connection = self._configure(
+                    sqlite3.connect(self.database_path, check_same_thread=False)
+                )
+                self._stats['created'] += 1
+            thread = threading.current_thread()
+            self._bound[thread.ident] = (thread, connection)
+            acquires = self._acquires[thread.ident] = [1]
+
+        self._local.acquires = acquires
+        self._local.connection = connection
+        return connection
+
+    def release(self):
+        """
+        Detaches the current thread's connection and returns it to the idle list.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            return
+        self._local.connection = None
+        with self._lock:
+            self._bound.pop(threading.get_ident(), None)
+            self._stats['acquired'] += self._acquires.pop(threading.get_ident(), [0])[0]
+            if connection.in_transaction:
+                connection.rollback()
+            if len(self._idle) < self.max_idle:
+                self._idle.append(connection)
+            else:
+                connection.close()
+                self._stats['closed'] += 1
+
+    def close_all(self):
+        """
+        Closes every pooled connection. Threads reconnect lazily afterwards.
+        """
+        with self._lock:
+            connections = [conn for _, conn in self._bound.values()] + self._idle
+            self._bound.clear()
+            self._stats['acquired'] += sum(acquires[0] for acquires in self._acquires.values())
+            self._acquires.clear()
+            self._idle = []
+            for connection in connections:
+                try:
+                    connection.close()
+                except sqlite3.Error:
+                    pass
+                self._stats['closed'] += 1
+        self._local = threading.local()
+
+    def stats(self):
+        """
+        Returns a snapshot of the pool counters.
+        """
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['acquired'] += sum(acquires[0] for acquires in self._acquires.values())
+            snapshot['in_use'] = len(self._bound)
+            snapshot['idle'] = len(self._idle)
+        snapshot['database_path'] = self.database_path
+        return snapshot
+
+
+_pool = ConnectionPool(DATABASE_PATH)
+atexit.register(_pool.close_all)
+
+# Users listed under this shard in user_directory still have their rows in the
+# directory database itself (a single-file database being split into shards)
+DIRECTORY_SHARD = -1
+# Cached user_id -> shard entries read from user_directory
+USER_SHARD_CACHE_SIZE = int(os.getenv('USER_SHARD_CACHE_SIZE', '100000'))
+
+_shard_lock = threading.Lock()
+_shard_pools = None  # one ConnectionPool per shard, opened on first use
+_shard_log_writers = []  # one write-behind writer per shard
+_scan_executor = None
+_user_shards = TTLCache(max_size=USER_SHARD_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+def _connect(pool):
+    connection = pool.acquire()
+    if pool.database_path not in _schema_ready:
+        ensure_schema(connection, pool.database_path)
+    return connection
+
+
+def get_db_connection(user_id=None):
     """
-    Establish a connection to the SQLite database.
+    Returns the pooled connection to the SQLite database for the current thread.
+
+    The connection stays open between calls, so `with get_db_connection() as conn:`
+    scopes a transaction (commit on success, rollback on error) rather than the
+    connection's lifetime. The schema is brought up to date on first use.
+
+    With sharded storage, pass user_id to get the shard holding that user's
+    rows; without it the connection is to the directory database. In
+    single-file mode user_id makes no difference.
+
     Returns:
         connection: SQLite connection object.
     """
-    connection = sqlite3.connect(DATABASE_PATH)
-    connection.row_factory = sqlite3.Row  # To return dictionary-like rows
-    return connection
+    if user_id is None or not SQLITE_SHARD_DIR:
+        return _connect(_pool)
+    return _shard_connection(get_user_shard(user_id))
 
 
-def create_tables():
+def get_pool_stats():
     """
-    Create all necessary tables for the application if they don't exist.
+    Returns connection pool statistics.
+
+    Returns:
+        dict: Counters for created, reused, reclaimed, closed and acquired
+              connections plus the current in-use and idle counts.
     """
-    with get_db_connection() as conn:
+    return _pool.stats()
+
+
+def close_db_connections():
+    """
+    Closes all pooled connections, e.g. before swapping the database file.
+    """
+    _log_writer.close()
+    _close_shards()
+    _pool.close_all()
+
+
+def _make_log_writer(connect, name):
+    return WriteBehindWriter(
+        connect,
+        max_batch=WRITE_BEHIND_MAX_BATCH,
+        flush_interval=WRITE_BEHIND_FLUSH_INTERVAL,
+        max_pending=WRITE_BEHIND_MAX_PENDING,
+        enabled=WRITE_BEHIND_ENABLED,
+        name=name,
+    )
+
+
+_log_writer = _make_log_writer(get_db_connection, 'db-log-writer')
+
+
+def _get_log_writer(user_id):
+    """
+    The write-behind writer of a user's shard, so each shard commits its own
+    batches; the single writer in single-file mode.
+    """
+    shard = get_user_shard(user_id)
+    if shard is None or shard == DIRECTORY_SHARD:
+        return _log_writer
+    _get_shard_pools()
+    return _shard_log_writers[shard]
+
+
+def flush_pending_writes(timeout=5.0):
+    """
+    Waits until queued activity and consultation rows are committed.
+
+    Call this before reading back rows written through `save_user_activity` or
+    `create_consultation_log` when read-your-writes matters.
+
+    Returns:
+        bool: True if everything queued so far was written within `timeout`.
+    """
+    return all([writer.flush(timeout) for writer in [_log_writer, *_shard_log_writers]])
+
+
+def get_write_behind_stats():
+    """
+    Returns write-behind counters (enqueued, written, batches, sync_writes,
+    errors) and the number of rows still pending, summed over the writers.
+    """
+    totals = {}
+    for writer in [_log_writer, *_shard_log_writers]:
+        for key, value in writer.stats().items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def shard_path(shard):
+    """
+    Returns the database file of a shard; DIRECTORY_SHARD is the directory database.
+    """
+    if shard == DIRECTORY_SHARD:
+        return DATABASE_PATH
+    return os.path.join(SQLITE_SHARD_DIR, f'shard_{shard:03d}.db')
+
+
+def _get_shard_pools():
+    """
+    Opens a pool (and a write-behind writer) per shard on first use. The
+    shard count is the one recorded in shard_layout; a new directory starts
+    with SQLITE_SHARDS.
+    """
+    global _shard_pools
+    if _shard_pools is None:
+        with _shard_lock:
+            if _shard_pools is None:
+                with _connect(_pool) as conn:
+                    conn.execute('''
+                        INSERT OR IGNORE INTO shard_layout (id, shard_count, updated_at) VALUES (1, ?, ?)
+                    ''', (SQLITE_SHARDS, time.time()))
+                    count = conn.execute('SELECT shard_count FROM shard_layout WHERE id = 1').fetchone()[0]
+                _shard_log_writers[:] = [
+                    _make_log_writer(functools.partial(_shard_connection, shard), f'db-log-writer-{shard}')
+                    for shard in range(count)
+                ]
+                _shard_pools = [ConnectionPool(shard_path(shard)) for shard in range(count)]
+    return _shard_pools
+
+
+def _close_shards():
+    """
+    Writes queued rows, closes the shard pools and forgets cached placements;
+    the next call reopens them from shard_layout.
+    """
+    global _shard_pools
+    with _shard_lock:
+        for writer in _shard_log_writers:
+            writer.close()
+        for pool in _shard_pools or []:
+            pool.close_all()
+        _shard_log_writers[:] = []
+        _shard_pools = None
+    _user_shards.clear()
+
+
+def _shard_connection(shard):
+    if shard is None or shard == DIRECTORY_SHARD:
+        return _connect(_pool)
+    return _connect(_get_shard_pools()[shard])
+
+
+def place_user(user_id, shard_count):
+    """
+    Returns the shard a user id belongs on when there are shard_count shards.
+
+    This is a jump consistent hash (Lamping and Veach): growing from n to
+    n + 1 shards moves only the ids that land on the new shard, and shrinking
+    moves only the ids on the shards removed.
+    """
+    key = (int(user_id) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF  # spread consecutive ids
+    shard, candidate = -1, 0
+    while candidate < shard_count:
+        shard = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((shard + 1) * (1 << 31) / ((key >> 33) + 1))
+    return shard
+
+
+def get_user_shard(user_id):
+    """
+    Returns the shard holding a user's rows, read (and cached) from user_directory.
+
+    An id without a directory entry maps to the shard a new user with that
+    id would be placed on. None in single-file mode.
+    """
+    if not SQLITE_SHARD_DIR:
+        return None
+    shard = _user_shards.get(user_id)
+    if shard is None:
+        row = _connect(_pool).execute('SELECT shard FROM user_directory WHERE user_id = ?', (user_id,)).fetchone()
+        if row is None:
+            return place_user(user_id, len(_get_shard_pools()))
+        shard = row[0]
+        _user_shards.set(user_id, shard)
+    return shard
+
+
+def _get_scan_executor():
+    global _scan_executor
+    with _shard_lock:
+        if _scan_executor is None:
+            _scan_executor = ThreadPoolExecutor(max_workers=SHARD_SCAN_WORKERS, thread_name_prefix='shard-scan')
+    return _scan_executor
+
+
+def _run_concurrently(func, shards):
+    """
+    Calls func(shard) for each shard on the scan thread pool; SQLite releases
+    the GIL while a statement runs, so the shards are worked in parallel. A
+    single shard runs on the caller's thread.
+
+    Returns:
+        list: func's results, in the order of shards.
+    """
+    shards = list(shards)
+    if len(shards) == 1:
+        return [func(shards[0])]
+    return list(_get_scan_executor().map(func, shards))
+
+
+def _map_shards(func):
+    """
+    Calls func(connection) on every shard concurrently, or once on the
+    database in single-file mode.
+
+    Returns:
+        list: func's results, in shard order.
+    """
+    shards = range(len(_get_shard_pools())) if SQLITE_SHARD_DIR else [None]
+    return _run_concurrently(lambda shard: func(_shard_connection(shard)), shards)
+
+
+def _group_by_shard(user_ids):
+    """
+    Returns shard -> list of user ids (a single None group in single-file mode).
+    """
+    groups = {}
+    for user_id in user_ids:
+        groups.setdefault(get_user_shard(user_id), []).append(user_id)
+    return groups
+
+
+def scan_shards(sql, params=()):
+    """
+    Runs a read-only query on every shard concurrently, for admin reports
+    over all users.
+
+    Rows come back shard after shard, each shard's in its own order, so
+    aggregate across shards in Python (e.g. add up per-shard COUNTs). In
+    single-file mode the query runs once against the database.
+
+    Args:
+        sql (str): Query to run on each shard.
+        params (tuple): Query parameters.
+
+    Returns:
+        list: Rows from all shards.
+    """
+    rows = []
+    for shard_rows in _map_shards(lambda conn: conn.execute(sql, params).fetchall()):
+        rows.extend(shard_rows)
+    return rows
+
+
+def get_shard_stats():
+    """
+    Returns per-shard user, consultation and activity counts and file sizes.
+
+    Returns:
+        list: Dicts with shard, users, consultations, activities and
+              size_bytes, in shard order; a single entry with shard None in
+              single-file mode.
+    """
+    def stats(conn):
+        row = conn.execute('''
+            SELECT (SELECT COUNT(*) FROM users) AS users,
+                   (SELECT COUNT(*) FROM consultations) AS consultations,
+                   (SELECT COUNT(*) FROM user_activities) AS activities
+        ''').fetchone()
+        size = conn.execute('PRAGMA page_count').fetchone()[0] * conn.execute('PRAGMA page_size').fetchone()[0]
+        return dict(row, size_bytes=size)
+
+    results = _map_shards(stats)
+    shards = range(len(results)) if SQLITE_SHARD_DIR else [None]
+    return [dict(result, shard=shard) for shard, result in zip(shards, results)]
+
+
+def _lookup_user_id(email):
+    """
+    Returns the id registered for email in user_directory (caching the
+    user's shard), or None.
+    """
+    row = _connect(_pool).execute('SELECT user_id, shard FROM user_directory WHERE email = ?', (email,)).fetchone()
+    if row is None:
+        return None
+    _user_shards.set(row['user_id'], row['shard'])
+    return row['user_id']
+
+
+def _register_users(emails):
+    """
+    Adds user_directory entries for new users and places each on a shard.
+
+    Ids come from the directory's AUTOINCREMENT sequence, so they are unique
+    across shards and never reused.
+
+    Returns:
+        list: The new user ids, in the order of emails.
+
+    Raises:
+        sqlite3.IntegrityError: An email is already registered; nothing is added.
+    """
+    with _connect(_pool) as conn:
         cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        return _assign_user_ids(cursor, emails)
 
-        # Creating Users Table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                age INTEGER,
-                gender TEXT,
-                height REAL,
-                weight REAL,
-                medical_conditions TEXT,
-                health_goals TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
 
-        # Creating Activity Logs Table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_activities (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                activity_description TEXT NOT NULL,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
+def _assign_user_ids(cursor, emails):
+    # Caller holds the directory's write lock, so the sequence cannot move
+    shard_count = len(_get_shard_pools())
+    row = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'user_directory'").fetchone()
+    first_id = (row[0] if row else 0) + 1
+    entries = [(first_id + i, email, place_user(first_id + i, shard_count)) for i, email in enumerate(emails)]
+    cursor.executemany('INSERT INTO user_directory (user_id, email, shard) VALUES (?, ?, ?)', entries)
+    for user_id, _, shard in entries:
+        _user_shards.set(user_id, shard)
+    return [user_id for user_id, _, _ in entries]
 
-        # Creating Plans Table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_plans (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                lifestyle_plan TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
 
-        # Creating Workouts Table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS workouts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                workout_plan TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
+def _set_directory_email(user_id, email):
+    """
+    Changes a user's email in user_directory; raises sqlite3.IntegrityError
+    if another user has it.
+    """
+    with _connect(_pool) as conn:
+        conn.execute('UPDATE user_directory SET email = ? WHERE user_id = ?', (email, user_id))
 
-        # Creating Consultations Table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS consultations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                question TEXT,
-                response TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
 
-        # Creating Doctor Visits Table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS doctor_visits (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                visit_reason TEXT,
-                appointment_date TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
+def _unregister_users(user_ids):
+    """
+    Drops directory entries whose users rows could not be written.
+    """
+    with _connect(_pool) as conn:
+        conn.executemany('DELETE FROM user_directory WHERE user_id = ?', [(user_id,) for user_id in user_ids])
+    _user_shards.invalidate(*user_ids)
 
-        # Creating Recommendations Table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS recommendations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                health_recommendation TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
 
-        conn.commit()
+# Rollup bucket start for a unix time {t}, in UTC; weeks start on Monday
+_BODY_METRIC_BUCKETS = {
+    'day': '({t} - {t} % 86400)',
+    'week': '({t} - ({t} + 259200) % 604800)',
+    'month': "CAST(strftime('%s', {t}, 'unixepoch', 'start of month') AS INTEGER)",
+}
+
+# Folds each new reading into its day, week and month rollups
+_BODY_METRIC_ROLLUP_TRIGGER = (
+    'CREATE TRIGGER IF NOT EXISTS body_measurements_rollup AFTER INSERT ON body_measurements BEGIN'
+    + ''.join(f'''
+        INSERT INTO body_metric_rollups
+            (user_id, metric, period, bucket, value_count, value_min, value_max, value_sum, last_at, last_value)
+        VALUES (new.user_id, new.metric, '{period}', {bucket.format(t='new.measured_at')},
+                1, new.value, new.value, new.value, new.measured_at, new.value)
+        ON CONFLICT (user_id, metric, period, bucket) DO UPDATE SET
+            value_count = value_count + 1,
+            value_min = MIN(value_min, excluded.value_min),
+            value_max = MAX(value_max, excluded.value_max),
+            value_sum = value_sum + excluded.value_sum,
+            last_value = CASE WHEN excluded.last_at >= last_at THEN excluded.last_value ELSE last_value END,
+            last_at = MAX(last_at, excluded.last_at);''' for period, bucket in _BODY_METRIC_BUCKETS.items())
+    + '\n    END'
+)
+
+# Re-aggregates the day, week and month rollups holding a reading whose value
+# was replaced (a second reading in the same second); no period is longer
+# than 31 days, which bounds each bucket's range scan
+_BODY_METRIC_REBUCKET_TRIGGER = (
+    'CREATE TRIGGER IF NOT EXISTS body_measurements_rebucket AFTER UPDATE OF value ON body_measurements BEGIN'
+    + ''.join(f'''
+        INSERT INTO body_metric_rollups
+            (user_id, metric, period, bucket, value_count, value_min, value_max, value_sum, last_at, last_value)
+        SELECT new.user_id, new.metric, '{period}', {bucket.format(t='new.measured_at')},
+               COUNT(*), MIN(value), MAX(value), SUM(value), MAX(measured_at),
+               (SELECT value FROM body_measurements
+                WHERE user_id = new.user_id AND metric = new.metric
+                  AND measured_at BETWEEN new.measured_at - 2678400 AND new.measured_at + 2678400
+                  AND {bucket.format(t='measured_at')} = {bucket.format(t='new.measured_at')}
+                ORDER BY measured_at DESC LIMIT 1)
+        FROM body_measurements
+        WHERE user_id = new.user_id AND metric = new.metric
+          AND measured_at BETWEEN new.measured_at - 2678400 AND new.measured_at + 2678400
+          AND {bucket.format(t='measured_at')} = {bucket.format(t='new.measured_at')}
+        ON CONFLICT (user_id, metric, period, bucket) DO UPDATE SET
+            value_count = excluded.value_count,
+            value_min = excluded.value_min,
+            value_max = excluded.value_max,
+            value_sum = excluded.value_sum,
+            last_at = excluded.last_at,
+            last_value = excluded.last_value;'''
+        for period, bucket in _BODY_METRIC_BUCKETS.items())
+    + '\n    END'
+)
+
+# Recomputes user_summary rows from the base tables (the backfill in
+# migration 10 and `rebuild_user_summary`)
+_USER_SUMMARY_SELECT = '''
+    SELECT
+        u.id,
+        (SELECT id FROM user_plans WHERE user_id = u.id ORDER BY created_at DESC, id DESC LIMIT 1),
+        (SELECT id FROM workouts WHERE user_id = u.id ORDER BY created_at DESC, id DESC LIMIT 1),
+        (SELECT id FROM recommendations WHERE user_id = u.id ORDER BY created_at DESC, id DESC LIMIT 1),
+        (SELECT MIN(appointment_date) FROM doctor_visits WHERE user_id = u.id AND appointment_date >= date('now')),
+        (SELECT COUNT(*) FROM consultations WHERE user_id = u.id),
+        (SELECT COUNT(*) FROM user_activities WHERE user_id = u.id),
+        (SELECT MAX(timestamp) FROM user_activities WHERE user_id = u.id)
+    FROM users u
+'''
+
+# Schema migrations, applied in order. The version reached is recorded in
+# PRAGMA user_version, so each step runs exactly once per database file.
+MIGRATIONS = [
+    (1, 'baseline tables', [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            age INTEGER,
+            gender TEXT,
+            height REAL,
+            weight REAL,
+            medical_conditions TEXT,
+            health_goals TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_activities (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            activity_description TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_plans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            lifestyle_plan TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS workouts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            workout_plan TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS consultations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            question TEXT,
+            response TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS doctor_visits (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            visit_reason TEXT,
+            appointment_date TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS recommendations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            health_recommendation TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+    ]),
+    (2, 'tables present in the shipped database but never created in code', [
+        '''
+        CREATE TABLE IF NOT EXISTS user_medications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            medication_name TEXT NOT NULL,
+            dosage TEXT NOT NULL,
+            frequency TEXT NOT NULL,
+            start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS trending_topics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic_name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS topic_recommendations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            topic_id INTEGER NOT NULL,
+            recommendation TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (topic_id) REFERENCES trending_topics (id)
+        )
+        ''',
+    ]),
+    (3, 'per-user time indexes', [
+        'CREATE INDEX IF NOT EXISTS idx_user_plans_user_created ON user_plans (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_workouts_user_created ON workouts (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_consultations_user_created ON consultations (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_recommendations_user_created ON recommendations (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_doctor_visits_user_appointment ON doctor_visits (user_id, appointment_date)',
+        'CREATE INDEX IF NOT EXISTS idx_user_medications_user ON user_medications (user_id)',
+    ]),
+    (4, 'LLM response cache', [
+        '''
+        CREATE TABLE IF NOT EXISTS llm_response_cache (
+            cache_key TEXT PRIMARY KEY,
+            model_name TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_llm_response_cache_last_access ON llm_response_cache (last_access)',
+    ]),
+    (5, 'normalized claims tables', [
+        '''
+        CREATE TABLE IF NOT EXISTS claim_lines (
+            id INTEGER PRIMARY KEY,
+            claim_id_key TEXT NOT NULL,
+            service_line INTEGER,
+            sv_stat TEXT,
+            primary_person_key TEXT,
+            member_id TEXT,
+            bill_prov_key TEXT,
+            ref_prov_key TEXT,
+            att_prov_key TEXT,
+            yearmo INTEGER,
+            from_date TEXT,
+            to_date TEXT,
+            paid_date TEXT,
+            adm_date TEXT,
+            dis_date TEXT,
+            age_on_dos INTEGER,
+            relation TEXT,
+            payer_lob TEXT,
+            payer_type TEXT,
+            service_setting TEXT,
+            form_type TEXT,
+            claim_in_network TEXT,
+            pos TEXT,
+            ms_drg TEXT,
+            rev_code TEXT,
+            proc_code TEXT,
+            ndc_code TEXT,
+            rx_days_supply REAL,
+            rx_qty_dispensed REAL,
+            rx_drug_cost REAL,
+            rx_ingr_cost REAL,
+            amt_billed REAL,
+            amt_allowed REAL,
+            amt_cob REAL,
+            amt_copay REAL,
+            amt_deduct REAL,
+            amt_coins REAL,
+            amt_paid REAL,
+            amt_disallowed REAL,
+            sv_units REAL,
+            diagnostic_condition_category_id INTEGER
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS claim_diagnoses (
+            claim_line_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            icd_code TEXT NOT NULL,
+            poa TEXT,
+            PRIMARY KEY (claim_line_id, position)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS claim_procedures (
+            claim_line_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            icd_proc_code TEXT NOT NULL,
+            PRIMARY KEY (claim_line_id, position)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS claims_ingest_checkpoints (
+            source TEXT PRIMARY KEY,
+            file_size INTEGER NOT NULL,
+            byte_offset INTEGER NOT NULL,
+            rows_loaded INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_claim_lines_member_yearmo ON claim_lines (member_id, yearmo)',
+    ]),
+    (6, 'trends ingestion', [
+        'ALTER TABLE trending_topics ADD COLUMN search_volume TEXT',
+        'ALTER TABLE trending_topics ADD COLUMN explore_link TEXT',
+        'ALTER TABLE trending_topics ADD COLUMN position INTEGER',
+        'ALTER TABLE trending_topics ADD COLUMN fetched_at REAL',
+        'CREATE INDEX IF NOT EXISTS idx_trending_topics_fetched ON trending_topics (fetched_at, position)',
+        '''
+        CREATE TABLE IF NOT EXISTS trends_refresh_state (
+            source TEXT PRIMARY KEY,
+            last_attempt REAL,
+            last_success REAL,
+            last_error TEXT,
+            failures INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+    ]),
+    (7, 'pubmed evidence cache', [
+        '''
+        CREATE TABLE IF NOT EXISTS pubmed_cache (
+            medication_key TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+        ''',
+    ]),
+    (8, 'batch recommendation job', [
+        'ALTER TABLE recommendations ADD COLUMN profile_hash TEXT',
+        '''
+        CREATE TABLE IF NOT EXISTS recommendation_job_checkpoints (
+            job TEXT PRIMARY KEY,
+            last_user_id INTEGER NOT NULL,
+            processed INTEGER NOT NULL DEFAULT 0,
+            generated INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL
+        )
+        ''',
+    ]),
+    (9, 'full-text search over consultations and recommendations', [
+        # External-content FTS5 indexes: the text stays in the base tables and
+        # the triggers keep the indexes in step. user_id is indexed as well so
+        # a search intersects with the user's own rows inside FTS5.
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS consultations_fts USING fts5(
+            user_id, question, response,
+            content='consultations', content_rowid='id', tokenize='porter unicode61'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS consultations_fts_insert AFTER INSERT ON consultations BEGIN
+            INSERT INTO consultations_fts (rowid, user_id, question, response)
+            VALUES (new.id, new.user_id, new.question, new.response);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS consultations_fts_delete AFTER DELETE ON consultations BEGIN
+            INSERT INTO consultations_fts (consultations_fts, rowid, user_id, question, response)
+            VALUES ('delete', old.id, old.user_id, old.question, old.response);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS consultations_fts_update AFTER UPDATE ON consultations BEGIN
+            INSERT INTO consultations_fts (consultations_fts, rowid, user_id, question, response)
+            VALUES ('delete', old.id, old.user_id, old.question, old.response);
+            INSERT INTO consultations_fts (rowid, user_id, question, response)
+            VALUES (new.id, new.user_id, new.question, new.response);
+        END
+        ''',
+        "INSERT INTO consultations_fts (consultations_fts) VALUES ('rebuild')",
+        # Question matches count double; the user_id column is only a filter
+        "INSERT INTO consultations_fts (consultations_fts, rank) VALUES ('rank', 'bm25(0.0, 2.0, 1.0)')",
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS recommendations_fts USING fts5(
+            user_id, health_recommendation,
+            content='recommendations', content_rowid='id', tokenize='porter unicode61'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS recommendations_fts_insert AFTER INSERT ON recommendations BEGIN
+            INSERT INTO recommendations_fts (rowid, user_id, health_recommendation)
+            VALUES (new.id, new.user_id, new.health_recommendation);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS recommendations_fts_delete AFTER DELETE ON recommendations BEGIN
+            INSERT INTO recommendations_fts (recommendations_fts, rowid, user_id, health_recommendation)
+            VALUES ('delete', old.id, old.user_id, old.health_recommendation);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS recommendations_fts_update AFTER UPDATE ON recommendations BEGIN
+            INSERT INTO recommendations_fts (recommendations_fts, rowid, user_id, health_recommendation)
+            VALUES ('delete', old.id, old.user_id, old.health_recommendation);
+            INSERT INTO recommendations_fts (rowid, user_id, health_recommendation)
+            VALUES (new.id, new.user_id, new.health_recommendation);
+        END
+        ''',
+        "INSERT INTO recommendations_fts (recommendations_fts) VALUES ('rebuild')",
+        "INSERT INTO recommendations_fts (recommendations_fts, rank) VALUES ('rank', 'bm25(0.0, 1.0)')",
+    ]),
+    (10, 'materialized per-user dashboard summary', [
+        '''
+        CREATE TABLE IF NOT EXISTS user_summary (
+            user_id INTEGER PRIMARY KEY,
+            latest_plan_id INTEGER,
+            latest_workout_id INTEGER,
+            latest_recommendation_id INTEGER,
+            next_appointment TIMESTAMP,
+            consultation_count INTEGER NOT NULL DEFAULT 0,
+            activity_count INTEGER NOT NULL DEFAULT 0,
+            last_activity_at TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_user_activities_user_time ON user_activities (user_id, timestamp)',
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_user_insert AFTER INSERT ON users BEGIN
+            INSERT OR IGNORE INTO user_summary (user_id) VALUES (new.id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_user_delete AFTER DELETE ON users BEGIN
+            DELETE FROM user_summary WHERE user_id = old.id;
+        END
+        ''',
+        # Latest plan / workout / recommendation: re-read the newest id from
+        # the (user_id, created_at) index, which also handles backdated rows.
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_plan_insert AFTER INSERT ON user_plans BEGIN
+            INSERT INTO user_summary (user_id, latest_plan_id) VALUES (new.user_id, (
+                SELECT id FROM user_plans WHERE user_id = new.user_id ORDER BY created_at DESC, id DESC LIMIT 1
+            )) ON CONFLICT (user_id) DO UPDATE SET latest_plan_id = excluded.latest_plan_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_plan_delete AFTER DELETE ON user_plans BEGIN
+            UPDATE user_summary SET latest_plan_id = (
+                SELECT id FROM user_plans WHERE user_id = old.user_id ORDER BY created_at DESC, id DESC LIMIT 1
+            ) WHERE user_id = old.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_plan_update AFTER UPDATE OF user_id, created_at ON user_plans BEGIN
+            UPDATE user_summary SET latest_plan_id = (
+                SELECT id FROM user_plans WHERE user_id = old.user_id ORDER BY created_at DESC, id DESC LIMIT 1
+            ) WHERE user_id = old.user_id;
+            INSERT INTO user_summary (user_id, latest_plan_id) VALUES (new.user_id, (
+                SELECT id FROM user_plans WHERE user_id = new.user_id ORDER BY created_at DESC, id DESC LIMIT 1
+            )) ON CONFLICT (user_id) DO UPDATE SET latest_plan_id = excluded.latest_plan_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_workout_insert AFTER INSERT ON workouts BEGIN
+            INSERT INTO user_summary (user_id, latest_workout_id) VALUES (new.user_id, (
+                SELECT id FROM workouts WHERE user_id = new.user_id ORDER BY created_at DESC, id DESC LIMIT 1
+            )) ON CONFLICT (user_id) DO UPDATE SET latest_workout_id = excluded.latest_workout_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_workout_delete AFTER DELETE ON workouts BEGIN
+            UPDATE user_summary SET latest_workout_id = (
+                SELECT id FROM workouts WHERE user_id = old.user_id ORDER BY created_at DESC, id DESC LIMIT 1
+            ) WHERE user_id = old.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_workout_update AFTER UPDATE OF user_id, created_at ON workouts BEGIN
+            UPDATE user_summary SET latest_workout_id = (
+                SELECT id FROM workouts WHERE user_id = old.user_id ORDER BY created_at DESC, id DESC LIMIT 1
+            ) WHERE user_id = old.user_id;
+            INSERT INTO user_summary (user_id, latest_workout_id) VALUES (new.user_id, (
+                SELECT id FROM workouts WHERE user_id = new.user_id ORDER BY created_at DESC, id DESC LIMIT 1
+            )) ON CONFLICT (user_id) DO UPDATE SET latest_workout_id = excluded.latest_workout_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_recommendation_insert AFTER INSERT ON recommendations BEGIN
+            INSERT INTO user_summary (user_id, latest_recommendation_id) VALUES (new.user_id, (
+                SELECT id FROM recommendations WHERE user_id = new.user_id ORDER BY created_at DESC, id DESC LIMIT 1
+            )) ON CONFLICT (user_id) DO UPDATE SET latest_recommendation_id = excluded.latest_recommendation_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_recommendation_delete AFTER DELETE ON recommendations BEGIN
+            UPDATE user_summary SET latest_recommendation_id = (
+                SELECT id FROM recommendations WHERE user_id = old.user_id ORDER BY created_at DESC, id DESC LIMIT 1
+            ) WHERE user_id = old.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_recommendation_update
+        AFTER UPDATE OF user_id, created_at ON recommendations BEGIN
+            UPDATE user_summary SET latest_recommendation_id = (
+                SELECT id FROM recommendations WHERE user_id = old.user_id ORDER BY created_at DESC, id DESC LIMIT 1
+            ) WHERE user_id = old.user_id;
+            INSERT INTO user_summary (user_id, latest_recommendation_id) VALUES (new.user_id, (
+                SELECT id FROM recommendations WHERE user_id = new.user_id ORDER BY created_at DESC, id DESC LIMIT 1
+            )) ON CONFLICT (user_id) DO UPDATE SET latest_recommendation_id = excluded.latest_recommendation_id;
+        END
+        ''',
+        # Next appointment: the earliest visit dated today or later, from the
+        # (user_id, appointment_date) index. It goes stale as days pass
+        # without writes; get_dashboard_summary refreshes it on read.
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_visit_insert AFTER INSERT ON doctor_visits BEGIN
+            INSERT INTO user_summary (user_id, next_appointment) VALUES (new.user_id, (
+                SELECT MIN(appointment_date) FROM doctor_visits
+                WHERE user_id = new.user_id AND appointment_date >= date('now')
+            )) ON CONFLICT (user_id) DO UPDATE SET next_appointment = excluded.next_appointment;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_visit_delete AFTER DELETE ON doctor_visits BEGIN
+            UPDATE user_summary SET next_appointment = (
+                SELECT MIN(appointment_date) FROM doctor_visits
+                WHERE user_id = old.user_id AND appointment_date >= date('now')
+            ) WHERE user_id = old.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_visit_update
+        AFTER UPDATE OF user_id, appointment_date ON doctor_visits BEGIN
+            UPDATE user_summary SET next_appointment = (
+                SELECT MIN(appointment_date) FROM doctor_visits
+                WHERE user_id = old.user_id AND appointment_date >= date('now')
+            ) WHERE user_id = old.user_id;
+            INSERT INTO user_summary (user_id, next_appointment) VALUES (new.user_id, (
+                SELECT MIN(appointment_date) FROM doctor_visits
+                WHERE user_id = new.user_id AND appointment_date >= date('now')
+            )) ON CONFLICT (user_id) DO UPDATE SET next_appointment = excluded.next_appointment;
+        END
+        ''',
+        # Counts are adjusted by one per row; no table scans.
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_consultation_insert AFTER INSERT ON consultations BEGIN
+            INSERT INTO user_summary (user_id, consultation_count) VALUES (new.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET consultation_count = consultation_count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_consultation_delete AFTER DELETE ON consultations BEGIN
+            UPDATE user_summary SET consultation_count = consultation_count - 1 WHERE user_id = old.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_consultation_update AFTER UPDATE OF user_id ON consultations
+        WHEN old.user_id IS NOT new.user_id BEGIN
+            UPDATE user_summary SET consultation_count = consultation_count - 1 WHERE user_id = old.user_id;
+            INSERT INTO user_summary (user_id, consultation_count) VALUES (new.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET consultation_count = consultation_count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_activity_insert AFTER INSERT ON user_activities BEGIN
+            INSERT INTO user_summary (user_id, activity_count, last_activity_at) VALUES (new.user_id, 1, new.timestamp)
+            ON CONFLICT (user_id) DO UPDATE SET
+                activity_count = activity_count + 1,
+                last_activity_at = CASE
+                    WHEN last_activity_at IS NULL OR excluded.last_activity_at > last_activity_at
+                    THEN excluded.last_activity_at ELSE last_activity_at
+                END;
+        END
+        ''',
+        # Only deleting the newest activity needs a lookup for the new maximum
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_activity_delete AFTER DELETE ON user_activities BEGIN
+            UPDATE user_summary SET
+                activity_count = activity_count - 1,
+                last_activity_at = CASE
+                    WHEN old.timestamp >= last_activity_at
+                    THEN (SELECT MAX(timestamp) FROM user_activities WHERE user_id = old.user_id)
+                    ELSE last_activity_at
+                END
+            WHERE user_id = old.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_activity_update
+        AFTER UPDATE OF user_id, timestamp ON user_activities BEGIN
+            UPDATE user_summary SET
+                activity_count = activity_count - (old.user_id IS NOT new.user_id),
+                last_activity_at = (SELECT MAX(timestamp) FROM user_activities WHERE user_id = old.user_id)
+            WHERE user_id = old.user_id;
+            INSERT INTO user_summary (user_id, activity_count, last_activity_at) VALUES (new.user_id, 1, new.timestamp)
+            ON CONFLICT (user_id) DO UPDATE SET
+                activity_count = activity_count + (old.user_id IS NOT new.user_id),
+                last_activity_at = (SELECT MAX(timestamp) FROM user_activities WHERE user_id = new.user_id);
+        END
+        ''',
+        'INSERT OR REPLACE INTO user_summary ' + _USER_SUMMARY_SELECT,
+    ]),
+    (11, 'body-metric time series and rollups', [
+        # Append-only, one reading per (user, metric, second); the primary key
+        # is the only index and covers every range read.
+        '''
+        CREATE TABLE IF NOT EXISTS body_measurements (
+            user_id INTEGER NOT NULL,
+            metric TEXT NOT NULL,
+            measured_at INTEGER NOT NULL,
+            value REAL NOT NULL,
+            PRIMARY KEY (user_id, metric, measured_at)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS body_metric_rollups (
+            user_id INTEGER NOT NULL,
+            metric TEXT NOT NULL,
+            period TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            value_count INTEGER NOT NULL,
+            value_min REAL NOT NULL,
+            value_max REAL NOT NULL,
+            value_sum REAL NOT NULL,
+            last_at INTEGER NOT NULL,
+            last_value REAL NOT NULL,
+            PRIMARY KEY (user_id, metric, period, bucket)
+        ) WITHOUT ROWID
+        ''',
+        _BODY_METRIC_ROLLUP_TRIGGER,
+        # Seed the series with the profile values users already have
+        '''
+        INSERT OR IGNORE INTO body_measurements (user_id, metric, measured_at, value)
+        SELECT id, 'height', CAST(strftime('%s', COALESCE(created_at, 'now')) AS INTEGER), height
+        FROM users WHERE height IS NOT NULL
+        ''',
+        '''
+        INSERT OR IGNORE INTO body_measurements (user_id, metric, measured_at, value)
+        SELECT id, 'weight', CAST(strftime('%s', COALESCE(created_at, 'now')) AS INTEGER), weight
+        FROM users WHERE weight IS NOT NULL
+        ''',
+    ]),
+    (12, 'user_activities retention rollups', [
+        # Raw activities older than the retention age are folded into per-user
+        # daily counts by activity_retention.py and then deleted
+        '''
+        CREATE TABLE IF NOT EXISTS activity_daily_counts (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            activity_type TEXT NOT NULL,
+            activity_count INTEGER NOT NULL,
+            first_at TIMESTAMP NOT NULL,
+            last_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (user_id, day, activity_type)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_user_activities_timestamp ON user_activities (timestamp)',
+        '''
+        CREATE TABLE IF NOT EXISTS activity_compaction_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            compacting INTEGER NOT NULL DEFAULT 0,
+            compacted_before TIMESTAMP,
+            rows_compacted INTEGER NOT NULL DEFAULT 0,
+            last_run_at REAL
+        )
+        ''',
+        'INSERT OR IGNORE INTO activity_compaction_state (id) VALUES (1)',
+        # Compacted rows still count towards user_summary, so their deletes
+        # (made with compacting = 1) leave the summary alone
+        'DROP TRIGGER IF EXISTS user_summary_activity_delete',
+        '''
+        CREATE TRIGGER IF NOT EXISTS user_summary_activity_delete AFTER DELETE ON user_activities
+        WHEN (SELECT compacting FROM activity_compaction_state WHERE id = 1) = 0 BEGIN
+            UPDATE user_summary SET
+                activity_count = activity_count - 1,
+                last_activity_at = CASE
+                    WHEN old.timestamp >= last_activity_at
+                    THEN (SELECT MAX(timestamp) FROM user_activities WHERE user_id = old.user_id)
+                    ELSE last_activity_at
+                END
+            WHERE user_id = old.user_id;
+        END
+        ''',
+    ]),
+    (13, 'user directory for sharded storage', [
+        # Only the directory database of sharded storage fills these; shard
+        # files and single-file databases leave them empty
+        '''
+        CREATE TABLE IF NOT EXISTS user_directory (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE NOT NULL,
+            shard INTEGER NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_user_directory_shard ON user_directory (shard, user_id)',
+        '''
+        CREATE TABLE IF NOT EXISTS shard_layout (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            shard_count INTEGER NOT NULL,
+            updated_at REAL
+        )
+        ''',
+    ]),
+    (14, 'replace same-second body readings', [
+        # A second reading of a metric in the same second now replaces the
+        # first (see _insert_body_metrics) instead of being dropped
+        _BODY_METRIC_REBUCKET_TRIGGER,
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+_schema_lock = threading.Lock()
+_schema_ready = set()  # database files migrated by this process
+
+
+def get_schema_version(connection):
+    """
+    Returns the migration version recorded in the database file.
+    """
+    return connection.execute('PRAGMA user_version').fetchone()[0]
+
+
+def apply_migrations(connection, migrations=None):
+    """
+    Applies every migration newer than the database's recorded version.
+
+    Each step runs in its own IMMEDIATE transaction together with the version
+    bump, so concurrent processes serialize on the write lock and a failed
+    step leaves the database at the previous version.
+
+    Args:
+        connection: SQLite connection to migrate.
+        migrations (list): (version, description, statements) tuples; defaults
+                           to MIGRATIONS.
+
+    Returns:
+        int: The schema version after migrating.
+    """
+    migrations = MIGRATIONS if migrations is None else migrations
+    for version, description, statements in migrations:
+        if get_schema_version(connection) >= version:
+            continue
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            # Another process may have migrated while we waited for the lock.
+            if get_schema_version(connection) >= version:
+                connection.rollback()
+                continue
+            for statement in statements:
+                connection.execute(statement)
+            connection.execute(f'PRAGMA user_version = {int(version)}')
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            print(f"Error applying migration {version} ({description})")
+            raise
+    return get_schema_version(connection)
+
+
+def ensure_schema(connection=None, database_path=None):
+    """
+    Runs the migrations once per process and database file (the database,
+    or with sharded storage the directory and each shard).
+    """
+    database_path = DATABASE_PATH if database_path is None else database_path
+    with _schema_lock:
+        if database_path in _schema_ready:
+            return
+        apply_migrations(connection if connection is not None else _pool.acquire())
+        _schema_ready.add(database_path)
 
 
+def create_tables():
+    """
+    Create all necessary tables for the application if they don't exist.
+
+    Kept for existing callers; the schema is now managed by `apply_migrations`.
+    """
+    apply_migrations(_pool.acquire())
+
+
+@timed()
 def save_user_activity(user_id, activity_description):
     """
     Logs user activity into the database for analytics purposes.
 
+    The row is queued for the background writer and committed in a batch.
+
     Args:
         user_id (int): The ID of the user performing the activity.
         activity_description (str): A brief description of the user's activity.
     """
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO user_activities (user_id, activity_description)
-                VALUES (?, ?)
-            ''', (user_id, activity_description))
-            conn.commit()
+        _get_log_writer(user_id).submit('''
+            INSERT INTO user_activities (user_id, activity_description)
+            VALUES (?, ?)
+        ''', (user_id, activity_description))
     except Exception as e:
         print(f"Error saving user activity: {e}")
+        record_error('db.save_user_activity')
+
+
+_user_cache = TTLCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
 
+def _cache_user(row):
+    if row is not None:
+        _user_cache.set(('email', row['email']), row)
+        _user_cache.set(('id', row['id']), row)
+    return row
 
+
+def invalidate_user_cache(email=None, user_id=None):
+    """
+    Drops cached user rows so the next lookup reads from the database.
+
+    Both keys of a cached row are dropped, whichever one is given.
+
+    Args:
+        email (str): Email of the user to invalidate.
+        user_id (int): ID of the user to invalidate.
+    """
+    keys = []
+    for key in (('email', email), ('id', user_id)):
+        if key[1] is None:
+            continue
+        keys.append(key)
+        row = _user_cache.peek(key)
+        if row is not None:
+            keys.extend([('email', row['email']), ('id', row['id'])])
+    _user_cache.invalidate(*keys)
+
+
+def get_user_cache_stats():
+    """
+    Returns hit/miss/eviction counters for the user cache.
+    """
+    return _user_cache.stats()
+
+
+def _collect_metrics():
+    """
+    Pool, write-behind and user cache counters as gauges for metrics export.
+    """
+    gauges = {}
+    sources = [('sqlite_pool', get_pool_stats()), ('write_behind', get_write_behind_stats()),
+               ('user_cache', get_user_cache_stats())]
+    if _shard_pools:
+        # Shard pools are summed; per-shard detail is in get_shard_stats
+        totals = {'count': len(_shard_pools)}
+        for pool in _shard_pools:
+            for key, value in pool.stats().items():
+                if isinstance(value, int):
+                    totals[key] = totals.get(key, 0) + value
+        sources += [('sqlite_shards', totals), ('user_shard_cache', _user_shards.stats())]
+    for prefix, stats in sources:
+        for key, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                gauges[f'{prefix}_{key}'] = value
+    return gauges
+
+
+register_collector(_collect_metrics)
+
+
+@timed()
 def create_user(name, email, password, age, gender, height, weight, medical_conditions, health_goals):
     """
     Creates a new user in the database.
+
+    With sharded storage the email is registered in the directory first,
+    which assigns the id and shard and rejects an email in use on any shard.
     """
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO users (name, email, password, age, gender, height, weight, medical_conditions, health_goals)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (name, email, password, age, gender, height, weight, medical_conditions, health_goals))
-        conn.commit()
+    user_id = _register_users([email])[0] if SQLITE_SHARD_DIR else None
+    try:
+        with get_db_connection(user_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO users (id, name, email, password, age, gender, height, weight, medical_conditions,
+                                   health_goals)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, name, email, password, age, gender, height, weight, medical_conditions, health_goals))
+            _insert_body_metrics(cursor, cursor.lastrowid, {'height': height, 'weight': weight}, int(time.time()))
+            conn.commit()
+    except Exception:
+        if user_id is not None:
+            _unregister_users([user_id])
+        raise
+    invalidate_user_cache(email=email)
 
 
+@timed()
 def get_user_by_email(email):
     """
-    Fetches user details by email.
+    Fetches user details by email, served from the user cache when possible.
     """
+    row = _user_cache.get(('email', email))
+    if row is not None:
+        return row
+    if SQLITE_SHARD_DIR:
+        user_id = _lookup_user_id(email)
+        return None if user_id is None else get_user_by_id(user_id)
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM users WHERE email = ?', (email,))
-        return cursor.fetchone()
+        return _cache_user(cursor.fetchone())
+
+
+@timed()
+def get_user_by_id(user_id):
+    """
+    Fetches user details by id, served from the user cache when possible.
+    """
+    row = _user_cache.get(('id', user_id))
+    if row is not None:
+        return row
+    with get_db_connection(user_id) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
+        return _cache_user(cursor.fetchone())
 
 
+@timed()
 def update_user_info(user_email, updated_info):
     """
     Updates user information in the database.
+
+    With sharded storage a new email is claimed in the directory first, where
+    emails are unique across shards, and given back if the update fails.
     """
+    user_id = _lookup_user_id(user_email) if SQLITE_SHARD_DIR else None
+    new_email = updated_info.get('email', user_email)
+    claimed = False
     try:
-        with get_db_connection() as conn:
+        if user_id is not None and new_email != user_email:
+            _set_directory_email(user_id, new_email)
+            claimed = True
+        with get_db_connection(user_id) as conn:
             cursor = conn.cursor()
 
             # Build dynamic SET clause for SQL query
@@ -174,19 +1441,35 @@ def update_user_info(user_email, updated_info):
                 SET {set_clause}
                 WHERE email = ?
             ''', values + [user_email])
-            
+
+            # Profile height and weight are the latest readings; keep the history
+            metrics = {key: updated_info[key] for key in BODY_PROFILE_METRICS if key in updated_info}
+            if metrics:
+                cursor.execute('SELECT id FROM users WHERE email = ?', (updated_info.get('email', user_email),))
+                row = cursor.fetchone()
+                if row:
+                    _insert_body_metrics(cursor, row['id'], metrics, int(time.time()))
+
             conn.commit()
             return True
     except Exception as e:
         print(f"Error updating user info: {e}")
+        record_error('db.update_user_info')
+        if claimed:
+            _set_directory_email(user_id, user_email)
         return False
+    finally:
+        invalidate_user_cache(email=user_email)
+        if 'email' in updated_info:
+            invalidate_user_cache(email=updated_info['email'])
 
 
+@timed()
 def create_plan(user_id, lifestyle_plan):
     """
     Creates a lifestyle plan for a user.
     """
-    with get_db_connection() as conn:
+    with get_db_connection(user_id) as conn:
         cursor = conn.cursor()
         cursor.execute('''
             INSERT INTO user_plans (user_id, lifestyle_plan)
@@ -195,21 +1478,23 @@ def create_plan(user_id, lifestyle_plan):
         conn.commit()
 
 
+@timed()
 def get_latest_plan(user_id):
     """
     Fetches the latest lifestyle plan for a user.
     """
-    with get_db_connection() as conn:
+    with get_db_connection(user_id) as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM user_plans WHERE user_id = ? ORDER BY created_at DESC LIMIT 1', (user_id,))
+        cursor.execute('SELECT * FROM user_plans WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT 1', (user_id,))
         return cursor.fetchone()
 
 
+@timed()
 def create_workout(user_id, workout_plan):
     """
     Creates a workout plan for a user.
     """
-    with get_db_connection() as conn:
+    with get_db_connection(user_id) as conn:
         cursor = conn.cursor()
         cursor.execute('''
             INSERT INTO workouts (user_id, workout_plan)
@@ -218,44 +1503,50 @@ def create_workout(user_id, workout_plan):
         conn.commit()
 
 
+@timed()
 def get_latest_workout(user_id):
     """
     Fetches the latest workout plan for a user.
     """
-    with get_db_connection() as conn:
+    with get_db_connection(user_id) as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM workouts WHERE user_id = ? ORDER BY created_at DESC LIMIT 1', (user_id,))
+        cursor.execute('SELECT * FROM workouts WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT 1', (user_id,))
         return cursor.fetchone()
 
 
+@timed()
 def create_consultation_log(user_id, question, response):
     """
     Logs a user consultation.
+
+    The row is queued for the background writer; call `flush_pending_writes`
+    before reading it back.
     """
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO consultations (user_id, question, response)
-            VALUES (?, ?, ?)
-        ''', (user_id, question, response))
-        conn.commit()
+    _get_log_writer(user_id).submit('''
+        INSERT INTO consultations (user_id, question, response)
+        VALUES (?, ?, ?)
+    ''', (user_id, question, response))
 
 
+@timed()
 def get_consultation_log(user_id):
     """
-    Fetches all consultations for a user.
+    Fetches all consultations for a user, oldest first.
+
+    Loads the whole history; use `get_consultation_history` to page through it.
     """
-    with get_db_connection() as conn:
+    with get_db_connection(user_id) as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM consultations WHERE user_id = ?', (user_id,))
+        cursor.execute('SELECT * FROM consultations WHERE user_id = ? ORDER BY created_at, id', (user_id,))
         return cursor.fetchall()
 
 
+@timed()
 def schedule_doctor_visit(user_id, visit_reason, appointment_date):
     """
     Schedules a doctor visit for a user.
     """
-    with get_db_connection() as conn:
+    with get_db_connection(user_id) as conn:
         cursor = conn.cursor()
         cursor.execute('''
             INSERT INTO doctor_visits (user_id, visit_reason, appointment_date)
@@ -264,61 +1555,1137 @@ def schedule_doctor_visit(user_id, visit_reason, appointment_date):
         conn.commit()
 
 
+@timed()
 def get_doctor_visits(user_id):
     """
     Fetches all doctor visits for a user.
     """
-    with get_db_connection() as conn:
+    with get_db_connection(user_id) as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM doctor_visits WHERE user_id = ? ORDER BY appointment_date', (user_id,))
         return cursor.fetchall()
 
 
-def create_health_recommendation(user_id, recommend):
+@timed()
+def create_health_recommendation(user_id, recommend, profile_hash=None):
     """
     Creates a health recommendation for a user.
+
+    `profile_hash` identifies the profile the text was generated for, so the
+    batch job can skip users whose profile has not changed since.
     """
-    with get_db_connection() as conn:
+    with get_db_connection(user_id) as conn:
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT INTO recommendations (user_id, health_recommendation)
-            VALUES (?, ?)
-        ''', (user_id, recommend))
+            INSERT INTO recommendations (user_id, health_recommendation, profile_hash)
+            VALUES (?, ?, ?)
+        ''', (user_id, recommend, profile_hash))
         conn.commit()
 
 
+@timed()
 def get_health_recommendation_db(user_id):
     """
     Fetches the latest health recommendation for a user.
     """
-    with get_db_connection() as conn:
+    with get_db_connection(user_id) as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM recommendations WHERE user_id = ? ORDER BY created_at DESC LIMIT 1', (user_id,))
+        cursor.execute('SELECT * FROM recommendations WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT 1', (user_id,))
         return cursor.fetchone()
-    
-    
 
-def get_user_health_data(user_id):
+
+# Tables with a (user_id, created_at) index that can be paged newest first
+_HISTORY_TABLES = ('consultations', 'recommendations', 'user_plans', 'workouts')
+
+HISTORY_PAGE_SIZE = 20
+# Searches rank at most this many of the newest matches (see search_consultations)
+SEARCH_RANK_WINDOW = int(os.getenv('SEARCH_RANK_WINDOW', '2000'))
+
+
+def _history_page(table, user_id, limit, before):
     """
-    Fetches health-related data for the given user.
+    Fetches one page of a user's history, newest first.
 
-    Args:
-        user_id (int): The ID of the user.
+    Pages are keyed on (created_at, id) rather than OFFSET, so the query is an
+    index range scan on (user_id, created_at) however deep the page is.
+
+    Returns:
+        tuple: (rows, next_before). Pass next_before back as `before` to get
+               the following page; it is None on the last page.
+    """
+    if table not in _HISTORY_TABLES:
+        raise ValueError(f"Unknown history table: {table}")
+    with get_db_connection(user_id) as conn:
+        cursor = conn.cursor()
+        if before is None:
+            cursor.execute(f'''
+                SELECT * FROM {table} WHERE user_id = ?
+                ORDER BY created_at DESC, id DESC LIMIT ?
+            ''', (user_id, limit + 1))
+        else:
+            cursor.execute(f'''
+                SELECT * FROM {table} WHERE user_id = ? AND (created_at, id) < (?, ?)
+                ORDER BY created_at DESC, id DESC LIMIT ?
+            ''', (user_id, before[0], before[1], limit + 1))
+        rows = cursor.fetchall()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, (rows[-1]['created_at'], rows[-1]['id'])
+
+
+@timed()
+def get_consultation_history(user_id, limit=HISTORY_PAGE_SIZE, before=None):
+    """
+    Fetches one page of a user's consultations, newest first.
+
+    Args:
+        user_id (int): The ID of the user.
+        limit (int): Rows per page.
+        before (tuple): The `next_before` cursor of the previous page, or None
+                        for the first page.
+
+    Returns:
+        tuple: (rows, next_before); next_before is None on the last page.
+    """
+    return _history_page('consultations', user_id, limit, before)
+
+
+@timed()
+def get_recommendation_history(user_id, limit=HISTORY_PAGE_SIZE, before=None):
+    """
+    Fetches one page of a user's health recommendations, newest first.
+    See `get_consultation_history`.
+    """
+    return _history_page('recommendations', user_id, limit, before)
+
+
+@timed()
+def get_plan_history(user_id, limit=HISTORY_PAGE_SIZE, before=None):
+    """
+    Fetches one page of a user's lifestyle plans, newest first.
+    See `get_consultation_history`.
+    """
+    return _history_page('user_plans', user_id, limit, before)
+
+
+@timed()
+def get_workout_history(user_id, limit=HISTORY_PAGE_SIZE, before=None):
+    """
+    Fetches one page of a user's workout plans, newest first.
+    See `get_consultation_history`.
+    """
+    return _history_page('workouts', user_id, limit, before)
+
+
+def _fts_query(user_id, text, columns):
+    """
+    Builds an FTS5 query for one user's rows in which every word of `text`
+    appears in one of `columns`, the last word also as a prefix
+    (search-as-you-type). Words are quoted, so FTS5 operators and punctuation
+    in the input are matched literally instead of raising a syntax error.
+
+    Returns:
+        str: The MATCH expression, or None if the text has no searchable words.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = ' '.join(f'"{word}"' for word in words) + '*'
+    return f'user_id : "{int(user_id)}" AND {{{columns}}} : ({terms})'
+
+
+@timed()
+def search_consultations(user_id, query, limit=HISTORY_PAGE_SIZE, offset=0):
+    """
+    Ranked full-text search over a user's consultation questions and answers.
+
+    Args:
+        user_id (int): The ID of the user.
+        query (str): Free text; every word must match (the last as a prefix).
+        limit (int): Maximum results.
+        offset (int): Results to skip, for paging through the ranking.
+
+    Returns:
+        list: Rows with id, question, response and created_at plus
+              question_highlight (the question with matches wrapped in
+              <mark>) and response_snippet (the best matching fragment of the
+              response), best match first.
+
+    Scoring every match of a word that appears in most of a heavy user's
+    rows dominates the cost, so only the newest SEARCH_RANK_WINDOW matches
+    are ranked (by BM25, question matches weighted double). Smaller result
+    sets are ranked in full.
+    """
+    match = _fts_query(user_id, query, 'question response')
+    if match is None:
+        return []
+    with get_db_connection(user_id) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT c.id, c.question, c.response, c.created_at,
+                   highlight(consultations_fts, 1, '<mark>', '</mark>') AS question_highlight,
+                   snippet(consultations_fts, 2, '<mark>', '</mark>', '…', 24) AS response_snippet
+            FROM consultations_fts
+            JOIN consultations c ON c.id = consultations_fts.rowid
+            WHERE consultations_fts MATCH ? AND consultations_fts.rowid >= COALESCE((
+                SELECT rowid FROM consultations_fts WHERE consultations_fts MATCH ?
+                ORDER BY rowid DESC LIMIT 1 OFFSET ?
+            ), 0)
+            ORDER BY consultations_fts.rank
+            LIMIT ? OFFSET ?
+        ''', (match, match, SEARCH_RANK_WINDOW - 1, limit, offset))
+        return cursor.fetchall()
+
+
+@timed()
+def search_recommendations(user_id, query, limit=HISTORY_PAGE_SIZE, offset=0):
+    """
+    Ranked full-text search over a user's health recommendations.
+
+    Returns:
+        list: Rows with id, health_recommendation and created_at plus snippet
+              (the best matching fragment, matches wrapped in <mark>), best
+              match first. See `search_consultations`.
+    """
+    match = _fts_query(user_id, query, 'health_recommendation')
+    if match is None:
+        return []
+    with get_db_connection(user_id) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT r.id, r.health_recommendation, r.created_at,
+                   snippet(recommendations_fts, 1, '<mark>', '</mark>', '…', 24) AS snippet
+            FROM recommendations_fts
+            JOIN recommendations r ON r.id = recommendations_fts.rowid
+            WHERE recommendations_fts MATCH ? AND recommendations_fts.rowid >= COALESCE((
+                SELECT rowid FROM recommendations_fts WHERE recommendations_fts MATCH ?
+                ORDER BY rowid DESC LIMIT 1 OFFSET ?
+            ), 0)
+            ORDER BY recommendations_fts.rank
+            LIMIT ? OFFSET ?
+        ''', (match, match, SEARCH_RANK_WINDOW - 1, limit, offset))
+        return cursor.fetchall()
+
+
+_SUMMARY_FIELDS = frozenset((
+    'summary_user_id', 'next_appointment', 'consultation_count', 'activity_count', 'last_activity_at',
+    'plan_id', 'lifestyle_plan', 'plan_created_at', 'workout_id', 'workout_plan', 'workout_created_at',
+    'recommendation_id', 'health_recommendation', 'recommendation_created_at',
+))
+
+
+def _read_dashboard_summary(email, user_id):
+    with get_db_connection(user_id) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT u.*,
+                   s.user_id AS summary_user_id, s.next_appointment, s.consultation_count, s.activity_count,
+                   s.last_activity_at,
+                   p.id AS plan_id, p.lifestyle_plan, p.created_at AS plan_created_at,
+                   w.id AS workout_id, w.workout_plan, w.created_at AS workout_created_at,
+                   r.id AS recommendation_id, r.health_recommendation, r.created_at AS recommendation_created_at
+            FROM users u
+            LEFT JOIN user_summary s ON s.user_id = u.id
+            LEFT JOIN user_plans p ON p.id = s.latest_plan_id
+            LEFT JOIN workouts w ON w.id = s.latest_workout_id
+            LEFT JOIN recommendations r ON r.id = s.latest_recommendation_id
+            WHERE u.email = ?
+        ''', (email,))
+        return cursor.fetchone()
+
+
+@timed()
+def get_dashboard_summary(email):
+    """
+    Fetches everything the dashboard shows for a user in one indexed read of
+    the user_summary table and the rows it points at.
+
+    The summary is kept current by triggers; a missing row or a next
+    appointment that has since passed is recomputed for this user first.
+
+    Args:
+        email (str): The user's email.
+
+    Returns:
+        dict: user (the users row as a dict), latest_plan, latest_workout and
+              latest_recommendation (dicts with id, the text and created_at,
+              or None), next_appointment, consultation_count, activity_count
+              and last_activity_at; None if there is no such user.
+    """
+    user_id = _lookup_user_id(email) if SQLITE_SHARD_DIR else None
+    if SQLITE_SHARD_DIR and user_id is None:
+        return None
+    row = _read_dashboard_summary(email, user_id)
+    if row is None:
+        return None
+    # next_appointment is computed against SQLite's date('now'), which is UTC
+    if row['summary_user_id'] is None or (
+            row['next_appointment'] is not None
+            and row['next_appointment'] < time.strftime('%Y-%m-%d', time.gmtime())):
+        rebuild_user_summary(row['id'])
+        row = _read_dashboard_summary(email, user_id)
+
+    def latest(id_key, text_key, created_key):
+        if row[id_key] is None:
+            return None
+        return {'id': row[id_key], text_key: row[text_key], 'created_at': row[created_key]}
+
+    return {
+        'user': {key: row[key] for key in row.keys() if key not in _SUMMARY_FIELDS},
+        'latest_plan': latest('plan_id', 'lifestyle_plan', 'plan_created_at'),
+        'latest_workout': latest('workout_id', 'workout_plan', 'workout_created_at'),
+        'latest_recommendation': latest('recommendation_id', 'health_recommendation', 'recommendation_created_at'),
+        'next_appointment': row['next_appointment'],
+        'consultation_count': row['consultation_count'],
+        'activity_count': row['activity_count'],
+        'last_activity_at': row['last_activity_at'],
+    }
+
+
+def _rebuild_user_summary(cursor, user_ids=None):
+    """
+    Rewrites the user_summary rows of the given users (everyone when None)
+    in the cursor's database.
+
+    Returns:
+        int: Number of summary rows written.
+    """
+    if user_ids is None:
+        where, params = '', ()
+        cursor.execute('DELETE FROM user_summary')
+        cursor.execute('INSERT INTO user_summary ' + _USER_SUMMARY_SELECT)
+    else:
+        placeholders = ', '.join('?' * len(user_ids))
+        where, params = f'WHERE user_id IN ({placeholders})', tuple(user_ids)
+        cursor.execute(f'INSERT OR REPLACE INTO user_summary {_USER_SUMMARY_SELECT} WHERE u.id IN ({placeholders})',
+                       params)
+    rows = cursor.rowcount
+    # Compacted activities still count (see compact_activity_batch)
+    cursor.execute(f'''
+        UPDATE user_summary SET
+            activity_count = user_summary.activity_count + rolled.activity_count,
+            last_activity_at = MAX(COALESCE(user_summary.last_activity_at, ''), rolled.last_at)
+        FROM (
+            SELECT user_id, SUM(activity_count) AS activity_count, MAX(last_at) AS last_at
+            FROM activity_daily_counts
+            {where}
+            GROUP BY user_id
+        ) AS rolled
+        WHERE rolled.user_id = user_summary.user_id
+    ''', params)
+    return rows
+
+
+@timed()
+def rebuild_user_summary(user_id=None):
+    """
+    Recomputes user_summary from the base tables, for one user or (with no
+    user_id) for everyone, e.g. after a bulk load that bypassed the triggers.
+    Shards are rebuilt concurrently.
+
+    Returns:
+        int: Number of summary rows written.
+    """
+    def rebuild(conn):
+        with conn:
+            return _rebuild_user_summary(conn.cursor(), None if user_id is None else [user_id])
+
+    if user_id is not None:
+        return rebuild(get_db_connection(user_id))
+    return sum(_map_shards(rebuild))
+
+
+# users columns that are also recorded as body-metric readings
+BODY_PROFILE_METRICS = ('height', 'weight')
+# Rows returned by get_body_metric_series, raw or rolled up
+BODY_METRIC_MAX_POINTS = int(os.getenv('BODY_METRIC_MAX_POINTS', '500'))
+_MAX_TIME = 2 ** 62
+
+
+def _insert_body_metrics(cursor, user_id, values, measured_at):
+    cursor.executemany('''
+        INSERT INTO body_measurements (user_id, metric, measured_at, value)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id, metric, measured_at) DO UPDATE SET value = excluded.value
+        WHERE value != excluded.value
+    ''', [(user_id, metric, measured_at, float(value)) for metric, value in values.items() if value is not None])
+    return cursor.rowcount
+
+
+@timed()
+def record_body_metrics(user_id, values, measured_at=None):
+    """
+    Appends readings to a user's body-metric series.
+
+    A second reading of the same metric within the same second replaces the
+    first, so the latest value is the one kept.
+
+    Args:
+        user_id (int): The ID of the user.
+        values (dict): Metric name ('weight', 'height', ...) to value; None
+                       values are skipped.
+        measured_at (float): Unix time of the readings; defaults to now.
+
+    Returns:
+        int: Number of readings stored.
+    """
+    measured_at = int(time.time() if measured_at is None else measured_at)
+    with get_db_connection(user_id) as conn:
+        return _insert_body_metrics(conn.cursor(), user_id, values, measured_at)
+
+
+@timed()
+def get_body_metric_series(user_id, metric, start=None, end=None, max_points=BODY_METRIC_MAX_POINTS):
+    """
+    Reads one metric for a user at the finest resolution that fits max_points.
+
+    Raw readings are returned when there are at most max_points of them in
+    range, otherwise the first of the day, week and month rollups that fits;
+    months are returned even when they don't (body_metrics.downsample merges
+    them further). Each count is capped at max_points + 1 rows of the index.
+
+    Args:
+        user_id (int): The ID of the user.
+        metric (str): Metric name, e.g. 'weight'.
+        start (int): Earliest unix time to include; None for no bound. A
+                     rollup bucket containing start is included whole.
+        end (int): Latest unix time to include; None for no bound.
+        max_points (int): Largest number of rows wanted.
+
+    Returns:
+        tuple: (resolution, rows), resolution being 'raw', 'day', 'week' or
+               'month'; rows, oldest first, have bucket (unix start time),
+               value_count, value_min, value_max, value_mean and last_value.
+    """
+    params = {
+        'user_id': user_id, 'metric': metric, 'limit': max_points + 1,
+        'start': 0 if start is None else int(start), 'end': _MAX_TIME if end is None else int(end),
+    }
+    with get_db_connection(user_id) as conn:
+        cursor = conn.cursor()
+        where = 'user_id = :user_id AND metric = :metric AND measured_at BETWEEN :start AND :end'
+        cursor.execute(f'SELECT COUNT(*) FROM (SELECT 1 FROM body_measurements WHERE {where} LIMIT :limit)', params)
+        if cursor.fetchone()[0] <= max_points:
+            cursor.execute(f'''
+                SELECT measured_at AS bucket, 1 AS value_count, value AS value_min, value AS value_max,
+                       value AS value_mean, value AS last_value
+                FROM body_measurements
+                WHERE {where}
+                ORDER BY measured_at
+            ''', params)
+            return 'raw', cursor.fetchall()
+        for period, bucket in _BODY_METRIC_BUCKETS.items():
+            where = (f"user_id = :user_id AND metric = :metric AND period = '{period}' "
+                     f"AND bucket BETWEEN {bucket.format(t=':start')} AND :end")
+            if period != 'month':
+                cursor.execute(f'SELECT COUNT(*) FROM (SELECT 1 FROM body_metric_rollups WHERE {where} LIMIT :limit)',
+                               params)
+                if cursor.fetchone()[0] > max_points:
+                    continue
+            cursor.execute(f'''
+                SELECT bucket, value_count, value_min, value_max, value_sum / value_count AS value_mean, last_value
+                FROM body_metric_rollups
+                WHERE {where}
+                ORDER BY bucket
+            ''', params)
+            return period, cursor.fetchall()
+
+
+@timed()
+def rebuild_body_metric_rollups(user_id=None):
+    """
+    Recomputes body_metric_rollups from body_measurements, for one user or
+    (with no user_id) for everyone, shards concurrently.
+
+    Returns:
+        int: Number of rollup rows written.
+    """
+    where, params = ('user_id = ?', (user_id,)) if user_id is not None else ('1', ())
+
+    def rebuild(conn):
+        written = 0
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute(f'DELETE FROM body_metric_rollups WHERE {where}', params)
+            for period, bucket in _BODY_METRIC_BUCKETS.items():
+                cursor.execute(f'''
+                    INSERT INTO body_metric_rollups
+                        (user_id, metric, period, bucket, value_count, value_min, value_max, value_sum, last_at,
+                         last_value)
+                    SELECT user_id, metric, '{period}', {bucket.format(t='measured_at')} AS start,
+                           COUNT(*), MIN(value), MAX(value), SUM(value), MAX(measured_at), 0
+                    FROM body_measurements
+                    WHERE {where}
+                    GROUP BY user_id, metric, start
+                ''', params)
+                written += cursor.rowcount
+            # The last reading of each bucket is a primary-key lookup on its time
+            cursor.execute(f'''
+                UPDATE body_metric_rollups SET last_value = (
+                    SELECT value FROM body_measurements m
+                    WHERE m.user_id = body_metric_rollups.user_id AND m.metric = body_metric_rollups.metric
+                      AND m.measured_at = body_metric_rollups.last_at
+                )
+                WHERE {where}
+            ''', params)
+        return written
+
+    if user_id is not None:
+        return rebuild(get_db_connection(user_id))
+    return sum(_map_shards(rebuild))
+
+
+# The next batch of raw activities older than the cutoff, oldest first
+_ACTIVITY_BATCH = 'SELECT id FROM user_activities WHERE timestamp < :cutoff ORDER BY timestamp LIMIT :limit'
+
+
+@timed()
+def compact_activity_batch(cutoff, batch_size):
+    """
+    Folds up to batch_size raw activities older than cutoff into
+    activity_daily_counts and deletes them, in one short transaction (per
+    shard, shards concurrently).
+
+    Args:
+        cutoff (str): 'YYYY-MM-DD HH:MM:SS' (UTC); older rows are compacted.
+        batch_size (int): Most rows to move per shard; bounds how long writers wait.
+
+    Returns:
+        int: Number of raw rows compacted (0 when none are left).
+    """
+    params = {'cutoff': cutoff, 'limit': batch_size}
+
+    def compact(conn):
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute('UPDATE activity_compaction_state SET compacting = 1 WHERE id = 1')
+            cursor.execute(f'''
+                INSERT INTO activity_daily_counts (user_id, day, activity_type, activity_count, first_at, last_at)
+                SELECT user_id, date(timestamp), activity_description, COUNT(*), MIN(timestamp), MAX(timestamp)
+                FROM user_activities
+                WHERE id IN ({_ACTIVITY_BATCH})
+                GROUP BY user_id, date(timestamp), activity_description
+                ON CONFLICT (user_id, day, activity_type) DO UPDATE SET
+                    activity_count = activity_count + excluded.activity_count,
+                    first_at = MIN(first_at, excluded.first_at),
+                    last_at = MAX(last_at, excluded.last_at)
+            ''', params)
+            cursor.execute(f'DELETE FROM user_activities WHERE id IN ({_ACTIVITY_BATCH})', params)
+            compacted = cursor.rowcount
+            cursor.execute('''
+                UPDATE activity_compaction_state
+                SET compacting = 0, compacted_before = MAX(COALESCE(compacted_before, ''), ?),
+                    rows_compacted = rows_compacted + ?, last_run_at = ?
+                WHERE id = 1
+            ''', (cutoff, compacted, time.time()))
+            return compacted
+
+    # A shard with a full batch left keeps the total at batch_size or more
+    return sum(_map_shards(compact))
+
+
+def get_activity_compaction_state():
+    """
+    Returns the compaction watermark (compacted_before), rows_compacted and
+    last_run_at, plus the database's auto_vacuum mode and free page count.
+    With shards, counts are summed and auto_vacuum is the lowest mode of any
+    shard.
+    """
+    def read(conn):
+        state = dict(conn.execute('SELECT * FROM activity_compaction_state WHERE id = 1').fetchone())
+        state['auto_vacuum'] = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        state['freelist_count'] = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        return state
+
+    states = _map_shards(read)
+    state = states[0]
+    for other in states[1:]:
+        state['compacted_before'] = min(state['compacted_before'] or '', other['compacted_before'] or '') or None
+        state['last_run_at'] = max(state['last_run_at'] or 0, other['last_run_at'] or 0) or None
+        state['auto_vacuum'] = min(state['auto_vacuum'], other['auto_vacuum'])
+        for key in ('compacting', 'rows_compacted', 'freelist_count'):
+            state[key] += other[key]
+    return state
+
+
+def incremental_vacuum(pages):
+    """
+    Returns up to `pages` free pages (per shard) to the filesystem.
+
+    Only possible when the database uses auto_vacuum = INCREMENTAL (new
+    databases do; see `enable_incremental_vacuum` for existing ones).
+
+    Returns:
+        int: Number of pages released.
+    """
+    def vacuum(conn):
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return 0
+        before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        # The pragma frees one page per step and sqlite3 steps a statement once
+        # per execute, so step it `pages` times inside a single transaction
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for _ in range(min(int(pages), before)):
+                conn.execute('PRAGMA incremental_vacuum(1)')
+        return before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+    return sum(_map_shards(vacuum))
+
+
+def enable_incremental_vacuum():
+    """
+    Switches an existing database (and every shard) to auto_vacuum = INCREMENTAL.
+
+    This runs a full VACUUM, which rewrites the file and holds the write lock
+    throughout; run it once in a maintenance window.
+    """
+    def vacuum(conn):
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+
+    if SQLITE_SHARD_DIR:
+        vacuum(get_db_connection())
+    _map_shards(vacuum)
+
+
+@timed()
+def get_activity_counts(user_id, start=None, end=None):
+    """
+    Daily activity counts for a user over raw and compacted activities alike.
+
+    Compacted days come from activity_daily_counts and recent days are
+    counted from user_activities; both reads are primary-key or
+    (user_id, timestamp) index ranges.
+
+    Args:
+        user_id (int): The ID of the user.
+        start (str): First day to include, 'YYYY-MM-DD'; None for no bound.
+        end (str): Last day to include, 'YYYY-MM-DD'; None for no bound.
+
+    Returns:
+        list: Rows with day, activity_type and activity_count, ordered by
+              day and activity type.
+    """
+    end = end or '9999-12-31'
+    params = {'user_id': user_id, 'start': start or '0000-00-00', 'end': end, 'until': f'{end} 23:59:59'}
+    with get_db_connection(user_id) as conn:
+        cursor = conn.cursor()
+        # A day can appear in both while a compaction run is part way through it
+        cursor.execute('''
+            SELECT day, activity_type, SUM(activity_count) AS activity_count
+            FROM (
+                SELECT day, activity_type, activity_count
+                FROM activity_daily_counts
+                WHERE user_id = :user_id AND day BETWEEN :start AND :end
+                UNION ALL
+                SELECT date(timestamp), activity_description, COUNT(*)
+                FROM user_activities
+                WHERE user_id = :user_id AND timestamp >= :start AND timestamp <= :until
+                GROUP BY date(timestamp), activity_description
+            )
+            GROUP BY day, activity_type
+            ORDER BY day, activity_type
+        ''', params)
+        return cursor.fetchall()
+
+
+def iter_user_pages(page_size=500, after_id=0):
+    """
+    Yields users rows in id order, one page (list of rows) at a time.
+
+    Pages are read with `id > last id` so each query is an index range scan
+    regardless of how far into the table it is. Shards are paged separately
+    and merged by id.
+    """
+    if SQLITE_SHARD_DIR:
+        users = _iter_sharded_users(page_size, after_id)
+        while True:
+            page = list(itertools.islice(users, page_size))
+            if not page:
+                return
+            yield page
+    while True:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM users WHERE id > ? ORDER BY id LIMIT ?', (after_id, page_size))
+            page = cursor.fetchall()
+        if not page:
+            return
+        yield page
+        after_id = page[-1]['id']
+
+
+def _iter_sharded_users(page_size, after_id):
+    """
+    Yields the users rows of every shard in id order. Each shard is read a
+    page at a time; the shards that have run dry are refilled concurrently
+    before the merge goes on, since they may hold the next lowest id.
+    """
+    def read(shard):
+        return _shard_connection(shard).execute(
+            'SELECT * FROM users WHERE id > ? ORDER BY id LIMIT ?', (last_ids[shard], page_size)
+        ).fetchall()
+
+    pending = {shard: deque() for shard in range(len(_get_shard_pools()))}
+    last_ids = dict.fromkeys(pending, after_id)
+    while pending:
+        empty = [shard for shard, rows in pending.items() if not rows]
+        for shard, rows in zip(empty, _run_concurrently(read, empty)):
+            if rows:
+                pending[shard].extend(rows)
+                last_ids[shard] = rows[-1]['id']
+            else:
+                del pending[shard]
+        while pending and all(pending.values()):
+            shard = min(pending, key=lambda shard: pending[shard][0]['id'])
+            yield pending[shard].popleft()
+
+
+# Columns a bulk import may set, in create_user's argument order
+USER_IMPORT_FIELDS = (
+    'name', 'email', 'password', 'age', 'gender', 'height', 'weight', 'medical_conditions', 'health_goals',
+)
+# Export key -> history table, each read along its (user_id, created_at) index
+_EXPORT_HISTORY = {
+    'plans': 'user_plans',
+    'workouts': 'workouts',
+    'consultations': 'consultations',
+    'recommendations': 'recommendations',
+}
+
+
+def _insert_users(cursor, users, ids=None):
+    """
+    Inserts users rows, with the given ids or AUTOINCREMENT ones, and records
+    their height and weight as the first body-metric readings.
+
+    Caller holds the write lock, so the new rows are exactly the ids above
+    the current maximum.
+    """
+    last_id = cursor.execute('SELECT COALESCE(MAX(id), 0) FROM users').fetchone()[0]
+    columns = ('id',) + USER_IMPORT_FIELDS
+    cursor.executemany(f'''
+        INSERT INTO users ({', '.join(columns)})
+        VALUES ({', '.join('?' * len(columns))})
+    ''', [(user_id, *(user.get(field) for field in USER_IMPORT_FIELDS))
+          for user_id, user in zip(ids or itertools.repeat(None), users)])
+    for metric in BODY_PROFILE_METRICS:
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO body_measurements (user_id, metric, measured_at, value)
+            SELECT id, '{metric}', ?, {metric} FROM users WHERE id > ? AND {metric} IS NOT NULL
+        ''', (int(time.time()), last_id))
+
+
+@timed()
+def create_users_bulk(users):
+    """
+    Creates many users in one transaction with executemany.
+
+    The write lock is taken up front (BEGIN IMMEDIATE), so the duplicate
+    check and the insert see the same table. A row whose email is already
+    registered, or repeats an earlier row, is skipped and reported. Height
+    and weight become the first body-metric readings, as in create_user.
+
+    With sharded storage the check and the id assignment happen in one
+    directory transaction, then each shard's users are written in one
+    transaction per shard, shards concurrently.
+
+    Args:
+        users (list): Dicts keyed by USER_IMPORT_FIELDS; missing optional
+                      fields are stored as NULL.
+
+    Returns:
+        tuple: (inserted, conflicts) where conflicts lists (index, email,
+               reason) for each skipped row, index being its position in users.
+    """
+    conflicts, accepted, seen = [], [], set()
+    registry = 'user_directory' if SQLITE_SHARD_DIR else 'users'
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        existing = set()
+        emails = [user['email'] for user in users]
+        for start in range(0, len(emails), 500):
+            chunk = emails[start:start + 500]
+            cursor.execute(f"SELECT email FROM {registry} WHERE email IN ({', '.join('?' * len(chunk))})", chunk)
+            existing.update(row['email'] for row in cursor)
+        for index, user in enumerate(users):
+            if user['email'] in existing:
+                conflicts.append((index, user['email'], 'email already registered'))
+            elif user['email'] in seen:
+                conflicts.append((index, user['email'], 'duplicate email in input'))
+            else:
+                seen.add(user['email'])
+                accepted.append(user)
+        if SQLITE_SHARD_DIR:
+            ids = _assign_user_ids(cursor, [user['email'] for user in accepted])
+        else:
+            _insert_users(cursor, accepted)
+    if SQLITE_SHARD_DIR and accepted:
+        _write_sharded_users(accepted, ids)
+    for user in accepted:
+        invalidate_user_cache(email=user['email'])
+    return len(accepted), conflicts
+
+
+def _write_sharded_users(users, ids):
+    """
+    Writes registered users to their shards concurrently. The directory
+    entries of any shard whose write fails are dropped again before the
+    error is raised.
+    """
+    by_id = dict(zip(ids, users))
+    groups = _group_by_shard(ids)
+
+    def write(shard):
+        try:
+            with _shard_connection(shard) as conn:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                _insert_users(cursor, [by_id[user_id] for user_id in groups[shard]], groups[shard])
+        except Exception as e:
+            _unregister_users(groups[shard])
+            return e
+        return None
+
+    errors = [error for error in _run_concurrently(write, list(groups)) if error is not None]
+    if errors:
+        raise errors[0]
+
+
+def iter_user_export(page_size=500, include_passwords=False):
+    """
+    Yields every user as a dict, in id order, with lists of their plans,
+    workouts, consultations and recommendations (oldest first).
+
+    Users come a page at a time from `iter_user_pages`. For each page, one
+    cursor per history table (and shard) walks the page's id range in
+    (user_id, created_at) index order and is consumed as users are yielded, so memory
+    holds one page of users and one user's history whatever the table sizes.
+
+    Args:
+        page_size (int): Users per page.
+        include_passwords (bool): Keep the password column (needed to import
+                                  the file elsewhere); dropped by default.
+    """
+    for page in iter_user_pages(page_size):
+        # Keyed by (shard, history key); a single None shard in single-file mode
+        cursors, pending = {}, {}
+        for shard, user_ids in _group_by_shard([user['id'] for user in page]).items():
+            conn = _shard_connection(shard)
+            for key, table in _EXPORT_HISTORY.items():
+                cursors[shard, key] = conn.execute(f'''
+                    SELECT * FROM {table}
+                    WHERE user_id BETWEEN ? AND ?
+                    ORDER BY user_id, created_at, id
+                ''', (user_ids[0], user_ids[-1]))
+                pending[shard, key] = next(cursors[shard, key], None)
+        for user in page:
+            record = dict(user)
+            if not include_passwords:
+                del record['password']
+            shard = get_user_shard(user['id'])
+            for key in _EXPORT_HISTORY:
+                cursor = cursors[shard, key]
+                # Rows of ids missing from the page (deleted users) are skipped
+                while pending[shard, key] is not None and pending[shard, key]['user_id'] < user['id']:
+                    pending[shard, key] = next(cursor, None)
+                history = []
+                while pending[shard, key] is not None and pending[shard, key]['user_id'] == user['id']:
+                    row = dict(pending[shard, key])
+                    del row['user_id']
+                    history.append(row)
+                    pending[shard, key] = next(cursor, None)
+                record[key] = history
+            yield record
+
+
+@timed()
+def get_latest_recommendation_hashes(user_ids):
+    """
+    Returns user_id -> profile_hash of each user's latest recommendation.
+    """
+    if not user_ids:
+        return {}
+    groups = _group_by_shard(user_ids)
+
+    def read(shard):
+        placeholders = ', '.join('?' * len(groups[shard]))
+        with _shard_connection(shard) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT user_id, profile_hash FROM recommendations r
+                WHERE user_id IN ({placeholders}) AND id = (
+                    SELECT id FROM recommendations WHERE user_id = r.user_id
+                    ORDER BY created_at DESC, id DESC LIMIT 1
+                )
+            ''', tuple(groups[shard]))
+            return {row['user_id']: row['profile_hash'] for row in cursor.fetchall()}
+
+    hashes = {}
+    for shard_hashes in _run_concurrently(read, list(groups)):
+        hashes.update(shard_hashes)
+    return hashes
+
+
+@timed()
+def save_recommendation_batch(rows, job, last_user_id, counts):
+    """
+    Inserts a batch of recommendations and advances the job checkpoint in
+    the same transaction.
+
+    With sharded storage each shard's rows are committed first and the
+    checkpoint (in the directory database) after them. A crash in between
+    repeats the batch, whose users are then skipped because their latest
+    profile hash already matches.
+
+    Args:
+        rows (list): (user_id, health_recommendation, profile_hash) tuples.
+        job (str): Job name the checkpoint belongs to.
+        last_user_id (int): Every user up to this id has been handled.
+        counts (dict): Running processed / generated / skipped / failed totals.
+    """
+    def insert(cursor, shard_rows):
+        cursor.executemany('''
+            INSERT INTO recommendations (user_id, health_recommendation, profile_hash)
+            VALUES (?, ?, ?)
+        ''', shard_rows)
+
+    if SQLITE_SHARD_DIR:
+        groups = {}
+        for row in rows:
+            groups.setdefault(get_user_shard(row[0]), []).append(row)
+
+        def write(shard):
+            with _shard_connection(shard) as conn:
+                insert(conn.cursor(), groups[shard])
+
+        _run_concurrently(write, list(groups))
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if not SQLITE_SHARD_DIR:
+            insert(cursor, rows)
+        cursor.execute('''
+            INSERT OR REPLACE INTO recommendation_job_checkpoints
+                (job, last_user_id, processed, generated, skipped, failed, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (job, last_user_id, counts['processed'], counts['generated'], counts['skipped'], counts['failed'],
+              time.time()))
+
+
+@timed()
+def get_recommendation_checkpoint(job):
+    """
+    Fetches the checkpoint row of an unfinished batch job, or None.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM recommendation_job_checkpoints WHERE job = ?', (job,))
+        return cursor.fetchone()
+
+
+@timed()
+def clear_recommendation_checkpoint(job):
+    with get_db_connection() as conn:
+        conn.execute('DELETE FROM recommendation_job_checkpoints WHERE job = ?', (job,))
+
+
+@timed()
+def get_cached_llm_response(cache_key, max_age):
+    """
+    Fetches a cached model response if it is younger than `max_age` seconds.
+
+    Args:
+        cache_key (str): Content hash identifying the prompt.
+        max_age (float): Maximum entry age in seconds.
+
+    Returns:
+        str: The cached response text, or None.
+    """
+    now = time.time()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT response FROM llm_response_cache
+            WHERE cache_key = ? AND created_at > ?
+        ''', (cache_key, now - max_age))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        cursor.execute('''
+            UPDATE llm_response_cache SET last_access = ?, hits = hits + 1
+            WHERE cache_key = ?
+        ''', (now, cache_key))
+        return row['response']
+
+
+@timed()
+def save_cached_llm_response(cache_key, model_name, response, max_entries):
+    """
+    Stores a model response and evicts the least recently used entries
+    beyond `max_entries`.
+    """
+    now = time.time()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO llm_response_cache (cache_key, model_name, response, created_at, last_access)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (cache_key, model_name, response, now, now))
+        cursor.execute('''
+            DELETE FROM llm_response_cache WHERE cache_key IN (
+                SELECT cache_key FROM llm_response_cache
+                ORDER BY last_access DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (max_entries,))
+
+
+@timed()
+def purge_llm_cache(max_age):
+    """
+    Deletes cached model responses older than `max_age` seconds.
+
+    Returns:
+        int: Number of entries removed.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM llm_response_cache WHERE created_at <= ?', (time.time() - max_age,))
+        return cursor.rowcount
+
+
+@timed()
+def save_trending_topics(topics, fetched_at, keep_seconds):
+    """
+    Stores one fetched batch of trending topics and drops batches older
+    than `keep_seconds`.
+
+    Args:
+        topics (list): Dicts with topic_name, search_volume and explore_link,
+                       in feed order.
+        fetched_at (float): Unix time of the fetch.
+        keep_seconds (float): How long superseded batches are kept.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO trending_topics (topic_name, search_volume, explore_link, position, fetched_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(t['topic_name'], t['search_volume'], t['explore_link'], i, fetched_at)
+              for i, t in enumerate(topics)])
+        cursor.execute('''
+            DELETE FROM trending_topics WHERE fetched_at < ? AND fetched_at < (SELECT MAX(fetched_at) FROM trending_topics)
+        ''', (fetched_at - keep_seconds,))
+
+
+@timed()
+def get_trending_topics():
+    """
+    Fetches the most recently stored batch of trending topics in feed order.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT topic_name, search_volume, explore_link, fetched_at FROM trending_topics
+            WHERE fetched_at = (SELECT MAX(fetched_at) FROM trending_topics)
+            ORDER BY position
+        ''')
+        return cursor.fetchall()
+
+
+@timed()
+def get_trends_refresh_state(source):
+    """
+    Fetches the last attempt / success bookkeeping for a trends source, or None.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM trends_refresh_state WHERE source = ?', (source,))
+        return cursor.fetchone()
+
+
+@timed()
+def save_trends_refresh_state(source, attempted_at, succeeded, error=None):
+    """
+    Records a refresh attempt. A success resets the failure count; a failure
+    increments it and keeps the previous last_success.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO trends_refresh_state (source, last_attempt, last_success, last_error, failures)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (source) DO UPDATE SET
+                last_attempt = excluded.last_attempt,
+                last_success = COALESCE(excluded.last_success, last_success),
+                last_error = excluded.last_error,
+                failures = CASE WHEN excluded.last_success IS NULL THEN failures + 1 ELSE 0 END
+        ''', (source, attempted_at, attempted_at if succeeded else None, error, 0 if succeeded else 1))
+
+
+@timed()
+def get_cached_pubmed(medication_keys, max_age):
+    """
+    Fetches cached PubMed payloads younger than `max_age` seconds.
+
+    Returns:
+        dict: medication_key -> payload JSON text, for the keys found.
+    """
+    if not medication_keys:
+        return {}
+    placeholders = ', '.join('?' * len(medication_keys))
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT medication_key, payload FROM pubmed_cache
+            WHERE medication_key IN ({placeholders}) AND fetched_at > ?
+        ''', (*medication_keys, time.time() - max_age))
+        return {row['medication_key']: row['payload'] for row in cursor.fetchall()}
+
+
+@timed()
+def save_cached_pubmed(payloads):
+    """
+    Stores PubMed payloads in one transaction.
+
+    Args:
+        payloads (dict): medication_key -> payload JSON text.
+    """
+    now = time.time()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT OR REPLACE INTO pubmed_cache (medication_key, payload, fetched_at)
+            VALUES (?, ?, ?)
+        ''', [(key, payload, now) for key, payload in payloads.items()])
+
+
+@timed()
+def get_user_health_data(user_id):
+    """
+    Fetches health-related data for the given user.
+
+    Args:
+        user_id (int): The ID of the user.
 
     Returns:
         dict: A dictionary containing the user's health-related data, including
               medical conditions, health goals, height, weight, etc.
     """
     try:
-        with get_db_connection() as conn:
+        with get_db_connection(user_id) as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT medical_conditions, health_goals, height, weight, age, gender, medications
-                FROM users
-                WHERE id = ?
-            ''', (user_id,))
-            result = cursor.fetchone()
+            result = get_user_by_id(user_id)
             if result:
+                # Medications live in their own table; there is no users.medications column.
+                cursor.execute('''
+                    SELECT medication_name FROM user_medications
+                    WHERE user_id = ?
+                    ORDER BY start_date, id
+                ''', (user_id,))
                 return {
                     "medical_conditions": result["medical_conditions"],
                     "health_goals": result["health_goals"],
@@ -326,14 +2693,220 @@ def get_user_health_data(user_id):
                     "weight": result["weight"],
                     "age": result["age"],
                     "gender": result["gender"],
-                    "medications": result["medications"] if result["medications"] else []  # Ensure it's a list
+                    "medications": [row["medication_name"] for row in cursor.fetchall()]
                 }
             return {}
     except Exception as e:
         print(f"Error fetching user health data: {e}")
+        record_error('db.get_user_health_data')
         return {}
-    
 
 
-# Initialize the database
-create_tables()
+# Tables holding a user's rows, with the column naming the user. Row ids are
+# per database file, so moved rows get new ones (users keep theirs);
+# user_summary, body_metric_rollups and the FTS indexes follow from the
+# triggers and _rebuild_user_summary.
+_USER_TABLES = {
+    'users': 'id',
+    'user_activities': 'user_id',
+    'user_plans': 'user_id',
+    'workouts': 'user_id',
+    'consultations': 'user_id',
+    'doctor_visits': 'user_id',
+    'recommendations': 'user_id',
+    'user_medications': 'user_id',
+    'topic_recommendations': 'user_id',
+    'body_measurements': 'user_id',
+    'activity_daily_counts': 'user_id',
+}
+
+
+def _delete_users(cursor, user_ids):
+    placeholders = ', '.join('?' * len(user_ids))
+    # users goes first: its trigger drops the summary rows, so the history
+    # triggers below find nothing to maintain
+    for table, column in _USER_TABLES.items():
+        cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({placeholders})', user_ids)
+    cursor.execute(f'DELETE FROM body_metric_rollups WHERE user_id IN ({placeholders})', user_ids)
+
+
+def get_shard_layout():
+    """
+    Returns the recorded shard_count and updated_at, plus users, the number
+    of directory entries per shard (DIRECTORY_SHARD included while a
+    single-file database is being split).
+    """
+    _get_shard_pools()
+    with _connect(_pool) as conn:
+        layout = dict(conn.execute('SELECT shard_count, updated_at FROM shard_layout WHERE id = 1').fetchone())
+        layout['users'] = dict(conn.execute('SELECT shard, COUNT(*) FROM user_directory GROUP BY shard').fetchall())
+    return layout
+
+
+def set_shard_count(shard_count):
+    """
+    Records a new shard count and reopens the shard pools, creating the
+    files of new shards. New users are placed by it at once; existing ones
+    are moved by `move_users` (see rebalance_shards.py).
+    """
+    with _connect(_pool) as conn:
+        conn.execute('''
+            INSERT INTO shard_layout (id, shard_count, updated_at) VALUES (1, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET shard_count = excluded.shard_count, updated_at = excluded.updated_at
+        ''', (shard_count, time.time()))
+    _close_shards()
+
+
+def get_directory_page(after_id=0, limit=1000):
+    """
+    Returns up to limit user_directory rows (user_id, email, shard) with
+    user_id above after_id, in id order.
+    """
+    return _connect(_pool).execute('''
+        SELECT user_id, email, shard FROM user_directory WHERE user_id > ? ORDER BY user_id LIMIT ?
+    ''', (after_id, limit)).fetchall()
+
+
+def move_users(user_ids, source, target):
+    """
+    Moves users' rows from one shard to another and repoints the directory.
+
+    Three transactions, in an order that never loses rows: copy to the
+    target (first clearing any copy an interrupted run left there), switch
+    the directory entries, delete from the source. An interruption leaves
+    extra copies only on a shard the directory does not point to, which
+    `sweep_shard` removes. Run it with the app stopped, since other processes
+    keep cached placements for up to USER_CACHE_TTL seconds.
+
+    Args:
+        user_ids (list): Users currently on source.
+        source (int): Shard to move from (DIRECTORY_SHARD for users still in
+                      the directory database).
+        target (int): Shard to move to.
+
+    Returns:
+        int: Number of rows copied.
+    """
+    user_ids = sorted(user_ids)
+    placeholders = ', '.join('?' * len(user_ids))
+    copied = 0
+    conn = _shard_connection(target)
+    conn.execute('ATTACH DATABASE ? AS source', (shard_path(source),))
+    try:
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            _delete_users(cursor, user_ids)
+            for table, column in _USER_TABLES.items():
+                columns = [row['name'] for row in cursor.execute(f'PRAGMA main.table_info({table})').fetchall()]
+                order = 'ORDER BY id' if 'id' in columns else ''
+                if table != 'users' and 'id' in columns:
+                    columns.remove('id')
+                column_list = ', '.join(columns)
+                cursor.execute(f'''
+                    INSERT INTO main.{table} ({column_list})
+                    SELECT {column_list} FROM source.{table} WHERE {column} IN ({placeholders}) {order}
+                ''', user_ids)
+                copied += cursor.rowcount
+            _rebuild_user_summary(cursor, user_ids)
+    finally:
+        conn.execute('DETACH DATABASE source')
+    with _connect(_pool) as directory:
+        directory.executemany('UPDATE user_directory SET shard = ? WHERE user_id = ?',
+                              [(target, user_id) for user_id in user_ids])
+    for user_id in user_ids:
+        _user_shards.set(user_id, target)
+        invalidate_user_cache(user_id=user_id)
+    with _shard_connection(source) as conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        _delete_users(cursor, user_ids)
+    return copied
+
+
+def sweep_shard(shard, batch_size=500):
+    """
+    Deletes the rows of users whose directory entry points to another shard,
+    as left behind by an interrupted `move_users`.
+
+    Returns:
+        int: Number of users removed from the shard.
+    """
+    removed, after_id = 0, 0
+    conn = _shard_connection(shard)
+    while True:
+        ids = [row[0] for row in conn.execute('SELECT id FROM users WHERE id > ? ORDER BY id LIMIT ?',
+                                              (after_id, batch_size)).fetchall()]
+        if not ids:
+            return removed
+        after_id = ids[-1]
+        placed = dict(_connect(_pool).execute(
+            f"SELECT user_id, shard FROM user_directory WHERE user_id IN ({', '.join('?' * len(ids))})", ids
+        ).fetchall())
+        stray = [user_id for user_id in ids if placed.get(user_id, shard) != shard]
+        if stray:
+            with conn:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                _delete_users(cursor, stray)
+            removed += len(stray)
+
+
+def import_single_database(path):
+    """
+    Starts sharded storage from an existing single-file database.
+
+    The file is copied into the (still empty) directory database, so the
+    caches, trends and job tables come along, and its users are listed under
+    DIRECTORY_SHARD for the rebalancer to move out to the shards.
+
+    Returns:
+        int: Number of users listed.
+    """
+    directory = _connect(_pool)
+    if directory.execute('SELECT COUNT(*) FROM user_directory').fetchone()[0]:
+        raise ValueError(f"{DATABASE_PATH} already lists users")
+    source = sqlite3.connect(path)
+    try:
+        source.backup(directory)
+    finally:
+        source.close()
+    apply_migrations(directory)
+    with directory:
+        cursor = directory.execute('''
+            INSERT INTO user_directory (user_id, email, shard) SELECT id, email, ? FROM users
+        ''', (DIRECTORY_SHARD,))
+    _user_shards.clear()
+    return cursor.rowcount
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Database maintenance commands.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('migrate', help="Apply pending schema migrations")
+    rebuild = commands.add_parser('rebuild-summary', help="Recompute user_summary from the base tables")
+    rebuild.add_argument('--user-id', type=int, help="Only this user (default: everyone)")
+    rollups = commands.add_parser('rebuild-body-metrics', help="Recompute body_metric_rollups from the readings")
+    rollups.add_argument('--user-id', type=int, help="Only this user (default: everyone)")
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        print(f"Schema at version {apply_migrations(_pool.acquire())} ({DATABASE_PATH})")
+        if SQLITE_SHARD_DIR:
+            versions = _map_shards(get_schema_version)
+            print(f"{len(versions)} shards at version {min(versions)} ({SQLITE_SHARD_DIR})")
+    elif args.command == 'rebuild-summary':
+        flush_pending_writes()
+        started = time.perf_counter()
+        rows = rebuild_user_summary(args.user_id)
+        print(f"Rebuilt {rows:,} user_summary rows in {time.perf_counter() - started:.2f}s")
+    elif args.command == 'rebuild-body-metrics':
+        started = time.perf_counter()
+        rows = rebuild_body_metric_rollups(args.user_id)
+        print(f"Rebuilt {rows:,} body_metric_rollups rows in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Which text model backs the app: "gemini" in production, "fake" for local runs
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')
+GEMINI_MODEL_NAME = os.getenv('GEMINI_MODEL', 'gemini-pro')
+# Simulated latency of the fake backend, in seconds
+FAKE_MODEL_DELAY = float(os.getenv('FAKE_MODEL_DELAY', '0'))
+FAKE_MODEL_TOKEN_DELAY = float(os.getenv('FAKE_MODEL_TOKEN_DELAY', '0'))
+
+
+class GeminiModel:
+    """
+    Google Generative AI model behind the `generate(prompt)` / `stream(prompt)` interface.
+    """
+
+    def __init__(self, model_name=GEMINI_MODEL_NAME):
+        import google.generativeai as genai
+
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        self.name = model_name
+        self._model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt):
+        """
+        Returns the full response text for `prompt`.
+        """
+        return self._model.generate_content(prompt).text
+
+    def stream(self, prompt):
+        """
+        Yields the response text in chunks as the model produces them.
+        """
+        for chunk in self._model.generate_content(prompt, stream=True):
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeModel:
+    """
+    Deterministic stand-in for GeminiModel, for local runs and tests.
+
+    The response is derived from the prompt, `delay` simulates generation
+    time, `token_delay` the gap between streamed chunks, and `calls` counts
+    how often the model was actually invoked.
+    """
+
+    def __init__(self, name='fake-model', delay=0.0, token_delay=0.0):
+        self.name = name
+        self.delay = delay
+        self.token_delay = token_delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _respond(self, prompt):
+        profile = prompt.splitlines()[-1]
+        return (
+            f"Recommendations for {profile}: stay active for 30 minutes a day, "
+            "eat plenty of vegetables, sleep 7-9 hours and keep regular check-ups."
+        )
+
+    def generate(self, prompt):
+        with self._lock:
+            self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return self._respond(prompt)
+
+    def stream(self, prompt):
+        """
+        Yields the `generate` response word by word; `delay` is spent before
+        the first chunk and `token_delay` before each later one.
+        """
+        with self._lock:
+            self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        for i, word in enumerate(self._respond(prompt).split(' ')):
+            if i and self.token_delay:
+                time.sleep(self.token_delay)
+            yield word if i == 0 else ' ' + word
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """
+    Returns the process-wide text model, creating it on first use.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = FakeModel(delay=FAKE_MODEL_DELAY, token_delay=FAKE_MODEL_TOKEN_DELAY) if LLM_BACKEND == 'fake' else GeminiModel()
+    return _model
+
+
+def set_model(model):
+    """
+    Replaces the process-wide text model, e.g. with a FakeModel in tests.
+    """
+    global _model
+    with _model_lock:
+        _model = model
@@ -0,0 +1,212 @@
+"""
+Condition -> medication knowledge index.
+
+The condition and medication tables are compiled once at import into
+MEDICATION_INDEX: every condition name and synonym is normalized (case-folded,
+punctuation stripped, whitespace collapsed) into a flat term table for exact
+lookups, and into a token trie for finding conditions inside free text such as
+users.medical_conditions.
+"""
+import re
+
+# Canonical condition name (as shown in the app) -> commonly prescribed medications
+MEDICATION_DATA = {
+    "obesity": ["Wegovy", "Ozempic", "Mounjaro", "Phentermine"],
+    "diabetes": ["Metformin", "Insulin", "GLP-1 Agonists", "SGLT2 Inhibitors"],
+    "high blood pressure": ["Atenolol", "Lisinopril", "Losartan", "Amlodipine"],
+    "sunset anxiety": ["Xanax", "Zoloft", "Lexapro", "Ativan"],
+    "arthritis": ["Methotrexate", "Sulfasalazine", "Humira", "Corticosteroids"],
+    "depression": ["SSRIs", "SNRIs", "Citalopram", "Sertraline", "Fluoxetine"],
+    "anxiety": ["Buspirone", "Xanax", "Ativan", "Valium"],
+    "asthma": ["Albuterol", "Salbutamol", "Advair", "Fluticasone"],
+    "COPD": ["Spiriva", "Symbicort", "Albuterol", "Fluticasone"],
+    "cholesterol": ["Statins", "Lipitor", "Atorvastatin", "Zocor"],
+    "sleep apnea": ["CPAP therapy", "BiPAP", "Oxygen therapy"],
+    "eczema": ["Topical steroids", "Hydrocortisone", "Tacrolimus"],
+    "insomnia": ["Ambien", "Melatonin", "Zolpidem"],
+    "acne": ["Benzoyl Peroxide", "Tretinoin", "Accutane", "Doxycycline"],
+    "allergies": ["Antihistamines", "Claritin", "Zyrtec", "Benadryl"],
+    "migraine": ["Sumatriptan", "Zolmitriptan", "Amitriptyline", "Topiramate"],
+    "heart disease": ["Beta-blockers", "Aspirin", "ACE inhibitors", "Statins"],
+    "gout": ["Allopurinol", "Colchicine", "Indomethacin"],
+    "cancer": ["Chemotherapy", "Immunotherapy", "Radiation therapy"],
+    "stroke": ["Aspirin", "Clopidogrel", "Warfarin"],
+    "thyroid problems": ["Levothyroxine", "Methimazole", "Liothyronine"],
+    "kidney disease": ["ACE inhibitors", "Diuretics"],
+    "liver disease": ["Antivirals", "Interferon", "Ribavirin"],
+}
+
+# Medications currently trending for a condition (Consultation page chart)
+TRENDING_MEDICATIONS = {
+    "obesity": ["Wegovy", "Ozempic"],
+    "diabetes": ["Metformin", "Insulin"],
+    "high blood pressure": ["Atenolol", "Lisinopril"],
+    "sunset anxiety": ["Xanax", "Zoloft"],
+}
+
+# Canonical condition -> other ways people write it
+CONDITION_SYNONYMS = {
+    "obesity": ["obese", "overweight", "weight gain"],
+    "diabetes": ["diabetic", "diabetes mellitus", "type 1 diabetes", "type 2 diabetes", "t1d", "t2d",
+                 "high blood sugar", "prediabetes"],
+    "high blood pressure": ["hypertension", "high bp", "hbp", "elevated blood pressure"],
+    "anxiety": ["anxiety disorder", "generalized anxiety", "gad", "panic disorder", "panic attacks"],
+    "arthritis": ["osteoarthritis", "rheumatoid arthritis", "ra", "joint pain"],
+    "depression": ["depressed", "major depression", "depressive disorder", "mdd"],
+    "asthma": ["asthmatic"],
+    "COPD": ["chronic obstructive pulmonary disease", "emphysema", "chronic bronchitis"],
+    "cholesterol": ["high cholesterol", "hyperlipidemia", "hypercholesterolemia", "dyslipidemia"],
+    "sleep apnea": ["sleep apnoea", "obstructive sleep apnea", "osa"],
+    "eczema": ["atopic dermatitis", "dermatitis"],
+    "insomnia": ["trouble sleeping", "sleeplessness", "sleep disorder"],
+    "acne": ["pimples", "acne vulgaris"],
+    "allergies": ["allergy", "allergic rhinitis", "hay fever", "seasonal allergies"],
+    "migraine": ["migraines", "migraine headaches"],
+    "heart disease": ["cardiovascular disease", "coronary artery disease", "cad", "heart failure",
+                      "heart condition"],
+    "cancer": ["tumor", "tumour", "carcinoma", "malignancy"],
+    "stroke": ["cva", "cerebrovascular accident"],
+    "thyroid problems": ["thyroid", "hypothyroidism", "hyperthyroidism", "thyroid disease"],
+    "kidney disease": ["chronic kidney disease", "ckd", "renal disease", "kidney failure"],
+    "liver disease": ["fatty liver", "hepatitis", "cirrhosis"],
+}
+
+NO_MEDICATIONS = "No specific medications found"
+
+# Upper bound on memoized raw lookup strings and matched condition texts
+MEMO_LIMIT = 100_000
+
+_NON_WORD = re.compile(r'[^0-9a-z]+')
+_END = object()  # trie key marking the end of a term
+
+
+def normalize_term(text):
+    """
+    Case-folds `text`, turns punctuation into spaces and collapses whitespace.
+    """
+    return ' '.join(_NON_WORD.sub(' ', text.casefold()).split())
+
+
+class MedicationIndex:
+    """
+    Normalized, synonym-aware lookups from condition text to medications.
+
+    Attributes:
+        conditions (list): Canonical condition names, in table order.
+    """
+
+    def __init__(self, medications=MEDICATION_DATA, synonyms=CONDITION_SYNONYMS, trending=TRENDING_MEDICATIONS):
+        self.conditions = list(medications)
+        self._medications = {condition: tuple(meds) for condition, meds in medications.items()}
+        self._trending = {condition: tuple(meds) for condition, meds in trending.items()}
+        self._terms = {}
+        self._trie = {}
+        for condition in self.conditions:
+            for term in [condition, *synonyms.get(condition, ())]:
+                self._add_term(normalize_term(term), condition)
+        self._matched = {}
+        self._resolved = {condition: condition for condition in self.conditions}
+
+    def _add_term(self, term, condition):
+        self._terms.setdefault(term, condition)
+        node = self._trie
+        for token in term.split():
+            node = node.setdefault(token, {})
+        node.setdefault(_END, condition)
+
+    def lookup(self, term):
+        """
+        Returns the canonical condition for a name or synonym, or None.
+
+        Raw strings are memoized after their first normalization, so repeat
+        lookups are a single dict hit.
+        """
+        try:
+            return self._resolved[term]
+        except KeyError:
+            pass
+        condition = self._terms.get(normalize_term(term))
+        if len(self._resolved) < MEMO_LIMIT:
+            self._resolved[term] = condition
+        return condition
+
+    def medications(self, condition):
+        """
+        Returns the medications for a condition name or synonym (empty if unknown).
+        """
+        return self._medications.get(self.lookup(condition), ())
+
+    def trending_medications(self, condition):
+        return self._trending.get(self.lookup(condition), ())
+
+    def match_conditions(self, text):
+        """
+        Finds every known condition mentioned in free text.
+
+        The token trie is walked from each token and the longest matching
+        term wins, so "type 2 diabetes and high blood pressure" yields
+        ['diabetes', 'high blood pressure'].
+
+        Returns:
+            list: Canonical conditions in order of first mention, without duplicates.
+        """
+        if not text:
+            return []
+        tokens = normalize_term(text).split()
+        found = []
+        i = 0
+        while i < len(tokens):
+            node, match, match_end = self._trie, None, i
+            for j in range(i, len(tokens)):
+                node = node.get(tokens[j])
+                if node is None:
+                    break
+                if _END in node:
+                    match, match_end = node[_END], j + 1
+            if match is None:
+                i += 1
+                continue
+            if match not in found:
+                found.append(match)
+            i = match_end
+        return found
+
+    def match_users(self, users):
+        """
+        Batch form of `match_conditions` for many users.
+
+        Identical condition strings are matched once and memoized, since many
+        users share the same few values.
+
+        Args:
+            users: Iterable of (user_id, medical_conditions) pairs or users rows.
+
+        Returns:
+            dict: user_id -> list of canonical conditions.
+        """
+        matched = {}
+        for user in users:
+            user_id, text = (user['id'], user['medical_conditions']) if hasattr(user, 'keys') else user
+            conditions = self._matched.get(text)
+            if conditions is None:
+                conditions = self.match_conditions(text)
+                if len(self._matched) < MEMO_LIMIT:
+                    self._matched[text] = conditions
+            matched[user_id] = list(conditions)
+        return matched
+
+    def recommendations(self, conditions):
+        """
+        Maps each selected condition to its medication list.
+
+        Returns:
+            dict: Condition -> list of medications, or NO_MEDICATIONS for unknown conditions.
+        """
+        recommendations = {}
+        for condition in conditions:
+            meds = self.medications(condition)
+            recommendations[condition] = list(meds) if meds else NO_MEDICATIONS
+        return recommendations
+
+
+MEDICATION_INDEX = MedicationIndex()
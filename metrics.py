@@ -0,0 +1,350 @@
+"""
+Lightweight latency instrumentation for hot paths.
+
+`timed` (decorator) and `timer` (context manager) record each call's
+duration into a per-name Histogram with fixed log-spaced buckets, plus call
+and error counts. Recording a call is two perf_counter reads and a list append;
+bucketing happens later in bulk (see Histogram).
+benchmarks/bench_metrics_overhead.py measures what that costs on the DB
+paths and on page reruns. Set METRICS_ENABLED=0 to turn every decorator into a
+plain pass-through at import time.
+
+`render_prometheus()` formats everything in the Prometheus text exposition
+format; with METRICS_TEXTFILE set, a background thread rewrites that file
+every METRICS_EXPORT_INTERVAL seconds (e.g. for node_exporter's textfile
+collector).
+"""
+import atexit
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+METRICS_TEXTFILE = os.getenv('METRICS_TEXTFILE')
+METRICS_EXPORT_INTERVAL = float(os.getenv('METRICS_EXPORT_INTERVAL', '15'))
+METRICS_PREFIX = 'precision_health'
+
+# Pending observations per histogram before they are folded into buckets
+FOLD_SIZE = 4096
+
+# Upper bounds in seconds, 2.5us .. 30s
+BUCKETS = (0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+           0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """
+    Call latencies for one instrumented function.
+
+    `observe` only appends the duration to a pending list (atomic under the
+    GIL, no lock). Pending durations are folded into the bucket counts in
+    bulk with NumPy once FOLD_SIZE have accumulated or when the histogram is
+    read, so the per-call cost is a list append and a length check.
+    """
+
+    def __init__(self, name, buckets=BUCKETS):
+        self.name = name
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.pending = []
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, error=False):
+        self.pending.append(seconds)
+        if error:
+            with self._lock:
+                self.errors += 1
+        if len(self.pending) >= FOLD_SIZE:
+            self.fold()
+
+    def add_error(self):
+        """
+        Counts an error without recording a duration.
+        """
+        with self._lock:
+            self.errors += 1
+
+    def fold(self):
+        """
+        Moves pending durations into the bucket counts.
+        """
+        import numpy as np
+
+        with self._lock:
+            n = len(self.pending)
+            if not n:
+                return
+            # Appends racing with this fold land after index n and are kept.
+            values = np.array(self.pending[:n], dtype=np.float64)
+            del self.pending[:n]
+            per_bucket = np.bincount(np.searchsorted(self.buckets, values, 'left'), minlength=len(self.counts))
+            self.counts = [c + int(b) for c, b in zip(self.counts, per_bucket)]
+            self.count += n
+            self.total += float(values.sum())
+            self.max = max(self.max, float(values.max()))
+
+    def clear(self):
+        with self._lock:
+            del self.pending[:]
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = self.errors = 0
+            self.total = self.max = 0.0
+
+    def snapshot(self):
+        self.fold()
+        with self._lock:
+            return list(self.counts), self.count, self.errors, self.total, self.max
+
+    def quantile(self, q):
+        """
+        Estimates the q-quantile (0-1) by interpolating inside its bucket.
+        """
+        counts, count, _, _, maximum = self.snapshot()
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        for i, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else maximum
+                return min(lower + (upper - lower) * (rank - seen) / bucket_count, maximum)
+            seen += bucket_count
+        return maximum
+
+    def summary(self):
+        _, count, errors, total, maximum = self.snapshot()
+        return {
+            'name': self.name,
+            'count': count,
+            'errors': errors,
+            'error_rate': errors / count if count else 0.0,
+            'mean': total / count if count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'max': maximum if count else None,
+        }
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+_collectors = []
+
+
+def get_histogram(name):
+    histogram = _histograms.get(name)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(name, Histogram(name))
+    return histogram
+
+
+def observe(name, seconds, error=False):
+    """
+    Records one duration (seconds) for `name`.
+    """
+    if METRICS_ENABLED:
+        get_histogram(name).observe(seconds, error)
+
+
+def record_error(name):
+    """
+    Counts an error for `name` without recording a duration, for @timed
+    functions that handle their own exceptions: the decorator records the
+    call, this marks it as failed.
+    """
+    if METRICS_ENABLED:
+        get_histogram(name).add_error()
+
+
+@contextmanager
+def timer(name):
+    """
+    Times the enclosed block; an exception counts as an error and is re-raised.
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+    histogram = get_histogram(name)
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        histogram.observe(time.perf_counter() - started, True)
+        raise
+    histogram.observe(time.perf_counter() - started)
+
+
+def timed(name=None):
+    """
+    Decorator recording the latency and errors of every call.
+
+    Args:
+        name (str): Metric name; defaults to "<module>.<qualified name>".
+    """
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+        histogram = get_histogram(name or f'{func.__module__}.{func.__qualname__}')
+        pending = histogram.pending
+        record = pending.append
+        clock = time.perf_counter
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = clock()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                histogram.observe(clock() - started, True)
+                raise
+            record(clock() - started)
+            if len(pending) >= FOLD_SIZE:
+                histogram.fold()
+            return result
+
+        return wrapper
+    return decorator
+
+
+def register_collector(collect):
+    """
+    Adds a callable returning {metric name: value} gauges for the export,
+    e.g. cache or pool statistics. Names are prefixed with METRICS_PREFIX.
+    """
+    _collectors.append(collect)
+
+
+def get_summaries():
+    """
+    Returns `Histogram.summary()` for every metric that has been called, by name.
+    """
+    summaries = [_histograms[name].summary() for name in sorted(_histograms)]
+    return [summary for summary in summaries if summary['count']]
+
+
+def get_gauges():
+    gauges = {}
+    for collect in _collectors:
+        try:
+            gauges.update(collect())
+        except Exception as e:
+            print(f"Error collecting metrics from {collect.__name__}: {e}")
+    return gauges
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    """
+    Formats all histograms and gauges in the Prometheus text format.
+    """
+    duration = f'{METRICS_PREFIX}_call_duration_seconds'
+    errors = f'{METRICS_PREFIX}_call_errors_total'
+    lines = [f'# HELP {duration} Latency of instrumented calls.', f'# TYPE {duration} histogram']
+    error_lines = [f'# HELP {errors} Instrumented calls that raised.', f'# TYPE {errors} counter']
+    for name in sorted(_histograms):
+        histogram = _histograms[name]
+        counts, count, error_count, total, _ = histogram.snapshot()
+        label = f'function="{_label(name)}"'
+        cumulative = 0
+        for bound, bucket_count in zip(histogram.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{duration}_bucket{{{label},le="{bound}"}} {cumulative}')
+        lines.append(f'{duration}_bucket{{{label},le="+Inf"}} {count}')
+        lines.append(f'{duration}_sum{{{label}}} {_number(total)}')
+        lines.append(f'{duration}_count{{{label}}} {count}')
+        error_lines.append(f'{errors}{{{label}}} {error_count}')
+    lines += error_lines
+    for name, value in sorted(get_gauges().items()):
+        if value is None:
+            continue
+        metric = f'{METRICS_PREFIX}_{name}'
+        lines += [f'# TYPE {metric} gauge', f'{metric} {_number(value)}']
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path):
+    """
+    Atomically writes `render_prometheus()` to `path`.
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+
+def reset():
+    """
+    Drops all recorded observations.
+    """
+    with _histograms_lock:
+        for histogram in _histograms.values():
+            histogram.clear()
+
+
+class TextfileExporter:
+    """
+    Rewrites the Prometheus text file every `interval` seconds on a daemon thread.
+    """
+
+    def __init__(self, path, interval=METRICS_EXPORT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-export', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._write()
+
+    def _write(self):
+        try:
+            write_prometheus(self.path)
+        except OSError as e:
+            print(f"Error writing metrics to {self.path}: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._write()
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def start_textfile_exporter(path=METRICS_TEXTFILE, interval=METRICS_EXPORT_INTERVAL):
+    """
+    Starts the process-wide textfile exporter once; a no-op without a path.
+    """
+    global _exporter
+    if not path or not METRICS_ENABLED:
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = TextfileExporter(path, interval).start()
+        return _exporter
@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote_plus
+
+from dotenv import load_dotenv
+
+from db import get_cached_pubmed, save_cached_pubmed
+from metrics import timed
+
+# Load environment variables
+load_dotenv()
+
+# NCBI E-utilities endpoint; point it at benchmarks/pubmed_fixture.py to run offline
+PUBMED_EUTILS_URL = os.getenv('PUBMED_EUTILS_URL', 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils')
+NCBI_API_KEY = os.getenv('NCBI_API_KEY')
+# NCBI allows 3 requests/second without an API key and 10 with one
+PUBMED_MAX_WORKERS = int(os.getenv('PUBMED_MAX_WORKERS', '3'))
+PUBMED_TIMEOUT = float(os.getenv('PUBMED_TIMEOUT', '10'))
+PUBMED_RETRIES = int(os.getenv('PUBMED_RETRIES', '3'))
+PUBMED_CACHE_TTL = float(os.getenv('PUBMED_CACHE_TTL', str(7 * 24 * 3600)))
+PUBMED_TOP_ARTICLES = int(os.getenv('PUBMED_TOP_ARTICLES', '3'))
+
+PUBMED_SEARCH_URL = 'https://pubmed.ncbi.nlm.nih.gov/?term={term}'
+PUBMED_ARTICLE_URL = 'https://pubmed.ncbi.nlm.nih.gov/{pmid}/'
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Returns the process-wide pooled session for E-utilities calls.
+
+    Connection errors and 429/5xx responses are retried with exponential
+    backoff (honouring Retry-After), and the pool is sized for
+    PUBMED_MAX_WORKERS concurrent requests.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            retry = Retry(total=PUBMED_RETRIES, backoff_factor=0.5,
+                          status_forcelist=(429, 500, 502, 503, 504), allowed_methods=('GET',))
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(PUBMED_MAX_WORKERS, 1), max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def medication_key(medication):
+    return ' '.join(medication.casefold().split())
+
+
+def search_url(medication):
+    return PUBMED_SEARCH_URL.format(term=quote_plus(medication))
+
+
+def _eutils(endpoint, params, session, timeout):
+    params = dict(params, retmode='json')
+    if NCBI_API_KEY:
+        params['api_key'] = NCBI_API_KEY
+    response = session.get(f'{PUBMED_EUTILS_URL}/{endpoint}', params=params, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+@timed()
+def fetch_evidence(medication, session=None, timeout=PUBMED_TIMEOUT, top=PUBMED_TOP_ARTICLES):
+    """
+    Looks up one medication on PubMed.
+
+    Returns:
+        dict: medication, count (total matching articles), search_url and
+              articles, a list of {pmid, title, url} for the top matches.
+    """
+    session = session or get_session()
+    found = _eutils('esearch.fcgi', {'db': 'pubmed', 'term': medication, 'retmax': top, 'sort': 'relevance'},
+                    session, timeout)['esearchresult']
+    pmids = found.get('idlist', [])
+    articles = []
+    if pmids:
+        summaries = _eutils('esummary.fcgi', {'db': 'pubmed', 'id': ','.join(pmids)}, session, timeout)['result']
+        for pmid in pmids:
+            title = summaries.get(pmid, {}).get('title')
+            if title:
+                articles.append({'pmid': pmid, 'title': title, 'url': PUBMED_ARTICLE_URL.format(pmid=pmid)})
+    return {
+        'medication': medication,
+        'count': int(found.get('count', 0)),
+        'search_url': search_url(medication),
+        'articles': articles,
+    }
+
+
+def get_medication_evidence(medications, max_workers=PUBMED_MAX_WORKERS, max_age=PUBMED_CACHE_TTL,
+                            timeout=PUBMED_TIMEOUT):
+    """
+    Returns PubMed evidence for each medication, from cache where possible.
+
+    Cached entries are read in one query; the misses are fetched concurrently
+    on at most `max_workers` threads sharing the pooled session, and the
+    successful ones are written back in one transaction. A medication whose
+    lookup fails still gets an entry with count None and its search URL, and
+    is not cached, so the next view retries it.
+
+    Args:
+        medications (list): Medication names; duplicates are looked up once.
+
+    Returns:
+        dict: Medication name -> evidence dict (see `fetch_evidence`), in input order.
+    """
+    names = list(dict.fromkeys(medications))
+    keys = {name: medication_key(name) for name in names}
+    cached = get_cached_pubmed(list(set(keys.values())), max_age)
+    evidence = {name: json.loads(cached[keys[name]]) for name in names if keys[name] in cached}
+    missing = [name for name in names if name not in evidence]
+
+    if missing:
+        session = get_session()
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(missing))),
+                                thread_name_prefix='pubmed') as executor:
+            futures = {name: executor.submit(fetch_evidence, name, session, timeout) for name in missing}
+        fetched = {}
+        for name, future in futures.items():
+            try:
+                evidence[name] = future.result()
+                fetched[keys[name]] = json.dumps(evidence[name])
+            except Exception as e:
+                logging.error(f"Error fetching PubMed evidence for {name}: {e}")
+                evidence[name] = {'medication': name, 'count': None, 'search_url': search_url(name), 'articles': []}
+        if fetched:
+            save_cached_pubmed(fetched)
+
+    return {name: evidence[name] for name in names}
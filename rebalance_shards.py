@@ -0,0 +1,173 @@
+"""
+Moves users between SQLite shards when the shard count changes.
+
+With SQLITE_SHARD_DIR set, db.py keeps each user's rows in one shard file,
+placed by a jump consistent hash of the user id, and the directory database
+records which shard every user is on. Changing the shard count therefore
+moves only the users whose placement changes (about 1/n of them when adding
+the n-th shard). They are moved in batches of --batch-size users per
+(source, target) pair; see db.move_users for how each batch stays safe to
+interrupt. A rerun picks up where an interrupted one stopped, and a final
+sweep removes any copies left on the wrong shard.
+
+The shard count is raised to the larger of the old and new counts before
+anything moves, so every shard in use stays reachable if the run stops part
+way, and lowered to the new count at the end, when the files of removed
+shards are deleted.
+
+--from starts sharded storage from an existing single-file database: it is
+copied into the empty directory database (caches, trends and job tables
+included) and its users are moved out to the shards.
+
+Stop the app while this runs: other processes cache user placements for up
+to USER_CACHE_TTL seconds and would keep writing to the old shards.
+
+Usage:
+    SQLITE_SHARD_DIR=shards python rebalance_shards.py --shards 8
+    SQLITE_SHARD_DIR=shards python rebalance_shards.py --shards 4 --from precision_health.db
+    SQLITE_SHARD_DIR=shards python rebalance_shards.py --status
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+from db import (
+    DIRECTORY_SHARD, SQLITE_SHARD_DIR, get_directory_page, get_shard_layout, get_shard_stats,
+    import_single_database, move_users, place_user, set_shard_count, shard_path, sweep_shard,
+)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_PAUSE = 0.0
+
+
+def plan_moves(shard_count, page_size=10_000):
+    """
+    Yields (user_id, source, target) for every user the directory lists on a
+    shard other than the one shard_count places them on.
+    """
+    after_id = 0
+    while True:
+        page = get_directory_page(after_id, page_size)
+        if not page:
+            return
+        for row in page:
+            target = place_user(row['user_id'], shard_count)
+            if row['shard'] != target:
+                yield row['user_id'], row['shard'], target
+        after_id = page[-1]['user_id']
+
+
+def rebalance(shard_count, batch_size=DEFAULT_BATCH_SIZE, pause=DEFAULT_PAUSE, progress=None):
+    """
+    Moves every misplaced user to its shard under shard_count shards.
+
+    Args:
+        shard_count (int): Shard count to end up with.
+        batch_size (int): Users per move_users call (one copy, directory and
+                          delete transaction each).
+        pause (float): Seconds to sleep between batches.
+        progress (callable): Called with the running report after each batch.
+
+    Returns:
+        dict: previous and new shard counts, users and rows moved, batches,
+              stray users swept, removed shard files and elapsed seconds.
+    """
+    started = time.perf_counter()
+    previous = get_shard_layout()['shard_count']
+    set_shard_count(max(previous, shard_count))
+    report = {'previous': previous, 'shards': shard_count, 'users': 0, 'rows': 0, 'batches': 0, 'swept': 0,
+              'removed_files': []}
+
+    def move(source, target, user_ids):
+        report['rows'] += move_users(user_ids, source, target)
+        report['users'] += len(user_ids)
+        report['batches'] += 1
+        if progress:
+            progress(report)
+        time.sleep(pause)
+
+    batches = {}
+    for user_id, source, target in plan_moves(shard_count):
+        batch = batches.setdefault((source, target), [])
+        batch.append(user_id)
+        if len(batch) >= batch_size:
+            move(source, target, batches.pop((source, target)))
+    for (source, target), user_ids in batches.items():
+        move(source, target, user_ids)
+
+    for shard in range(max(previous, shard_count)):
+        report['swept'] += sweep_shard(shard)
+    if DIRECTORY_SHARD not in get_shard_layout()['users']:
+        report['swept'] += sweep_shard(DIRECTORY_SHARD)
+
+    set_shard_count(shard_count)
+    for shard in range(shard_count, previous):
+        # Users without a directory entry are never moved; keep such a file
+        conn = sqlite3.connect(shard_path(shard))
+        left = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+        conn.close()
+        if left:
+            print(f"Keeping {shard_path(shard)}: {left:,} users there are not in the directory")
+            continue
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(shard_path(shard) + suffix):
+                os.remove(shard_path(shard) + suffix)
+        report['removed_files'].append(shard_path(shard))
+    report['elapsed'] = time.perf_counter() - started
+    return report
+
+
+def print_status():
+    layout = get_shard_layout()
+    print(f"{layout['shard_count']} shards in {SQLITE_SHARD_DIR}")
+    if layout['users'].get(DIRECTORY_SHARD):
+        print(f"  {layout['users'][DIRECTORY_SHARD]:,} users still in the directory database")
+    for stats in get_shard_stats():
+        listed = layout['users'].get(stats['shard'], 0)
+        print(
+            f"  shard {stats['shard']:>3}: {stats['users']:>10,} users ({listed:,} listed) "
+            f"{stats['consultations']:>10,} consultations {stats['activities']:>12,} activities "
+            f"{stats['size_bytes'] / 1e6:>9.1f} MB"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Change the number of SQLite shards and move users to match.")
+    parser.add_argument('--shards', type=int, help="Shard count to rebalance to")
+    parser.add_argument('--from', dest='source', metavar='PATH',
+                        help="Split this single-file database into the (empty) shard directory first")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Users per move")
+    parser.add_argument('--pause', type=float, default=DEFAULT_PAUSE, help="Seconds between batches")
+    parser.add_argument('--status', action='store_true', help="Print users and size per shard and exit")
+    args = parser.parse_args()
+
+    if not SQLITE_SHARD_DIR:
+        sys.exit("Set SQLITE_SHARD_DIR to the shard directory first.")
+    if args.status:
+        print_status()
+        return
+    if not args.shards or args.shards < 1:
+        parser.error("--shards must be at least 1")
+
+    if args.source:
+        listed = import_single_database(args.source)
+        print(f"Copied {args.source} into the directory database; {listed:,} users to move")
+
+    def progress(report):
+        print(f"  moved {report['users']:,} users ({report['rows']:,} rows) in {report['batches']:,} batches",
+              end='\r', flush=True)
+
+    report = rebalance(args.shards, args.batch_size, args.pause, progress)
+    if report['batches']:
+        print()
+    print(
+        f"Rebalanced {report['previous']} -> {report['shards']} shards: moved {report['users']:,} users "
+        f"({report['rows']:,} rows) in {report['batches']:,} batches, swept {report['swept']:,} stray users, "
+        f"removed {len(report['removed_files'])} shard files in {report['elapsed']:.1f}s"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, Future
+
+from db import get_cached_llm_response, save_cached_llm_response
+from llm import get_model
+from metrics import observe, timer
+
+# Persistent response cache settings
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '5000'))
+
+PROMPT_TEMPLATE = "Based on the following user profile, provide personalized health recommendations:\n{profile}"
+
+PROFILE_FIELDS = ('name', 'age', 'gender', 'weight', 'height', 'medical_conditions', 'health_goals')
+
+# Requests currently waiting on the model, keyed by cache key
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+# Timings of recent streamed generations (see get_stream_stats)
+STREAM_STATS_WINDOW = int(os.getenv('STREAM_STATS_WINDOW', '1000'))
+_stream_samples = deque(maxlen=STREAM_STATS_WINDOW)
+
+
+def build_user_profile(user):
+    """
+    Builds the profile line sent to the model.
+    """
+    return f"Name: {user['name']}, Age: {user['age']}, Gender: {user['gender']}, Weight: {user['weight']} kg, Height: {user['height']} cm, Medical Conditions: {user['medical_conditions']}, Health Goals: {user['health_goals']}"
+
+
+def normalize_profile(user):
+    """
+    Returns the profile fields in a canonical form for hashing.
+
+    Text is whitespace-collapsed and case-folded and measurements are rounded,
+    so cosmetic edits to a profile still hit the same cache entry.
+    """
+    normalized = {}
+    for field in PROFILE_FIELDS:
+        value = user[field]
+        if isinstance(value, str):
+            value = ' '.join(value.split()).casefold()
+        elif isinstance(value, float):
+            value = round(value, 1)
+        normalized[field] = value
+    return normalized
+
+
+def recommendation_cache_key(user, model_name):
+    """
+    Content hash of the model name, prompt template and normalized profile.
+    """
+    payload = json.dumps(
+        {'model': model_name, 'template': PROMPT_TEMPLATE, 'profile': normalize_profile(user)},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _claim_inflight(key):
+    """
+    Returns (future, owner) for key. The owner must resolve the future and
+    remove it from _inflight; everyone else waits on it.
+    """
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = _inflight[key] = Future()
+    return future, owner
+
+
+def get_cached_recommendation(user, model=None):
+    """
+    Returns the cached recommendation text for this profile, or None.
+    """
+    model = model or get_model()
+    return get_cached_llm_response(recommendation_cache_key(user, model.name), LLM_CACHE_TTL)
+
+
+def get_health_recommendations(user, model=None):
+    """
+    Returns personalized health recommendations for a user.
+
+    Responses are cached in SQLite by profile hash. Concurrent calls for the
+    same profile, streamed or not, share a single model call.
+
+    Args:
+        user: User row (or dict) with the PROFILE_FIELDS keys.
+        model: Object with `name` and `generate(prompt)`; defaults to `get_model()`.
+
+    Returns:
+        tuple: (recommendation text, True if it was served from the cache).
+               A call that waited on another caller's generation gets False;
+               the text is new from the model, not cached.
+    """
+    model = model or get_model()
+    key = recommendation_cache_key(user, model.name)
+
+    cached = get_cached_llm_response(key, LLM_CACHE_TTL)
+    if cached is not None:
+        return cached, True
+
+    while True:
+        future, owner = _claim_inflight(key)
+        if owner:
+            break
+        try:
+            return future.result(), False
+        except CancelledError:
+            # The owner's stream was closed early; take the call over
+            continue
+
+    try:
+        with timer('llm.generate'):
+            text = model.generate(PROMPT_TEMPLATE.format(profile=build_user_profile(user)))
+        save_cached_llm_response(key, model.name, text, LLM_CACHE_MAX_ENTRIES)
+        future.set_result(text)
+        return text, False
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+class RecommendationStream:
+    """
+    Iterates over a user's recommendation text as the model streams it.
+
+    A cached response for the profile is yielded as one chunk without calling
+    the model. If the same profile is already being generated (streamed or
+    through get_health_recommendations), the stream waits for that call and
+    yields its text as one chunk. Otherwise chunks are passed through as they
+    arrive, and the full text is written to the response cache once the
+    stream completes. Closing the stream early (e.g. the Streamlit script
+    stops because the user navigated away) closes the model's stream and
+    caches nothing; callers waiting on it then make the call themselves.
+
+    Attributes:
+        text (str): Text received so far.
+        from_cache (bool): Whether the text came from the response cache.
+        shared (bool): Whether the text came from another caller's generation.
+        completed (bool): The stream ran to the end.
+        cancelled (bool): The stream was closed before completing.
+        ttft (float): Seconds until the first chunk, or None.
+        elapsed (float): Seconds from start to completion or cancellation, or None.
+    """
+
+    def __init__(self, user, model=None):
+        self.user = user
+        self.model = model or get_model()
+        self.key = recommendation_cache_key(user, self.model.name)
+        self.text = ''
+        self.from_cache = False
+        self.shared = False
+        self.completed = False
+        self.cancelled = False
+        self.ttft = None
+        self.elapsed = None
+        self._chunks = None
+
+    def __iter__(self):
+        if self._chunks is None:
+            self._chunks = self._generate()
+        return self._chunks
+
+    def _generate(self):
+        started = time.perf_counter()
+        future = None  # set while this stream owns the in-flight call
+        cached = get_cached_llm_response(self.key, LLM_CACHE_TTL)
+        if cached is not None:
+            self.from_cache = True
+            chunks = iter([cached])
+        else:
+            while True:
+                future, owner = _claim_inflight(self.key)
+                if owner:
+                    chunks = self.model.stream(PROMPT_TEMPLATE.format(profile=build_user_profile(self.user)))
+                    break
+                try:
+                    chunks = iter([future.result()])
+                    self.shared = True
+                    future = None
+                    break
+                except CancelledError:
+                    continue
+        generated = future is not None
+        parts = []
+        error = None
+        try:
+            for chunk in chunks:
+                if self.ttft is None:
+                    self.ttft = time.perf_counter() - started
+                    if generated:
+                        observe('llm.stream.first_token', self.ttft)
+                parts.append(chunk)
+                self.text = ''.join(parts)
+                yield chunk
+            self.completed = True
+            if generated:
+                save_cached_llm_response(self.key, self.model.name, self.text, LLM_CACHE_MAX_ENTRIES)
+                future.set_result(self.text)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.elapsed = time.perf_counter() - started
+            if generated and (self.completed or error is not None):
+                observe('llm.stream', self.elapsed, error is not None)
+            if not self.completed:
+                self.cancelled = True
+                close = getattr(chunks, 'close', None)
+                if close is not None:
+                    close()
+            if generated:
+                if not future.done():
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.cancel()
+                with _inflight_lock:
+                    _inflight.pop(self.key, None)
+            _stream_samples.append((self.ttft, self.elapsed, self.from_cache, self.cancelled, self.shared))
+
+    def close(self):
+        """
+        Stops the stream if it is still running.
+        """
+        if self._chunks is not None:
+            self._chunks.close()
+
+
+def stream_health_recommendations(user, model=None):
+    """
+    Returns a RecommendationStream over the user's recommendations.
+
+    Args:
+        user: User row (or dict) with the PROFILE_FIELDS keys.
+        model: Object with `name` and `stream(prompt)`; defaults to `get_model()`.
+    """
+    return RecommendationStream(user, model)
+
+
+def get_stream_stats():
+    """
+    Summarizes the last STREAM_STATS_WINDOW streamed generations.
+
+    Returns:
+        dict: count, cached, shared, cancelled and median / max time to first
+              token and total time (seconds) over model-generated streams.
+    """
+    samples = list(_stream_samples)
+    generated = [s for s in samples if not s[2] and not s[4] and s[0] is not None]
+    ttfts = sorted(s[0] for s in generated)
+    totals = sorted(s[1] for s in generated if not s[3])
+    return {
+        'count': len(samples),
+        'cached': sum(1 for s in samples if s[2]),
+        'shared': sum(1 for s in samples if s[4]),
+        'cancelled': sum(1 for s in samples if s[3]),
+        'ttft_p50': ttfts[len(ttfts) // 2] if ttfts else None,
+        'ttft_max': ttfts[-1] if ttfts else None,
+        'total_p50': totals[len(totals) // 2] if totals else None,
+        'total_max': totals[-1] if totals else None,
+    }
@@ -0,0 +1,246 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from urllib.parse import urljoin
+
+from dotenv import load_dotenv
+
+from db import get_trending_topics, get_trends_refresh_state, save_trending_topics, save_trends_refresh_state
+from metrics import timed
+
+# Load environment variables
+load_dotenv()
+
+# Trends source and refresh schedule. Point TRENDS_URL at a local fixture
+# server (benchmarks/trends_fixture.py) to run without Google.
+TRENDS_URL = os.getenv('TRENDS_URL', 'https://trends.google.com/trending?geo=US&category=7&hours=168')
+TRENDS_REFRESH_INTERVAL = float(os.getenv('TRENDS_REFRESH_INTERVAL', '3600'))
+TRENDS_RETRY_DELAY = float(os.getenv('TRENDS_RETRY_DELAY', '30'))
+TRENDS_HTTP_TIMEOUT = float(os.getenv('TRENDS_HTTP_TIMEOUT', '10'))
+TRENDS_KEEP_SECONDS = float(os.getenv('TRENDS_KEEP_SECONDS', str(7 * 24 * 3600)))
+TRENDS_REFRESH_ENABLED = os.getenv('TRENDS_REFRESH_ENABLED', '1') == '1'
+
+TREND_COLUMNS = ['Trends', 'Search volume', 'Explore link']
+
+# pandas, requests and bs4 are imported on first use so importing this
+# module (and rendering the Consultation page from stored rows) stays cheap.
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Returns the process-wide HTTP session for trends fetches.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+
+            _session = requests.Session()
+        return _session
+
+
+def parse_trends(html, base_url=TRENDS_URL):
+    """
+    Extracts the feed items from a Google Trends "trending" page.
+
+    Args:
+        html (str): Page markup.
+        base_url (str): URL the page was fetched from; relative explore
+                        links are resolved against its origin.
+
+    Returns:
+        list: Dicts with topic_name, search_volume and explore_link, in feed order.
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    topics = []
+    for trend_item in soup.find_all('div', class_='feed-item'):
+        title = trend_item.find('div', class_='feed-item-title')
+        if title is None:
+            continue
+        stats = trend_item.find('div', class_='feed-item-stats')
+        link = trend_item.find('a', href=True)
+        topics.append({
+            'topic_name': title.text.strip(),
+            'search_volume': stats.text.strip() if stats else "N/A",
+            'explore_link': urljoin(base_url, link['href']) if link else None,
+        })
+    return topics
+
+
+@timed()
+def fetch_trends(url=TRENDS_URL, timeout=TRENDS_HTTP_TIMEOUT):
+    """
+    Downloads and parses the trends page.
+
+    Raises:
+        requests.RequestException: On connection errors, timeouts and non-200 responses.
+    """
+    response = get_session().get(url, timeout=timeout)
+    response.raise_for_status()
+    return parse_trends(response.text, url)
+
+
+def refresh_trends(url=TRENDS_URL, timeout=TRENDS_HTTP_TIMEOUT):
+    """
+    Fetches the trends page once and stores the parsed batch.
+
+    The attempt is recorded in trends_refresh_state either way. An empty
+    parse counts as a failure so a changed page layout never replaces the
+    last good batch with nothing.
+
+    Returns:
+        int: Number of topics stored.
+    """
+    attempted_at = time.time()
+    try:
+        topics = fetch_trends(url, timeout)
+        if not topics:
+            raise ValueError("no trend items found in page")
+        save_trending_topics(topics, attempted_at, TRENDS_KEEP_SECONDS)
+    except Exception as e:
+        logging.error(f"Error refreshing trends from {url}: {e}")
+        save_trends_refresh_state(url, attempted_at, False, str(e))
+        raise
+    save_trends_refresh_state(url, attempted_at, True)
+    return len(topics)
+
+
+class TrendsRefresher:
+    """
+    Keeps trending_topics fresh from a background thread.
+
+    The thread refreshes whenever the last success is older than `interval`
+    and otherwise sleeps until it will be. Failures back off exponentially
+    from `retry_delay` up to `interval`. Due times come from
+    trends_refresh_state, so several app processes sharing one database do
+    not each hit the upstream on every interval.
+    """
+
+    def __init__(self, url=TRENDS_URL, interval=TRENDS_REFRESH_INTERVAL, retry_delay=TRENDS_RETRY_DELAY,
+                 timeout=TRENDS_HTTP_TIMEOUT, name='trends-refresh'):
+        self.url = url
+        self.interval = interval
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.name = name
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.stats = {'refreshes': 0, 'failures': 0}
+        atexit.register(self.stop)
+
+    def next_due(self, now=None):
+        """
+        Unix time at which the next refresh should run.
+        """
+        now = time.time() if now is None else now
+        state = get_trends_refresh_state(self.url)
+        if state is None:
+            return now
+        due = (state['last_success'] or 0) + self.interval
+        if state['failures']:
+            backoff = min(self.retry_delay * 2 ** (state['failures'] - 1), self.interval)
+            due = max(due, state['last_attempt'] + backoff)
+        return due
+
+    def is_stale(self, now=None):
+        now = time.time() if now is None else now
+        state = get_trends_refresh_state(self.url)
+        return state is None or (state['last_success'] or 0) + self.interval <= now
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def request_refresh(self):
+        """
+        Wakes the thread to re-check whether a refresh is due. Never blocks.
+        """
+        self.start()
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                delay = self.next_due() - time.time()
+                if delay <= 0:
+                    refresh_trends(self.url, self.timeout)
+                    self.stats['refreshes'] += 1
+                    continue
+            except Exception:
+                self.stats['failures'] += 1
+                delay = self.retry_delay
+            self._wake.wait(max(delay, 0.0))
+            self._wake.clear()
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def get_refresher():
+    """
+    Returns the process-wide TrendsRefresher for TRENDS_URL, started.
+    """
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = TrendsRefresher()
+        if TRENDS_REFRESH_ENABLED:
+            _refresher.start()
+        return _refresher
+
+
+def get_trending_data():
+    """
+    Returns the stored trends as a DataFrame, revalidating in the background.
+
+    This only reads SQLite: when the stored batch is older than the refresh
+    interval the background thread is woken and the current (stale) rows are
+    returned immediately. The frame's `attrs['fetched_at']` holds the fetch
+    time of the batch, or None when nothing has been stored yet.
+    """
+    import pandas as pd
+
+    refresher = get_refresher()
+    if TRENDS_REFRESH_ENABLED and refresher.is_stale():
+        refresher.request_refresh()
+    rows = get_trending_topics()
+    df = pd.DataFrame(
+        [(row['topic_name'], row['search_volume'], row['explore_link']) for row in rows],
+        columns=TREND_COLUMNS,
+    )
+    df.attrs['fetched_at'] = rows[0]['fetched_at'] if rows else None
+    return df
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fetch Google Trends once into trending_topics.")
+    parser.add_argument('--url', default=TRENDS_URL)
+    parser.add_argument('--timeout', type=float, default=TRENDS_HTTP_TIMEOUT)
+    args = parser.parse_args()
+    print(f"Stored {refresh_trends(args.url, args.timeout)} topics from {args.url}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Bulk user import from CSV/JSONL and streaming JSONL export.
+
+Import reads the file lazily (csv.DictReader or one JSON object per line) and
+hands it to db.create_users_bulk in chunks, each one executemany transaction.
+Rows with a registered or repeated email, or with missing or malformed fields,
+are reported by line and skipped; the rest of the file still loads.
+
+Export writes one JSON object per user, with their plans, workouts,
+consultations and recommendations, straight from db.iter_user_export, so
+memory stays flat however many users and rows there are. Passwords are left
+out unless --include-passwords is given, and an export without them cannot be
+imported again.
+
+Usage:
+    python user_transfer.py import clinic_users.csv --chunk-size 1000
+    python user_transfer.py export users.jsonl --include-passwords
+"""
+import argparse
+import csv
+import itertools
+import json
+import sys
+import time
+
+from db import USER_IMPORT_FIELDS, create_users_bulk, iter_user_export
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_PAGE_SIZE = 500
+REQUIRED_FIELDS = ('name', 'email', 'password')
+NUMERIC_FIELDS = {'age': int, 'height': float, 'weight': float}
+
+
+def read_records(f, file_format):
+    """
+    Yields (line number, record dict) pairs from a CSV (with a header row) or
+    JSONL file; a JSONL line that is not valid JSON yields None.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(f)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except json.JSONDecodeError:
+                yield line_number, None
+
+
+def clean_record(record):
+    """
+    Returns the USER_IMPORT_FIELDS of a record, stripped, with numbers
+    converted (blank ones to None), or raises ValueError naming the problem.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("not a JSON object")
+    user = {}
+    for field in USER_IMPORT_FIELDS:
+        value = record.get(field)
+        if isinstance(value, str):
+            value = value.strip()
+        if field in NUMERIC_FIELDS and value is not None:
+            if value == '':
+                value = None
+            else:
+                try:
+                    value = NUMERIC_FIELDS[field](value)
+                except (TypeError, ValueError):
+                    raise ValueError(f"{field} is not a number: {value!r}")
+        user[field] = value
+    missing = [field for field in REQUIRED_FIELDS if not user[field]]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    return user
+
+
+def import_users(f, file_format, chunk_size=DEFAULT_CHUNK_SIZE, on_conflict=None):
+    """
+    Imports users from an open CSV or JSONL file in chunked transactions.
+
+    Args:
+        f: Text file object.
+        file_format (str): 'csv' or 'jsonl'.
+        chunk_size (int): Users per transaction.
+        on_conflict (callable): Called with (line number, email, reason) for
+                                each skipped row.
+
+    Returns:
+        dict: rows, inserted, skipped and elapsed seconds.
+    """
+    started = time.perf_counter()
+    rows = inserted = skipped = 0
+    records = read_records(f, file_format)
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            break
+        rows += len(chunk)
+        users, lines, problems = [], [], []
+        for line_number, record in chunk:
+            try:
+                users.append(clean_record(record))
+                lines.append(line_number)
+            except ValueError as e:
+                problems.append((line_number, record.get('email') if isinstance(record, dict) else None, str(e)))
+        count, conflicts = create_users_bulk(users)
+        problems += [(lines[index], email, reason) for index, email, reason in conflicts]
+        inserted += count
+        skipped += len(problems)
+        if on_conflict:
+            for problem in sorted(problems):
+                on_conflict(*problem)
+    return {'rows': rows, 'inserted': inserted, 'skipped': skipped, 'elapsed': time.perf_counter() - started}
+
+
+def export_users(f, page_size=DEFAULT_PAGE_SIZE, include_passwords=False):
+    """
+    Writes every user with their history to f as JSONL.
+
+    Returns:
+        int: Number of users written.
+    """
+    written = 0
+    for record in iter_user_export(page_size, include_passwords):
+        f.write(json.dumps(record))
+        f.write('\n')
+        written += 1
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import users from CSV/JSONL or export them as JSONL.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    importer = commands.add_parser('import', help="Create users from a CSV or JSONL file")
+    importer.add_argument('path', help="CSV with a header row, or JSONL ('-' for stdin)")
+    importer.add_argument('--format', choices=['csv', 'jsonl'], help="Default: from the file extension")
+    importer.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Users per transaction")
+    exporter = commands.add_parser('export', help="Write users and their history as JSONL")
+    exporter.add_argument('path', help="Output file ('-' for stdout)")
+    exporter.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE)
+    exporter.add_argument('--include-passwords', action='store_true')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        file_format = args.format or ('csv' if args.path.lower().endswith('.csv') else 'jsonl')
+
+        def report(line_number, email, reason):
+            print(f"line {line_number} ({email}): {reason}", file=sys.stderr)
+
+        f = sys.stdin if args.path == '-' else open(args.path, newline='', encoding='utf-8')
+        with f:
+            result = import_users(f, file_format, args.chunk_size, report)
+        print(
+            f"Imported {result['inserted']:,} of {result['rows']:,} users ({result['skipped']:,} skipped) "
+            f"in {result['elapsed']:.1f}s"
+        )
+    else:
+        started = time.perf_counter()
+        f = sys.stdout if args.path == '-' else open(args.path, 'w', encoding='utf-8')
+        with f:
+            written = export_users(f, args.page_size, args.include_passwords)
+        print(f"Exported {written:,} users in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
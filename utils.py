@@ -1,5 +1,9 @@
+import os
 import streamlit as st
 
+# Comma-separated emails allowed to see operator pages
+ADMIN_EMAILS = {email.strip().casefold() for email in os.getenv('ADMIN_EMAILS', '').split(',') if email.strip()}
+
 def apply_custom_css():
     st.markdown("""
         <style>
@@ -46,3 +50,12 @@ def verify_user_session():
     if 'logged_in' not in st.session_state or not st.session_state['logged_in']:
         st.error("You need to log in to access this page.")
         st.stop()
+
+def is_admin(email):
+    return bool(email) and email.casefold() in ADMIN_EMAILS
+
+def verify_admin_session():
+    verify_user_session()
+    if not is_admin(st.session_state.get('email')):
+        st.error("This page is only available to administrators.")
+        st.stop()
@@ -0,0 +1,195 @@
+import atexit
+import queue
+import threading
+import time
+
+
+class WriteBehindWriter:
+    """
+    Batches INSERT statements onto a background writer thread.
+
+    Callers enqueue `(sql, params)` pairs and return immediately. The writer
+    thread groups pending rows by statement and writes each group with a single
+    `executemany` inside one transaction, so many log rows share one commit
+    (and one fsync). A batch is flushed when it reaches `max_batch` rows or
+    when `flush_interval` seconds have passed since its first row.
+
+    The queue is bounded by `max_pending`. When it is full, `submit` waits up to
+    `put_timeout` seconds for the writer to catch up and then writes the row
+    synchronously on the caller's thread, so memory stays bounded and no row
+    is dropped. That write is wrapped in a savepoint rather than its own
+    transaction, so a transaction the caller has open is neither committed
+    nor rolled back by it.
+    """
+
+    _STOP = object()
+
+    def __init__(self, connect, max_batch=500, flush_interval=0.5, max_pending=10000,
+                 put_timeout=0.05, enabled=True, name='write-behind'):
+        """
+        Args:
+            connect (callable): Returns the SQLite connection to write with.
+                                Called on the writer thread and, for synchronous
+                                fallbacks, on the caller's thread.
+            max_batch (int): Maximum rows per transaction.
+            flush_interval (float): Maximum seconds a row waits before being written.
+            max_pending (int): Maximum queued rows before backpressure applies.
+            put_timeout (float): Seconds to wait for queue space before writing synchronously.
+            enabled (bool): When False, every row is written synchronously.
+            name (str): Writer thread name.
+        """
+        self.connect = connect
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.enabled = enabled
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'enqueued': 0, 'written': 0, 'batches': 0, 'sync_writes': 0, 'errors': 0}
+        atexit.register(self.close)
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, sql, params):
+        """
+        Queues one statement for writing, falling back to a synchronous write.
+
+        Args:
+            sql (str): Parameterized INSERT statement.
+            params (tuple): Statement parameters.
+        """
+        if self.enabled:
+            self._ensure_started()
+            try:
+                self._queue.put((sql, params), timeout=self.put_timeout)
+                self._count('enqueued')
+                return
+            except queue.Full:
+                pass
+        self._count('sync_writes')
+        self._write_sync(sql, params)
+
+    def flush(self, timeout=5.0):
+        """
+        Blocks until every row queued before this call has been written.
+
+        Returns:
+            bool: True if the writer confirmed the flush within `timeout`.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout=5.0):
+        """
+        Writes everything still queued and stops the writer thread.
+        """
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(self._STOP)
+        thread.join(timeout)
+
+    def stats(self):
+        """
+        Returns a snapshot of the writer counters plus the current queue depth.
+        """
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot['pending'] = self._queue.qsize()
+        return snapshot
+
+    def _write(self, rows):
+        # Group rows by statement so each group is one executemany.
+        groups = {}
+        for sql, params in rows:
+            groups.setdefault(sql, []).append(params)
+        conn = self.connect()
+        try:
+            with conn:
+                for sql, params_list in groups.items():
+                    conn.executemany(sql, params_list)
+            self._count('written', len(rows))
+            self._count('batches')
+        except Exception as e:
+            print(f"Error writing batch of {len(rows)} rows, retrying individually: {e}")
+            for sql, params in rows:
+                try:
+                    with conn:
+                        conn.execute(sql, params)
+                    self._count('written')
+                except Exception as row_error:
+                    self._count('errors')
+                    print(f"Error writing row: {row_error}")
+
+    def _write_sync(self, sql, params):
+        # The caller's connection may be inside its own transaction: the
+        # savepoint joins it (or commits on release when there is none), and a
+        # failure rolls back only this row.
+        conn = self.connect()
+        conn.execute('SAVEPOINT write_behind_sync')
+        try:
+            conn.execute(sql, params)
+            self._count('written')
+        except Exception as e:
+            conn.execute('ROLLBACK TO write_behind_sync')
+            self._count('errors')
+            print(f"Error writing row: {e}")
+        finally:
+            conn.execute('RELEASE write_behind_sync')
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            batch, waiters = [], []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is self._STOP:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if stopping or waiters or len(batch) >= self.max_batch:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if stopping:
+                # Drain whatever arrived before the stop marker was taken.
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(item, threading.Event):
+                        waiters.append(item)
+                    elif item is not self._STOP:
+                        batch.append(item)
+            if batch:
+                self._write(batch)
+            for waiter in waiters:
+                waiter.set()